@@ -1,16 +1,47 @@
 ﻿import os
+import base64
+import bisect
+import gzip
+import hashlib
+import heapq
+import hmac
+import io
+import json
+import math
+import mimetypes
 import pandas as pd
+import queue
+import random
 import re
 import requests
+import smtplib
+import threading
+import time
 import urllib3
-from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+import zlib
+from collections import OrderedDict
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import date, datetime, timedelta
+from flask import (Flask, render_template, request, redirect, url_for, flash, jsonify, session, make_response,
+                   stream_with_context, send_file, abort)
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_session import Session
 from flask_mail import Mail, Message
-from sqlalchemy import text
+from sqlalchemy import event, text
+from sqlalchemy.exc import DatabaseError, SQLAlchemyError
+
+try:
+    import brotli   # optional: Content-Encoding br for the inventory API, gzip otherwise
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image   # optional: resized thumbnails; without it the cached original is served
+except ImportError:
+    Image = None
 
 # Suppress InsecureRequestWarning for local dev if SSL certs are missing
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -22,11 +53,6 @@ app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev_key')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SQLALCHEMY_DATABASE_URI', 'sqlite:///inventory.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-# --- Session Config (Shopping Cart) ---
-app.config["SESSION_TYPE"] = "filesystem"
-app.config["SESSION_PERMANENT"] = False
-Session(app)
-
 # --- Email Config (SMTP2GO) ---
 app.config['MAIL_SERVER'] = os.environ.get("SMTP_HOST", "mail.smtp2go.com")
 app.config['MAIL_PORT'] = int(os.environ.get("SMTP_PORT", 2525))
@@ -35,6 +61,10 @@ app.config['MAIL_PASSWORD'] = os.environ.get("SMTP_PASS")
 app.config['MAIL_USE_TLS'] = True
 app.config['MAIL_USE_SSL'] = False
 app.config['MAIL_DEFAULT_SENDER'] = os.environ.get("FROM_EMAIL", "sales@fludmedia.com")
+# Quote requests go here; without ADMIN_EMAIL they land in the sending mailbox rather than nowhere
+ADMIN_EMAIL = os.environ.get("ADMIN_EMAIL") or app.config['MAIL_DEFAULT_SENDER']
+if not os.environ.get("ADMIN_EMAIL"):
+    print(f"⚠️ ADMIN_EMAIL is not set; quote requests will be sent to {ADMIN_EMAIL}", flush=True)
 
 mail = Mail(app)
 db = SQLAlchemy(app)
@@ -42,6 +72,29 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# --- Session Config (Shopping Cart) ---
+# Server-side sessions shared by both gunicorn workers (and any extra containers): a 'sessions' table in the
+# app database by default, or any Redis-protocol server with SESSION_BACKEND=redis + SESSION_REDIS_URL.
+# A session is only written back when a view changed it (mutating a nested cart? set session.modified).
+# SQL rows don't expire by themselves; sweep_expired_sessions() deletes them in batches in the background.
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'sqlalchemy').lower()
+app.config["SESSION_PERMANENT"] = False
+app.config["SESSION_REFRESH_EACH_REQUEST"] = False
+app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(days=int(os.environ.get('SESSION_LIFETIME_DAYS', 14)))
+if SESSION_BACKEND == 'redis':
+    import redis   # only needed for this backend
+    app.config["SESSION_TYPE"] = "redis"
+    app.config["SESSION_REDIS"] = redis.from_url(os.environ.get('SESSION_REDIS_URL', 'redis://localhost:6379/0'))
+elif SESSION_BACKEND == 'sqlalchemy':
+    app.config["SESSION_TYPE"] = "sqlalchemy"
+    app.config["SESSION_SQLALCHEMY"] = db
+else:
+    app.config["SESSION_TYPE"] = SESSION_BACKEND   # e.g. 'filesystem' for a throwaway local run
+Session(app)
+SessionRecord = getattr(app.session_interface, 'sql_session_model', None)
+if SessionRecord is not None:
+    db.Index('ix_sessions_expiry', SessionRecord.__table__.c.expiry)
+
 # --- Database Models ---
 
 class User(UserMixin, db.Model):
@@ -49,6 +102,9 @@ class User(UserMixin, db.Model):
     username = db.Column(db.String(150), unique=True, nullable=False)
     password_hash = db.Column(db.String(200), nullable=False)
     is_admin = db.Column(db.Boolean, default=False)
+    # Bumped on every Card/Settings write of this user (see bump_inventory_version); keys storefront caches
+    inventory_version = db.Column(db.Integer, default=0)
+    inventory_updated_at = db.Column(db.DateTime)
     cards = db.relationship('Card', backref='owner', lazy=True, cascade="all, delete-orphan")
     sales = db.relationship('Sale', backref='seller', lazy=True, cascade="all, delete-orphan")
     settings = db.relationship('Settings', backref='owner', uselist=False, cascade="all, delete-orphan")
@@ -83,7 +139,25 @@ class CardReference(db.Model):
     # NEW: Phase 1 - Track if this is a species you are actively chasing
     is_favorite = db.Column(db.Boolean, default=False)
     # NEW: Phase 1.5 - Track all available finishes for this card
+    # (display/sync copy; slot logic reads the normalized finish_rows)
     available_finishes = db.Column(db.String(255), default="Normal")
+    finish_rows = db.relationship(
+        'CardReferenceFinish', viewonly=True, order_by='CardReferenceFinish.finish_code',
+        primaryjoin='CardReference.id == foreign(CardReferenceFinish.reference_id)'
+    )
+
+    # Normalized match keys (see normalize_name / normalize_number), kept in sync on write
+    name_key = db.Column(db.String(150))
+    number_key = db.Column(db.String(20))
+
+    # Price cache: compact JSON of TCGPlayer tiers per finish, refreshed by syncs (see PRICE_CACHE_TTL)
+    prices = db.Column(db.Text)
+    prices_updated_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_card_reference_name_number', 'name_key', 'number_key'),
+        db.Index('ix_card_reference_set_number', 'set_id', 'number_key'),
+    )
 
 class MasterTracker(db.Model):
     """Tracks the umbrella species you are hunting (e.g. 'Meowth') to group all wildcards."""
@@ -116,69 +190,2833 @@ class Card(db.Model):
     grade = db.Column(db.String(20), nullable=True)           # 10, 9.5, 9
     cert_number = db.Column(db.String(100), nullable=True)    # Certification ID
 
-    # New: 1st Edition Toggle
-    is_first_edition = db.Column(db.Boolean, default=False)
+    # New: 1st Edition Toggle
+    is_first_edition = db.Column(db.Boolean, default=False)
+
+    last_updated = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Normalized match keys for linking to CardReference
+    name_key = db.Column(db.String(150))
+    number_key = db.Column(db.String(50))
+    # Canonical finish (FINISH_CODES), derived from the free-text finish on write
+    finish_code = db.Column(db.Integer)
+
+    __table_args__ = (
+        db.Index('ix_card_name_number', 'name_key', 'number_key'),
+        db.Index('ix_card_user_reference_finish_code', 'user_id', 'reference_id', 'finish_code'),
+        db.Index('ix_card_user_quantity', 'user_id', 'quantity'),
+        # Storefront keyset pagination: one index per sort order, id breaks ties
+        db.Index('ix_card_user_price_id', 'user_id', 'price', 'id'),
+        db.Index('ix_card_user_name_id', 'user_id', 'card_name', 'id'),
+        db.Index('ix_card_user_set_id', 'user_id', 'set_name', 'id'),
+        # Trade tool type-ahead: prefix range scans on the normalized name within one user's cards
+        db.Index('ix_card_user_name_key', 'user_id', 'name_key'),
+    )
+
+class Sale(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    card_name = db.Column(db.String(150), nullable=False)
+    set_name = db.Column(db.String(100))
+    sale_price = db.Column(db.Float, default=0.0)
+    quantity = db.Column(db.Integer, default=1)
+    sale_date = db.Column(db.DateTime, default=datetime.utcnow)
+
+class OutboxEmail(db.Model):
+    """Outgoing email. Requests only insert rows (queue_email); the outbox sender thread delivers them."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50))                          # quote_admin, quote_customer, ...
+    recipients = db.Column(db.Text, nullable=False)          # JSON list
+    subject = db.Column(db.String(300), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    reply_to = db.Column(db.String(200))
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claimed_by = db.Column(db.String(40))                    # claim token of the worker sending it
+    claimed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_outbox_email_due', 'status', 'next_attempt_at'),
+    )
+
+class BackgroundJob(db.Model):
+    """Progress record for long-running work (catalog sync, ...) so any worker can report on it."""
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False, index=True)
+    status = db.Column(db.String(20), default='running', nullable=False)  # running, done, failed
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    total = db.Column(db.Integer, default=0)
+    done = db.Column(db.Integer, default=0)
+    message = db.Column(db.String(500))
+    detail = db.Column(db.Text)  # JSON blob (failed pages, per-item errors...)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'total': self.total or 0,
+            'done': self.done or 0,
+            'percent': int(((self.done or 0) / self.total) * 100) if self.total else 0,
+            'message': self.message,
+            'detail': json.loads(self.detail) if self.detail else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+class CatalogChange(db.Model):
+    """Append-only feed of CardReference ids touched by any writer (filled by SQLite triggers)."""
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = db.Column(db.Integer, primary_key=True)
+    ref_id = db.Column(db.String(50), nullable=False)
+
+class PriceHistory(db.Model):
+    """Append-only market price samples. One row per (reference, TCGPlayer price tier, day),
+    written only when the price moved. day = date.toordinal(), cents = market price * 100."""
+    reference_id = db.Column(db.String(50), primary_key=True)
+    finish = db.Column(db.String(30), primary_key=True)   # API tier key, e.g. 'reverseHolofoil'
+    day = db.Column(db.Integer, primary_key=True)
+    cents = db.Column(db.Integer, nullable=False)
+
+class CardReferenceFinish(db.Model):
+    """Normalized available finishes: one row per (reference, FINISH_CODES value)."""
+    reference_id = db.Column(db.String(50), primary_key=True)
+    finish_code = db.Column(db.Integer, primary_key=True)
+
+    @property
+    def label(self):
+        return FINISH_LABELS.get(self.finish_code, 'Unknown')
+
+class CardSpecies(db.Model):
+    """Reference -> species mapping extracted from card names at ingest (see extract_species).
+    Tag-team cards map to every partner; trainers just map to whatever their name reduces to."""
+    species = db.Column(db.String(100), primary_key=True)   # lowercase, e.g. 'meowth', 'mr. mime'
+    reference_id = db.Column(db.String(50), primary_key=True, index=True)
+
+class CompletionCounter(db.Model):
+    """Materialized Pokedex completion. scope 'species' is keyed by MasterTracker.species_name, 'set' by set_id.
+    user_id 0 holds the catalog's total slots; every other row holds that user's owned slots."""
+    user_id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(10), primary_key=True)
+    key = db.Column(db.String(100), primary_key=True)
+    slots = db.Column(db.Integer, default=0, nullable=False)
+
+class HuntCache(db.Model):
+    """Compact hunt list per (user, species key), rebuilt on demand after invalidate_hunt_cache drops it."""
+    user_id = db.Column(db.Integer, primary_key=True)
+    species = db.Column(db.String(100), primary_key=True)   # species_key, same as CardSpecies.species
+    targets = db.Column(db.Text, nullable=False)             # JSON, see build_hunt_targets
+    etag = db.Column(db.String(40), nullable=False)
+    built_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class TradeSlot(db.Model):
+    """Reverse index for trade matching: side 'have' = the user has a card of this slot in stock (storefront),
+    side 'want' = the slot belongs to a tracked species and the user owns no card of it (hunt list)."""
+    user_id = db.Column(db.Integer, primary_key=True)
+    side = db.Column(db.String(4), primary_key=True)
+    reference_id = db.Column(db.String(50), primary_key=True)
+    finish_code = db.Column(db.Integer, primary_key=True)
+
+    __table_args__ = (
+        db.Index('ix_trade_slot_lookup', 'reference_id', 'finish_code', 'side'),
+    )
+
+class PosTicket(db.Model):
+    """One POS transaction. Lines live in PosLine; the totals here are maintained by pos_add_line /
+    pos_remove_line with relative UPDATEs, never re-summed."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    status = db.Column(db.String(20), default='open', nullable=False)   # open, completed, void
+    total_out = db.Column(db.Float, default=0.0, nullable=False)       # customer receives (we sell)
+    total_in = db.Column(db.Float, default=0.0, nullable=False)        # customer gives (trade-in credit)
+    item_count = db.Column(db.Integer, default=0, nullable=False)      # units across all lines
+    version = db.Column(db.Integer, default=0, nullable=False)         # bumped by every line change
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_pos_ticket_user_status', 'user_id', 'status'),
+    )
+
+    def totals(self):
+        return {'out': round(self.total_out, 2), 'in': round(self.total_in, 2),
+                'net': round(self.total_out - self.total_in, 2), 'items': self.item_count, 'version': self.version}
+
+class PosLine(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    ticket_id = db.Column(db.Integer, db.ForeignKey('pos_ticket.id'), nullable=False)
+    direction = db.Column(db.String(3), nullable=False)      # 'out' (selling) or 'in' (trade-in)
+    card_id = db.Column(db.Integer, nullable=True)           # inventory card sold (out lines)
+    reference_id = db.Column(db.String(50), nullable=True)   # dictionary card taken in (in lines)
+    name = db.Column(db.String(200), nullable=False)
+    base_price = db.Column(db.Float, default=0.0)
+    multiplier = db.Column(db.Float, default=1.0)
+    price = db.Column(db.Float, default=0.0)                 # per unit: base_price * multiplier
+    quantity = db.Column(db.Integer, default=1, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_pos_line_ticket', 'ticket_id', 'direction', 'card_id'),
+    )
+
+    def to_dict(self):
+        return {'id': self.id, 'direction': self.direction, 'card_id': self.card_id, 'reference_id': self.reference_id,
+                'name': self.name, 'base_price': self.base_price, 'multiplier': self.multiplier,
+                'price': self.price, 'quantity': self.quantity}
+
+# --- Match Keys ---
+
+def normalize_name(name):
+    """Strips suffixes like ' - 107/088' or ' (Delta Species)'"""
+    if not name: return ""
+    # Remove everything after a dash, parenthesis, or hash symbol
+    clean = re.split(r' \-| \(| #', name)[0]
+    return clean.strip().lower()
+
+def normalize_number(num):
+    """Converts #074/132 -> 74, #SM51 -> sm51, #013 -> 13"""
+    if not num: return ""
+    num = str(num).replace('#', '').split('/')[0]
+    # Remove leading zeros from the numeric part (e.g., 008 -> 8) but keep letter prefixes
+    match = re.search(r'([a-zA-Z]*)(0*)(\d+)', num)
+    if match:
+        prefix, zeros, digits = match.groups()
+        return f"{prefix}{digits}".strip().lower()
+    return num.strip().lower()
+
+@event.listens_for(CardReference, 'before_insert')
+@event.listens_for(CardReference, 'before_update')
+def _fill_reference_keys(mapper, connection, target):
+    target.name_key = normalize_name(target.name)
+    target.number_key = normalize_number(target.number)
+
+@event.listens_for(Card, 'before_insert')
+@event.listens_for(Card, 'before_update')
+def _fill_card_keys(mapper, connection, target):
+    target.name_key = normalize_name(target.card_name)
+    target.number_key = normalize_number(target.card_number)
+    target.finish_code = finish_code(target.finish)
+    if target.price is None:
+        target.price = 0.0   # keyset pagination compares on price, NULL would drop the card
+
+def bump_inventory_version(session, user_ids):
+    """Marks these users' storefront data as changed (see Storefront Cache). Safe inside flush hooks; caller commits."""
+    ids = sorted({u for u in user_ids if u})
+    if not ids:
+        return
+    table = User.__table__
+    session.connection().execute(table.update().where(table.c.id.in_(ids)).values(
+        inventory_version=db.func.coalesce(table.c.inventory_version, 0) + 1,
+        inventory_updated_at=datetime.utcnow(),
+    ))
+
+MATCH_CHUNK_SIZE = 500
+
+def _set_matches(set_clean, ref):
+    """Same rule as the old ilike('%set%'), plus an exact set code hit (paste imports use codes)."""
+    if not set_clean:
+        return True
+    return set_clean in (ref.set_name or "").lower() or set_clean == (ref.set_id or "").lower()
+
+def match_references_bulk(items):
+    """
+    BATCH REFERENCE MATCHER
+    - items: iterable of (item_key, card_name, set_name, card_number)
+    - Loads only the catalog rows sharing a name_key with the batch, once, into hash maps.
+    - Tier 1: name_key + number_key (+ set). Tier 2: name_key + set.
+    - More than one candidate in a tier is reported as ambiguous and left unlinked.
+    Returns (matches {item_key: ref_id}, report {'matched', 'ambiguous', 'unmatched'}).
+    """
+    prepared = []
+    for item_key, card_name, set_name, card_number in items:
+        prepared.append((
+            item_key, card_name, set_name,
+            normalize_name(card_name), (set_name or "").strip().lower(), normalize_number(card_number)
+        ))
+
+    name_keys = list({p[3] for p in prepared if p[3]})
+    by_name = {}
+    by_name_number = {}
+    for start in range(0, len(name_keys), MATCH_CHUNK_SIZE):
+        rows = db.session.query(
+            CardReference.id, CardReference.name_key, CardReference.number_key,
+            CardReference.set_name, CardReference.set_id
+        ).filter(CardReference.name_key.in_(name_keys[start:start + MATCH_CHUNK_SIZE])).all()
+        for ref in rows:
+            by_name.setdefault(ref.name_key, []).append(ref)
+            by_name_number.setdefault((ref.name_key, ref.number_key), []).append(ref)
+
+    matches = {}
+    report = {'matched': 0, 'ambiguous': [], 'unmatched': []}
+    for item_key, card_name, set_name, name_key, set_clean, num_key in prepared:
+        candidates = []
+        if num_key:
+            candidates = [r for r in by_name_number.get((name_key, num_key), []) if _set_matches(set_clean, r)]
+        if not candidates:
+            candidates = [r for r in by_name.get(name_key, []) if _set_matches(set_clean, r)]
+
+        if len(candidates) > 1 and set_clean:
+            # "Base" is contained in "Base Set 2" too; an exact set name/code hit wins
+            exact = [r for r in candidates if set_clean in ((r.set_name or "").lower(), (r.set_id or "").lower())]
+            if len(exact) == 1:
+                candidates = exact
+
+        if len(candidates) == 1:
+            matches[item_key] = candidates[0].id
+            report['matched'] += 1
+        elif candidates:
+            report['ambiguous'].append({
+                'key': item_key, 'name': card_name, 'set': set_name,
+                'candidates': sorted(r.id for r in candidates)
+            })
+        else:
+            report['unmatched'].append({'key': item_key, 'name': card_name, 'set': set_name})
+    return matches, report
+
+def match_reference(card_name, set_name=None, card_number=None):
+    """Single-card convenience wrapper around match_references_bulk."""
+    matches, _ = match_references_bulk([(0, card_name, set_name, card_number)])
+    return db.session.get(CardReference, matches[0]) if 0 in matches else None
+
+def link_references_bulk(cards):
+    """Matches a batch of Card rows and writes all links with one executemany UPDATE."""
+    matches, report = match_references_bulk(
+        (c.id, c.card_name, c.set_name, c.card_number) for c in cards
+    )
+    if matches:
+        # Bulk UPDATEs skip the flush hooks, so keep the completion counters and trade index in step by hand
+        slots = set()
+        for c in cards:
+            if c.id in matches:
+                slots.add((c.user_id, matches[c.id], finish_code(c.finish)))
+                if c.reference_id:
+                    slots.add((c.user_id, c.reference_id, finish_code(c.finish)))
+        before = owned_slot_state(db.session, slots)
+        db.session.execute(db.update(Card), [{'id': cid, 'reference_id': rid} for cid, rid in matches.items()])
+        after = owned_slot_state(db.session, slots)
+        apply_completion_deltas(db.session, slots, before, after)
+        sync_trade_slots(db.session, slots)
+        bump_inventory_version(db.session, {c.user_id for c in cards if c.id in matches})
+    return matches, report
+
+def attach_references(new_cards):
+    """Links not-yet-saved Card objects (importers) in one batch. Returns the match report."""
+    matches, report = match_references_bulk(
+        (i, c.card_name, c.set_name, c.card_number) for i, c in enumerate(new_cards)
+    )
+    for i, ref_id in matches.items():
+        new_cards[i].reference_id = ref_id
+    return report
+
+# --- Finishes ---
+# One canonical enum for catalog finishes (CardReferenceFinish) and inventory finishes (Card.finish_code),
+# so "Holo", "holo foil" and "Holofoil" all land in the same slot.
+
+FINISH_CODES = {
+    'Normal': 1,
+    'Holofoil': 2,
+    'Reverse Holofoil': 3,
+    '1st Edition': 4,
+    '1st Edition Holofoil': 5,
+    'Unlimited Holofoil': 6,
+    'Unlimited': 7,
+}
+FINISH_LABELS = {code: name for name, code in FINISH_CODES.items()}
+
+# Canonical names are the spelling the add-card form, hunt mode and force_variant use.
+# Keys: TCGPlayer price tiers plus common hand-typed spellings (lowercase, letters/digits only)
+FINISH_NAMES = {
+    'normal': 'Normal',
+    'holofoil': 'Holofoil',
+    'reverseholofoil': 'Reverse Holofoil',
+    '1stedition': '1st Edition',
+    '1steditionnormal': '1st Edition',
+    '1steditionholofoil': '1st Edition Holofoil',
+    'unlimitedholofoil': 'Unlimited Holofoil',
+    'unlimited': 'Unlimited',
+    'nonholo': 'Normal',
+    'regular': 'Normal',
+    'holo': 'Holofoil',
+    'foil': 'Holofoil',
+    'reverse': 'Reverse Holofoil',
+    'reverseholo': 'Reverse Holofoil',
+    'revholo': 'Reverse Holofoil',
+    'rh': 'Reverse Holofoil',
+    '1sted': '1st Edition',
+    '1stedholo': '1st Edition Holofoil',
+    '1steditionholo': '1st Edition Holofoil',
+}
+
+def canonical_finish(finish):
+    """Canonical finish name for any spelling, or None if it can't be placed."""
+    key = re.sub(r'[^0-9a-z]', '', (finish or '').lower())
+    if not key:
+        return 'Normal'
+    if key in FINISH_NAMES:
+        return FINISH_NAMES[key]
+    if 'reverse' in key:
+        return 'Reverse Holofoil'
+    if '1st' in key or 'first' in key:
+        return '1st Edition Holofoil' if ('holo' in key or 'foil' in key) else '1st Edition'
+    if 'holo' in key or 'foil' in key:
+        return 'Holofoil'
+    if 'normal' in key:
+        return 'Normal'
+    return None
+
+def finish_code(finish):
+    return FINISH_CODES.get(canonical_finish(finish))
+
+def reference_finish_codes(available_finishes):
+    """FINISH_CODES for a comma-separated available_finishes string (empty -> Normal)."""
+    names = [f for f in (available_finishes or "").split(',') if f.strip()] or ["Normal"]
+    return sorted({code for code in (finish_code(f) for f in names) if code})
+
+def index_finishes(refs):
+    """(Re)writes CardReferenceFinish for these (reference_id, available_finishes) pairs. Caller commits."""
+    refs = list(refs)
+    table = CardReferenceFinish.__table__
+    for start in range(0, len(refs), MATCH_CHUNK_SIZE):
+        chunk = refs[start:start + MATCH_CHUNK_SIZE]
+        invalidate_hunt_cache(db.session, [ref_id for ref_id, _ in chunk])
+        db.session.execute(table.delete().where(table.c.reference_id.in_([ref_id for ref_id, _ in chunk])))
+        rows = [{'reference_id': ref_id, 'finish_code': code}
+                for ref_id, finishes in chunk for code in reference_finish_codes(finishes)]
+        if rows:
+            db.session.execute(table.insert(), rows)
+
+def rebuild_finish_index(batch_size=5000):
+    """Re-derives CardReferenceFinish for the whole dictionary (startup backfill, snapshot import, repair)."""
+    db.session.execute(CardReferenceFinish.__table__.delete())
+    db.session.execute(HuntCache.__table__.delete())
+    count = 0
+    batch = []
+    for row in db.session.query(CardReference.id, CardReference.available_finishes).yield_per(batch_size):
+        batch.append(tuple(row))
+        if len(batch) >= batch_size:
+            index_finishes(batch)
+            count += len(batch)
+            batch = []
+    index_finishes(batch)
+    return count + len(batch)
+
+def backfill_card_prices():
+    """Zeroes NULL Card.price left by old writers (storefront pages are keyed on price)."""
+    users = [u for (u,) in db.session.query(Card.user_id).filter(Card.price.is_(None)).distinct()]
+    db.session.query(Card).filter(Card.price.is_(None)).update({Card.price: 0.0}, synchronize_session=False)
+    bump_inventory_version(db.session, users)
+    db.session.commit()
+
+def backfill_finish_codes():
+    """Fills Card.finish_code on rows written before the column existed (one UPDATE per spelling)."""
+    spellings = [f for (f,) in db.session.query(Card.finish).filter(Card.finish_code.is_(None)).distinct()]
+    for spelling in spellings:
+        code = finish_code(spelling)
+        if code:
+            column = Card.finish.is_(None) if spelling is None else Card.finish == spelling
+            db.session.query(Card).filter(column, Card.finish_code.is_(None)).update(
+                {Card.finish_code: code}, synchronize_session=False)
+    db.session.commit()
+
+# --- Species Index ---
+# "Mew" must not match "Mewtwo", and "Dark Charizard" / "M Charizard-EX" / "Charizard VMAX" are all
+# Charizard. Species are extracted once per reference at ingest and looked up by an indexed join.
+
+SPECIES_PREFIXES = [
+    'dark', 'light', 'shining', 'radiant', 'alolan', 'galarian', 'hisuian', 'paldean', 'mega', 'm',
+    'flying', 'surfing', 'detective', 'special delivery', 'origin forme', 'single strike', 'rapid strike',
+    'fusion strike', 'ice rider', 'shadow rider', 'bloodmoon',
+]
+SPECIES_SUFFIXES = {
+    'ex', 'gx', 'v', 'vmax', 'vstar', 'v-union', 'break', 'legend', 'prime', 'lv.x', 'lv', 'x', 'star', 'prism',
+    'δ', '☆', '★', '◇', 'g', 'gl', 'fb', 'c', '4', 'e4',
+}
+SPECIES_HYPHEN_SUFFIX = re.compile(r'-(?:ex|gx|v|vmax|vstar)$', re.IGNORECASE)
+SPECIES_POSSESSIVE = re.compile(r"^.*?['’]s\s+")   # "Giovanni's", "Team Rocket's", "Lt. Surge's"
+
+def species_key(name):
+    """Canonical lookup key for a species name typed by a user (MasterTracker, URLs)."""
+    return " ".join((name or "").split()).lower()
+
+def extract_species(card_name):
+    """Species keys in a card name: strips owners, forms and mechanic suffixes; splits tag teams."""
+    if not card_name:
+        return []
+    base = re.sub(r'\s*[\(\[].*?[\)\]]', '', card_name)   # "(Delta Species)", "[A]"
+    base = re.split(r' - | #', base)[0]
+    species = []
+    for part in re.split(r'\s*&\s*', base):
+        part = SPECIES_POSSESSIVE.sub('', part.strip())
+        tokens = [SPECIES_HYPHEN_SUFFIX.sub('', t) for t in part.split()]
+        tokens = [t for t in tokens if t]
+        while len(tokens) > 1 and tokens[-1].lower() in SPECIES_SUFFIXES:
+            tokens.pop()
+        stripped = True
+        while stripped and len(tokens) > 1:
+            stripped = False
+            for prefix in SPECIES_PREFIXES:
+                words = prefix.split()
+                if len(tokens) > len(words) and [t.lower() for t in tokens[:len(words)]] == words:
+                    tokens = tokens[len(words):]
+                    stripped = True
+                    break
+        key = species_key(" ".join(tokens))
+        if key and key not in species:
+            species.append(key)
+    return species
+
+def index_species(refs):
+    """(Re)writes the species rows for these (reference_id, name) pairs. Caller commits."""
+    refs = list(refs)
+    table = CardSpecies.__table__
+    for start in range(0, len(refs), MATCH_CHUNK_SIZE):
+        chunk = refs[start:start + MATCH_CHUNK_SIZE]
+        # Hunt lists of the species a reference leaves and of the ones it joins
+        invalidate_hunt_cache(db.session, [ref_id for ref_id, _ in chunk])
+        db.session.execute(table.delete().where(table.c.reference_id.in_([ref_id for ref_id, _ in chunk])))
+        rows = [{'species': sp, 'reference_id': ref_id} for ref_id, name in chunk for sp in extract_species(name)]
+        if rows:
+            db.session.execute(table.insert(), rows)
+            invalidate_hunt_cache(db.session, species={row['species'] for row in rows})
+
+def rebuild_species_index(batch_size=5000):
+    """Re-extracts species for the whole dictionary (startup backfill, snapshot import, repair)."""
+    db.session.execute(CardSpecies.__table__.delete())
+    db.session.execute(HuntCache.__table__.delete())
+    count = 0
+    batch = []
+    for row in db.session.query(CardReference.id, CardReference.name).yield_per(batch_size):
+        batch.append(tuple(row))
+        if len(batch) >= batch_size:
+            index_species(batch)
+            count += len(batch)
+            batch = []
+    index_species(batch)
+    return count + len(batch)
+
+def species_reference_ids(species):
+    """Subquery of reference ids mapped to one species (indexed)."""
+    return db.session.query(CardSpecies.reference_id).filter(CardSpecies.species == species_key(species))
+
+# --- Schema Upgrades ---
+# db.create_all() only creates missing tables. Columns added to existing tables are listed here
+# and patched in at startup (the same job migrate.py used to do by hand).
+
+SCHEMA_PATCHES = {
+    'user': [('inventory_version', 'INTEGER DEFAULT 0'), ('inventory_updated_at', 'DATETIME')],
+    'card_reference': [('name_key', 'VARCHAR(150)'), ('number_key', 'VARCHAR(20)'),
+                       ('prices', 'TEXT'), ('prices_updated_at', 'DATETIME')],
+    'card': [('name_key', 'VARCHAR(150)'), ('number_key', 'VARCHAR(50)'), ('finish_code', 'INTEGER')],
+}
+
+# Indexes superseded by newer ones (dropped at startup)
+SCHEMA_DROPPED_INDEXES = ['ix_card_user_reference_finish']
+
+def upgrade_schema():
+    inspector = db.inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table, columns in SCHEMA_PATCHES.items():
+            existing = {c['name'] for c in inspector.get_columns(table)}
+            for col_name, col_type in columns:
+                if col_name not in existing:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {col_name} {col_type}"))
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        for name in SCHEMA_DROPPED_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+def backfill_match_keys(batch_size=2000):
+    """Fills name_key/number_key on rows written before the columns existed."""
+    for model, name_col, num_col in ((CardReference, 'name', 'number'), (Card, 'card_name', 'card_number')):
+        while True:
+            rows = db.session.query(model.id, getattr(model, name_col), getattr(model, num_col)).filter(
+                model.name_key.is_(None)
+            ).limit(batch_size).all()
+            if not rows:
+                break
+            db.session.execute(db.update(model), [
+                {'id': r[0], 'name_key': normalize_name(r[1]), 'number_key': normalize_number(r[2])} for r in rows
+            ])
+            db.session.commit()
+
+# --- Full-Text Search Index (CardReference) ---
+# SQLite FTS5 table mirroring CardReference.name/set_name. Triggers keep it in sync
+# with every write to card_reference (sync_db, ingest.py, force_api_fetch...)
+# so nothing else has to remember to update it. Falls back to ilike scans on other databases.
+# The index is keyed on card_reference's implicit rowid (its primary key is a string), which a VACUUM may
+# renumber; init_reference_fts checks it against the table at every start and rebuilds it on a mismatch.
+
+FTS_ENABLED = False
+
+FTS_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS card_reference_fts USING fts5(
+        name, set_name, content='card_reference', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS card_reference_fts_ai AFTER INSERT ON card_reference BEGIN
+        INSERT INTO card_reference_fts(rowid, name, set_name) VALUES (new.rowid, new.name, new.set_name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS card_reference_fts_ad AFTER DELETE ON card_reference BEGIN
+        INSERT INTO card_reference_fts(card_reference_fts, rowid, name, set_name) VALUES ('delete', old.rowid, old.name, old.set_name);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS card_reference_fts_au AFTER UPDATE OF name, set_name ON card_reference BEGIN
+        INSERT INTO card_reference_fts(card_reference_fts, rowid, name, set_name) VALUES ('delete', old.rowid, old.name, old.set_name);
+        INSERT INTO card_reference_fts(rowid, name, set_name) VALUES (new.rowid, new.name, new.set_name);
+    END""",
+]
+
+# Change feed: lets every worker (and the CLI scripts) see which references changed.
+# Only columns the autocomplete index reads are watched, so price-cache refreshes don't flood it.
+CATALOG_CHANGE_COLUMNS = "name, set_name, number, set_id, image_url, release_date"
+CATALOG_CHANGE_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS card_reference_log_ai AFTER INSERT ON card_reference BEGIN
+        INSERT INTO catalog_change(ref_id) VALUES (new.id);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS card_reference_log_au AFTER UPDATE OF {CATALOG_CHANGE_COLUMNS} ON card_reference BEGIN
+        INSERT INTO catalog_change(ref_id) VALUES (new.id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS card_reference_log_ad AFTER DELETE ON card_reference BEGIN
+        INSERT INTO catalog_change(ref_id) VALUES (old.id);
+    END""",
+]
+
+CHANGELOG_ENABLED = False
+
+def init_catalog_changelog():
+    global CHANGELOG_ENABLED
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    try:
+        with db.engine.begin() as conn:
+            # Older databases have an update trigger that fires on every column
+            old_trigger = conn.execute(text(
+                "SELECT sql FROM sqlite_master WHERE type='trigger' AND name='card_reference_log_au'"
+            )).scalar()
+            if old_trigger and 'UPDATE OF' not in old_trigger:
+                conn.execute(text("DROP TRIGGER card_reference_log_au"))
+            for stmt in CATALOG_CHANGE_TRIGGERS:
+                conn.execute(text(stmt))
+        CHANGELOG_ENABLED = True
+    except Exception as e:
+        print(f"Catalog changelog init skipped: {str(e)}", flush=True)
+        CHANGELOG_ENABLED = False
+    return CHANGELOG_ENABLED
+
+def init_reference_fts():
+    """Creates the FTS5 index + sync triggers. Backfills the index the first time it is created."""
+    global FTS_ENABLED
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    try:
+        with db.engine.begin() as conn:
+            existed = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='card_reference_fts'"
+            )).first()
+            for stmt in FTS_SCHEMA:
+                conn.execute(text(stmt))
+            if not existed:
+                conn.execute(text("INSERT INTO card_reference_fts(card_reference_fts) VALUES ('rebuild')"))
+        if existed and not reference_fts_consistent():
+            print("FTS index out of step with card_reference; rebuilding", flush=True)
+            with db.engine.begin() as conn:
+                conn.execute(text("INSERT INTO card_reference_fts(card_reference_fts) VALUES ('rebuild')"))
+        FTS_ENABLED = True
+    except Exception as e:
+        # FTS5 not compiled in (or DB locked by the other worker mid-create): keep the ilike fallback
+        print(f"FTS init skipped: {str(e)}", flush=True)
+        FTS_ENABLED = False
+    return FTS_ENABLED
+
+def reference_fts_consistent():
+    """False if the FTS index no longer matches card_reference row for row (rank 1 = check the content table)."""
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(text("INSERT INTO card_reference_fts(card_reference_fts, rank) VALUES ('integrity-check', 1)"))
+    except DatabaseError:
+        return False
+    return True
+
+def rebuild_reference_fts():
+    """Re-derives the whole index from card_reference (repair after VACUUM / manual edits)."""
+    if not FTS_ENABLED:
+        return
+    db.session.execute(text("INSERT INTO card_reference_fts(card_reference_fts) VALUES ('rebuild')"))
+    db.session.commit()
+
+def search_reference_index(query, limit=20):
+    """Ranked prefix search over CardReference. Every word must prefix-match the name or set."""
+    terms = re.findall(r'\w+', query.lower())
+    if not terms:
+        return []
+
+    if FTS_ENABLED:
+        match_expr = " ".join(f'"{t}"*' for t in terms)
+        # Name hits outweigh set-name hits; ties go to the newest printing
+        stmt = text("""
+            SELECT card_reference.* FROM card_reference_fts
+            JOIN card_reference ON card_reference.rowid = card_reference_fts.rowid
+            WHERE card_reference_fts MATCH :match
+            ORDER BY bm25(card_reference_fts, 10.0, 1.0), card_reference.release_date DESC
+            LIMIT :limit
+        """)
+        return CardReference.query.from_statement(stmt.bindparams(match=match_expr, limit=limit)).all()
+
+    filters = []
+    for term in terms:
+        filters.append(db.or_(CardReference.name.ilike(f'%{term}%'), CardReference.set_name.ilike(f'%{term}%')))
+    return CardReference.query.filter(db.and_(*filters)).order_by(CardReference.release_date.desc()).limit(limit).all()
+
+# --- In-Memory Autocomplete (POS) ---
+# Each gunicorn worker keeps its own compact index of the dictionary so POS keystrokes never
+# hit SQL. Built lazily on first use, then patched from the catalog_change feed at most once
+# every AUTOCOMPLETE_REFRESH_SECONDS.
+
+AUTOCOMPLETE_REFRESH_SECONDS = float(os.environ.get('AUTOCOMPLETE_REFRESH_SECONDS', 5))
+AUTOCOMPLETE_REBUILD_THRESHOLD = 5000   # More pending changes than this -> cheaper to reload
+CATALOG_CHANGE_KEEP = 50000             # Feed rows retained for lagging workers
+CATALOG_RELOAD_MARKER = '*'             # Feed row written by bulk loads that bypass the triggers
+
+def _date_key(release_date):
+    digits = re.sub(r'\D', '', release_date or '')
+    return int(digits[:8]) if digits else 0
+
+class ReferenceAutocomplete:
+    """Tokens live in a sorted list (bisect = prefix range scan) with trigram postings for substring hits."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.last_change_id = 0
+        self.last_check = 0.0
+        self._reset()
+
+    def _reset(self):
+        self.entries = {}        # ref_id -> (id, name, set_name, number, image_url, name_key, date_key)
+        self.doc_tokens = {}     # ref_id -> frozenset of tokens
+        self.postings = {}       # token -> set of ref_ids
+        self.sorted_tokens = []
+        self.trigrams = {}       # trigram -> set of tokens
+
+    # --- Index maintenance ---
+
+    def _add_token(self, token, ref_id, bulk=False):
+        refs = self.postings.get(token)
+        if refs is None:
+            refs = self.postings[token] = set()
+            if not bulk:
+                bisect.insort(self.sorted_tokens, token)
+            for i in range(len(token) - 2):
+                self.trigrams.setdefault(token[i:i + 3], set()).add(token)
+        refs.add(ref_id)
+
+    def _drop_token(self, token, ref_id):
+        refs = self.postings.get(token)
+        if refs is None:
+            return
+        refs.discard(ref_id)
+        if not refs:
+            del self.postings[token]
+            i = bisect.bisect_left(self.sorted_tokens, token)
+            if i < len(self.sorted_tokens) and self.sorted_tokens[i] == token:
+                del self.sorted_tokens[i]
+            for j in range(len(token) - 2):
+                tri = self.trigrams.get(token[j:j + 3])
+                if tri is not None:
+                    tri.discard(token)
+                    if not tri:
+                        del self.trigrams[token[j:j + 3]]
+
+    def _index(self, row, bulk=False):
+        ref_id, name, set_name, number, set_id, image_url, release_date = row
+        name = name or "Unknown"
+        tokens = set()
+        for value in (name, set_name, number, set_id):
+            if value:
+                tokens.update(re.findall(r'\w+', str(value).lower()))
+        self.entries[ref_id] = (
+            ref_id, name, set_name or "Unknown", number or "", image_url or "",
+            " ".join(re.findall(r'\w+', name.lower())), _date_key(release_date)
+        )
+        self.doc_tokens[ref_id] = frozenset(tokens)
+        for token in tokens:
+            self._add_token(token, ref_id, bulk=bulk)
+
+    def _unindex(self, ref_id):
+        self.entries.pop(ref_id, None)
+        for token in self.doc_tokens.pop(ref_id, ()):
+            self._drop_token(token, ref_id)
+
+    @staticmethod
+    def _columns():
+        return (CardReference.id, CardReference.name, CardReference.set_name, CardReference.number,
+                CardReference.set_id, CardReference.image_url, CardReference.release_date)
+
+    def load_all(self, if_unloaded=False):
+        with self.lock:
+            if if_unloaded and self.loaded:
+                return   # the warmer finished while we waited for the lock
+            # Read the feed position first so changes made during the load get replayed
+            self.last_change_id = db.session.query(db.func.max(CatalogChange.id)).scalar() or 0
+            self._reset()
+            for row in db.session.query(*self._columns()).yield_per(2000):
+                self._index(tuple(row), bulk=True)
+            self.sorted_tokens = sorted(self.postings)
+            self.loaded = True
+            self.last_check = time.monotonic()
+
+    def refresh(self, force=False):
+        """Applies pending catalog_change rows. Cheap no-op between refresh intervals."""
+        if not self.loaded:
+            # Normally warm() has already loaded it; this only runs if a search beats the warmer
+            self.load_all(if_unloaded=True)
+            return
+        now = time.monotonic()
+        if not force and now - self.last_check < AUTOCOMPLETE_REFRESH_SECONDS:
+            return
+        self.last_check = now
+        if not CHANGELOG_ENABLED:
+            return
+
+        changes = db.session.query(CatalogChange.id, CatalogChange.ref_id).filter(
+            CatalogChange.id > self.last_change_id
+        ).order_by(CatalogChange.id).limit(AUTOCOMPLETE_REBUILD_THRESHOLD + 1).all()
+        if not changes:
+            return
+        # A gap means the rows we needed were pruned; a flood means a full sync ran
+        if (changes[0].id != self.last_change_id + 1 or len(changes) > AUTOCOMPLETE_REBUILD_THRESHOLD
+                or any(c.ref_id == CATALOG_RELOAD_MARKER for c in changes)):
+            self.load_all()
+            return
+
+        ref_ids = {c.ref_id for c in changes}
+        rows = db.session.query(*self._columns()).filter(CardReference.id.in_(ref_ids)).all()
+        with self.lock:
+            for ref_id in ref_ids:
+                self._unindex(ref_id)
+            for row in rows:
+                self._index(tuple(row))
+            self.last_change_id = changes[-1].id
+
+        if self.last_change_id > CATALOG_CHANGE_KEEP:
+            CatalogChange.query.filter(CatalogChange.id <= self.last_change_id - CATALOG_CHANGE_KEEP).delete()
+            db.session.commit()
+
+    def _term_matches(self, term):
+        """Returns (prefix_refs, all_refs) for one search word."""
+        start = end = bisect.bisect_left(self.sorted_tokens, term)
+        while end < len(self.sorted_tokens) and self.sorted_tokens[end].startswith(term):
+            end += 1
+        prefix_refs = set().union(*(self.postings[t] for t in self.sorted_tokens[start:end]))
+
+        all_refs = set(prefix_refs)
+        if len(term) >= 3:
+            tri_sets = [self.trigrams.get(term[j:j + 3], set()) for j in range(len(term) - 2)]
+            tri_sets.sort(key=len)
+            for token in set.intersection(*tri_sets):
+                if term in token:
+                    all_refs |= self.postings[token]
+        return prefix_refs, all_refs
+
+    def warm(self):
+        """Builds the index when the worker starts so the first search doesn't pay for the full load."""
+        with app.app_context():
+            try:
+                self.refresh()
+            except SQLAlchemyError as e:
+                print(f"Autocomplete warm-up skipped: {str(e)}", flush=True)
+
+    def search(self, query, limit=15):
+        """Every word must match (prefix or substring) a token of name/set/number/set code.
+        Ranked: exact name > name prefix > word prefixes > substring, then newest release."""
+        words = re.findall(r'\w+', query.lower())
+        if not words:
+            return []
+        self.refresh()
+        phrase = " ".join(words)
+
+        with self.lock:
+            # Intersect smallest match set first; set ops stay in C even for broad words
+            matches = sorted((self._term_matches(term) for term in set(words)), key=lambda m: len(m[1]))
+            prefix_all, candidates = matches[0]
+            for prefix_refs, all_refs in matches[1:]:
+                candidates &= all_refs
+                prefix_all &= prefix_refs
+                if not candidates:
+                    return []
+            if not candidates:
+                return []
+
+            def rank(ref_id):
+                entry = self.entries[ref_id]
+                name_key = entry[5]
+                if name_key == phrase:
+                    tier = 0
+                elif name_key.startswith(phrase):
+                    tier = 1
+                elif ref_id in prefix_all:
+                    tier = 2
+                else:
+                    tier = 3
+                return (tier, -entry[6], name_key)
+
+            return [self.entries[r] for r in heapq.nsmallest(limit, candidates, key=rank)]
+
+reference_autocomplete = ReferenceAutocomplete()
+
+# --- Helper Functions ---
+
+def get_user_settings(user_id, create=True):
+    settings = Settings.query.filter_by(user_id=user_id).first()
+    if not settings:
+        settings = Settings(user_id=user_id, show_prices=False)
+        # Public pages only read: hand back the defaults without writing a row
+        if create:
+            db.session.add(settings)
+            db.session.commit()
+    return settings
+
+# --- Helper Functions CONT.---
+
+def get_clean_finishes(tcgplayer_data):
+    """Parses TCGPlayer pricing tiers to determine available card variants."""
+    if not tcgplayer_data or not isinstance(tcgplayer_data, dict) or not tcgplayer_data.get('prices'):
+        return "Normal"
+    
+    clean_finishes = []
+    for f in tcgplayer_data['prices'].keys():
+        # Fallback for unexpected finishes: split CamelCase
+        cleaned = FINISH_NAMES.get(f.lower()) or re.sub('([A-Z])', r' \1', f).strip().title()
+        if cleaned not in clean_finishes:
+            clean_finishes.append(cleaned)
+            
+    return ",".join(clean_finishes) if clean_finishes else "Normal"
+
+# --- Background Jobs ---
+# Work that would blow through gunicorn's --timeout runs on a daemon thread in the worker that
+# accepted it. Progress lives in the BackgroundJob table so either worker can answer polls.
+
+JOB_STALE_AFTER = timedelta(minutes=10)   # No heartbeat for this long -> the worker died
+
+def update_job(job_id, **fields):
+    job = db.session.get(BackgroundJob, job_id)
+    for key, value in fields.items():
+        setattr(job, key, json.dumps(value) if key == 'detail' and value is not None else value)
+    job.updated_at = datetime.utcnow()
+    db.session.commit()
+
+def get_active_job(kind, user_id=None):
+    """Most recent running job of this kind, ignoring ones whose worker stopped heart-beating."""
+    cutoff = datetime.utcnow() - JOB_STALE_AFTER
+    query = BackgroundJob.query.filter(
+        BackgroundJob.kind == kind,
+        BackgroundJob.status == 'running',
+        BackgroundJob.updated_at > cutoff
+    )
+    if user_id is not None:
+        query = query.filter(BackgroundJob.user_id == user_id)
+    return query.order_by(BackgroundJob.id.desc()).first()
+
+worker_threads = set()
+worker_threads_lock = threading.Lock()
+
+def start_worker_thread(name, target):
+    """Runs target on a daemon thread, once per process (each gunicorn worker gets its own)."""
+    if name in worker_threads:
+        return
+    with worker_threads_lock:
+        if name in worker_threads:
+            return
+        worker_threads.add(name)
+    threading.Thread(target=target, name=name, daemon=True).start()
+
+def start_background_job(kind, target, user_id=None, **params):
+    """Records the job, then runs target(job_id, **params) on a daemon thread with its own app context."""
+    job = BackgroundJob(kind=kind, status='running', user_id=user_id)
+    db.session.add(job)
+    db.session.commit()
+    job_id = job.id
+
+    def runner():
+        with app.app_context():
+            try:
+                target(job_id, **params)
+                update_job(job_id, status='done', finished_at=datetime.utcnow())
+            except Exception as e:
+                db.session.rollback()
+                print(f"JOB {kind} #{job_id} CRASHED: {str(e)}", flush=True)
+                update_job(job_id, status='failed', message=str(e)[:500], finished_at=datetime.utcnow())
+
+    threading.Thread(target=runner, name=f"job-{kind}-{job_id}", daemon=True).start()
+    return job
+
+# --- Session Sweeper ---
+# Each worker runs one sweeper thread (see start_worker_threads). Two workers sweeping at once is
+# harmless: each batch is "delete these expired ids". Redis expires keys itself.
+
+SESSION_SWEEP_INTERVAL = int(os.environ.get('SESSION_SWEEP_INTERVAL', 15 * 60))
+SESSION_SWEEP_BATCH = 1000
+
+def sweep_expired_sessions(batch_size=SESSION_SWEEP_BATCH):
+    """Deletes expired SQL sessions batch_size rows per transaction, so a backlog never locks the table
+    for long. Returns how many were deleted."""
+    if SessionRecord is None:
+        return 0
+    deleted = 0
+    while True:
+        ids = [i for (i,) in db.session.query(SessionRecord.id).filter(
+            SessionRecord.expiry <= datetime.utcnow()).limit(batch_size)]
+        if not ids:
+            return deleted
+        db.session.query(SessionRecord).filter(SessionRecord.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(ids)
+
+def run_session_sweeper():
+    while True:
+        time.sleep(SESSION_SWEEP_INTERVAL * random.uniform(0.8, 1.2))
+        with app.app_context():
+            try:
+                deleted = sweep_expired_sessions()
+                if deleted:
+                    print(f"🧹 Removed {deleted} expired sessions")
+            except Exception as e:
+                db.session.rollback()
+                print(f"⚠️ Session sweep failed: {e}")
+
+# --- Email Outbox ---
+# Views never talk to SMTP: queue_email() adds an OutboxEmail row to the caller's transaction and
+# wake_outbox() nudges this worker's sender thread after the commit. The sender claims due rows with a
+# conditional UPDATE (so both gunicorn workers can run one), sends them over a single SMTP connection
+# until the queue is empty, and retries failures with exponential backoff.
+
+OUTBOX_BATCH = 20
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_POLL_INTERVAL = int(os.environ.get('OUTBOX_POLL_INTERVAL', 30))
+OUTBOX_CLAIM_TIMEOUT = timedelta(minutes=10)   # a worker that died mid-send gives its claim back after this
+outbox_wakeup = threading.Event()
+
+def queue_email(subject, recipients, body, reply_to=None, kind=None):
+    """Adds a message to the outbox; it goes out once the caller commits. Returns None if nobody to send to."""
+    recipients = [r for r in recipients if r]
+    if not recipients:
+        return None
+    email = OutboxEmail(kind=kind, recipients=json.dumps(recipients), subject=subject, body=body, reply_to=reply_to)
+    db.session.add(email)
+    return email
+
+def wake_outbox():
+    outbox_wakeup.set()
+
+def outbox_backoff(attempts):
+    return timedelta(seconds=min(3600, 30 * 2 ** (attempts - 1)))
+
+def claim_outbox_batch(limit=OUTBOX_BATCH):
+    """Marks up to limit due messages as 'sending' for this caller and returns them."""
+    now = datetime.utcnow()
+    due = db.or_(
+        db.and_(OutboxEmail.status == 'pending', OutboxEmail.next_attempt_at <= now),
+        db.and_(OutboxEmail.status == 'sending', OutboxEmail.claimed_at < now - OUTBOX_CLAIM_TIMEOUT),
+    )
+    ids = [i for (i,) in db.session.query(OutboxEmail.id).filter(due).order_by(OutboxEmail.id).limit(limit)]
+    if not ids:
+        return []
+    token = os.urandom(16).hex()
+    db.session.execute(db.update(OutboxEmail).where(OutboxEmail.id.in_(ids), due).values(
+        status='sending', claimed_by=token, claimed_at=now))
+    db.session.commit()
+    return OutboxEmail.query.filter_by(claimed_by=token, status='sending').order_by(OutboxEmail.id).all()
+
+def record_outbox_failure(email, error):
+    email.attempts += 1
+    email.last_error = str(error)[:500]
+    email.claimed_by = None
+    if email.attempts >= OUTBOX_MAX_ATTEMPTS:
+        email.status = 'failed'
+    else:
+        email.status = 'pending'
+        email.next_attempt_at = datetime.utcnow() + outbox_backoff(email.attempts)
+
+def deliver_outbox():
+    """Sends every due message, reusing one SMTP connection. Returns (sent, failed attempts)."""
+    sent = failed = 0
+    batch = claim_outbox_batch()
+    if not batch:
+        return sent, failed
+    try:
+        with mail.connect() as conn:
+            while batch:
+                for email in batch:
+                    try:
+                        conn.send(Message(subject=email.subject, recipients=json.loads(email.recipients),
+                                          body=email.body, reply_to=email.reply_to))
+                    except smtplib.SMTPException as e:
+                        record_outbox_failure(email, e)
+                        failed += 1
+                        db.session.commit()
+                        if isinstance(e, smtplib.SMTPServerDisconnected):
+                            raise
+                        continue
+                    email.status = 'sent'
+                    email.sent_at = datetime.utcnow()
+                    email.claimed_by = None
+                    db.session.commit()
+                    sent += 1
+                batch = claim_outbox_batch()
+    except Exception as e:
+        # Couldn't connect, or the connection dropped: give the rest of the batch back with a backoff
+        db.session.rollback()
+        for email in batch:
+            if email.status == 'sending':
+                record_outbox_failure(email, e)
+                failed += 1
+        db.session.commit()
+    return sent, failed
+
+def run_outbox_sender():
+    while True:
+        outbox_wakeup.wait(OUTBOX_POLL_INTERVAL * random.uniform(0.8, 1.2))
+        outbox_wakeup.clear()
+        with app.app_context():
+            try:
+                sent, failed = deliver_outbox()
+                if sent or failed:
+                    print(f"📧 Outbox: {sent} sent, {failed} failed")
+            except Exception as e:
+                db.session.rollback()
+                print(f"⚠️ Outbox delivery failed: {e}")
+
+@app.before_request
+def start_worker_threads():
+    """Per-worker background threads start with the first request, so CLI scripts importing app never run them."""
+    if SessionRecord is not None:
+        start_worker_thread('session-sweeper', run_session_sweeper)
+    start_worker_thread('outbox-sender', run_outbox_sender)
+    start_worker_thread('autocomplete-warmer', reference_autocomplete.warm)
+
+# --- Catalog Sync (pokemontcg.io) ---
+
+POKEMONTCG_API_URL = "https://api.pokemontcg.io/v2/cards"
+CATALOG_PAGE_SIZE = 250
+SYNC_CONCURRENCY = int(os.environ.get('SYNC_CONCURRENCY', 4))
+
+def api_session(pool_size=SYNC_CONCURRENCY):
+    """Keep-alive HTTP session sized for SYNC_CONCURRENCY parallel page fetches."""
+    http = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    http.mount('https://', adapter)
+    http.headers.update({'User-Agent': 'FludInventory/1.0', 'Accept': 'application/json'})
+    if os.environ.get('POKEMONTCG_API_KEY'):
+        http.headers['X-Api-Key'] = os.environ['POKEMONTCG_API_KEY']
+    http.verify = False
+    return http
+
+def fetch_card_page(http, page, q=None, page_size=CATALOG_PAGE_SIZE, retries=4):
+    """One page of /v2/cards. Backs off on 429 / 5xx instead of giving up on the page."""
+    params = {'page': page, 'pageSize': page_size}
+    if q:
+        params['q'] = q
+    for attempt in range(retries + 1):
+        r = http.get(POKEMONTCG_API_URL, params=params, timeout=30)
+        if r.status_code == 200:
+            return r.json()
+        if r.status_code in (429, 500, 502, 503, 504) and attempt < retries:
+            time.sleep(min(30, 2 ** attempt * 2))
+            continue
+        raise RuntimeError(f"API Error {r.status_code} on page {page}")
+
+def reference_row(item):
+    """Flattens one API card payload into CardReference column values."""
+    card_set = item.get('set') or {}
+    images = item.get('images') or {}
+    tcgplayer = item.get('tcgplayer') or {}
+    tcg_url = tcgplayer.get('url', '')
+    name = item.get('name', 'Unknown')
+    number = item.get('number', '')
+    return {
+        'id': item['id'],
+        'name': name,
+        'set_name': card_set.get('name', 'Unknown'),
+        'set_id': card_set.get('id'),
+        'number': number,
+        'image_url': images.get('small'),
+        'tcgplayer_id': str(tcg_url).split('/')[-1].split('?')[0] if tcg_url else None,
+        'release_date': card_set.get('releaseDate'),
+        'available_finishes': get_clean_finishes(tcgplayer),
+        'is_favorite': False,
+        'name_key': normalize_name(name),
+        'number_key': normalize_number(number),
+        'prices': price_cache_entry(tcgplayer),
+        'prices_updated_at': datetime.utcnow(),
+    }
+
+PRICE_CACHE_FIELDS = ('market', 'mid', 'low')
+
+def price_cache_entry(tcgplayer_data):
+    """Compact JSON of the TCGPlayer price tiers kept in CardReference.prices (None if unpriced)."""
+    prices = (tcgplayer_data or {}).get('prices') or {}
+    compact = {}
+    for finish, tiers in prices.items():
+        if isinstance(tiers, dict):
+            kept = {k: tiers[k] for k in PRICE_CACHE_FIELDS if tiers.get(k) is not None}
+            if kept:
+                compact[finish] = kept
+    return json.dumps(compact, separators=(',', ':')) if compact else None
+
+def get_dialect_insert():
+    """insert() with ON CONFLICT support for SQLite / Postgres, or None for other backends."""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert
+
+REFERENCE_FILL_COLUMNS = ('release_date', 'set_id', 'image_url')   # watched by catalog_change; only blanks are filled
+
+def upsert_references(rows):
+    """INSERT ... ON CONFLICT for a page of reference rows. Returns rows written.
+    Existing rows take fresh finishes/prices and fill blanks; favorites/large images are left alone."""
+    if not rows:
+        return 0
+    index_species((row['id'], row['name']) for row in rows)
+    index_finishes((row['id'], row['available_finishes']) for row in rows)
+    dialect_insert = get_dialect_insert()
+    if dialect_insert is None:
+        changed = 0
+        for row in rows:
+            exists = db.session.get(CardReference, row['id'])
+            if not exists:
+                db.session.add(CardReference(**row))
+                changed += 1
+            else:
+                if exists.available_finishes != row['available_finishes'] or not exists.release_date:
+                    exists.available_finishes = row['available_finishes']
+                    exists.release_date = exists.release_date or row['release_date']
+                    changed += 1
+                exists.prices = row['prices']
+                exists.prices_updated_at = row['prices_updated_at']
+        return changed
+
+    table = CardReference.__table__
+    stmt = dialect_insert(table).values(rows)
+    fresh = stmt.excluded
+    # Only columns the catalog_change trigger doesn't watch, so a re-upsert of an unchanged card (a price
+    # refresh, force_api_fetch) doesn't make every worker reload it into the autocomplete
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.id],
+        set_={
+            'available_finishes': fresh.available_finishes,
+            'tcgplayer_id': db.func.coalesce(table.c.tcgplayer_id, fresh.tcgplayer_id),
+            'prices': fresh.prices,
+            'prices_updated_at': fresh.prices_updated_at,
+        },
+    )
+    written = db.session.execute(stmt).rowcount or 0
+
+    # Blanks in watched columns are filled separately, touching only the rows that have one to fill
+    fill = {name: db.bindparam(f'fill_{name}') for name in REFERENCE_FILL_COLUMNS}
+    blank = db.or_(*(db.and_(table.c[name].is_(None), fill[name].isnot(None)) for name in REFERENCE_FILL_COLUMNS))
+    fill_rows = [{'ref_id': row['id'], **{f'fill_{name}': row.get(name) for name in REFERENCE_FILL_COLUMNS}}
+                 for row in rows if any(row.get(name) for name in REFERENCE_FILL_COLUMNS)]
+    if fill_rows:
+        db.session.connection().execute(
+            table.update().where(table.c.id == db.bindparam('ref_id'), blank).values(
+                {name: db.func.coalesce(table.c[name], fill[name]) for name in REFERENCE_FILL_COLUMNS}),
+            fill_rows)
+    return written
+
+def fetch_card(http, api_id):
+    """Single card by API id, or None if the API doesn't know it."""
+    r = http.get(f"{POKEMONTCG_API_URL}/{api_id}", timeout=30)
+    if r.status_code != 200:
+        return None
+    return r.json().get('data')
+
+# --- Catalog Ingest Pipeline ---
+# Generator stages shared by /admin/sync_db and ingest.py:
+#   iter_card_pages -> normalize_pages -> diff_pages -> write_pages
+# Each stage yields one API page at a time, so memory stays flat and a crash loses at most a page.
+
+def iter_card_pages(http, q=None, start_page=1, meta=None):
+    """Stage 1: yields (page, items) in page order, fetching up to SYNC_CONCURRENCY pages ahead.
+    A page that still fails after retries is yielded as (page, None)."""
+    meta = meta if meta is not None else {}
+    first = fetch_card_page(http, start_page, q=q)
+    meta['total_pages'] = total_pages = max(start_page, math.ceil((first.get('totalCount') or 0) / CATALOG_PAGE_SIZE))
+    yield start_page, first.get('data', [])
+
+    with ThreadPoolExecutor(max_workers=SYNC_CONCURRENCY) as pool:
+        window = []
+        next_page = start_page + 1
+        while next_page <= total_pages or window:
+            while next_page <= total_pages and len(window) < SYNC_CONCURRENCY * 2:
+                window.append((next_page, pool.submit(fetch_card_page, http, next_page, q)))
+                next_page += 1
+            page, future = window.pop(0)
+            try:
+                yield page, future.result().get('data', [])
+            except Exception as e:
+                print(f"FETCH PAGE {page} FAILED: {str(e)}", flush=True)
+                yield page, None
+
+def normalize_pages(pages):
+    """Stage 2: API payloads -> CardReference rows (one canonical finish mapper, match keys)."""
+    for page, items in pages:
+        if items is None:
+            yield page, None
+            continue
+        yield page, [reference_row(item) for item in items if item.get('id')]
+
+def diff_pages(pages, favorite=False, update_only=False):
+    """Stage 3: splits each page into inserts, real catalog updates, and price-cache-only refreshes."""
+    for page, rows in pages:
+        if rows is None:
+            yield page, None, None, None
+            continue
+        existing = {r.id: r for r in db.session.query(
+            CardReference.id, CardReference.available_finishes, CardReference.release_date,
+            CardReference.tcgplayer_id, CardReference.is_favorite
+        ).filter(CardReference.id.in_([row['id'] for row in rows])).all()}
+
+        inserts, updates, refreshed = [], [], []
+        for row in rows:
+            old = existing.get(row['id'])
+            if old is None:
+                if not update_only:
+                    row['is_favorite'] = favorite
+                    inserts.append(row)
+                continue
+            change = {
+                'id': row['id'],
+                'available_finishes': row['available_finishes'],
+                'release_date': old.release_date or row['release_date'],
+                'tcgplayer_id': old.tcgplayer_id or row['tcgplayer_id'],
+                'is_favorite': bool(old.is_favorite or favorite),
+            }
+            prices = {'prices': row['prices'], 'prices_updated_at': row['prices_updated_at']}
+            if any(change[k] != getattr(old, k) for k in change if k != 'id'):
+                updates.append({**change, **prices})
+            else:
+                refreshed.append({'id': row['id'], **prices})
+        yield page, inserts, updates, refreshed
+
+def write_pages(pages, dry_run=False, on_page=None):
+    """Stage 4: one transaction per page (bulk upsert + executemany UPDATEs). Returns run stats."""
+    stats = {'pages': 0, 'inserted': 0, 'updated': 0, 'prices_refreshed': 0, 'failed_pages': []}
+    touched = set()
+    for page, inserts, updates, refreshed in pages:
+        if inserts is None:
+            stats['failed_pages'].append(page)
+        else:
+            if not dry_run:
+                upsert_references(inserts)
+                if updates:
+                    db.session.execute(db.update(CardReference), updates)
+                    index_finishes((row['id'], row['available_finishes']) for row in updates)
+                if refreshed:
+                    db.session.execute(db.update(CardReference), refreshed)
+                record_price_history({row['id']: json.loads(row['prices'])
+                                      for row in inserts + updates + refreshed if row.get('prices')})
+                db.session.commit()
+                touched.update(row['id'] for row in inserts + updates)
+            stats['inserted'] += len(inserts)
+            stats['updated'] += len(updates)
+            stats['prices_refreshed'] += len(updates) + len(refreshed)
+        stats['pages'] += 1
+        if on_page:
+            on_page(page, stats)
+    if touched:
+        # New printings / finishes change the slot totals and trade rows of their species and sets only
+        recount_references_completion(touched)
+        rebuild_trade_slots(species_trade_references(touched))
+        db.session.commit()
+    return stats
+
+def run_ingest(q=None, favorite=False, update_only=False, dry_run=False, start_page=1, on_page=None, http=None):
+    """Full pipeline over /v2/cards (optionally filtered by an API q= query)."""
+    http = http or api_session()
+    meta = {}
+    pages = iter_card_pages(http, q=q, start_page=start_page, meta=meta)
+
+    def progress(page, stats):
+        stats['total_pages'] = meta.get('total_pages', 0)
+        if on_page:
+            on_page(page, stats)
+
+    stats = write_pages(diff_pages(normalize_pages(pages), favorite, update_only), dry_run, progress)
+    stats['total_pages'] = meta.get('total_pages', 0)
+    return stats
+
+def run_catalog_sync(job_id):
+    """Background job behind /admin/sync_db: the full-build pipeline with progress reporting."""
+    def progress(page, stats):
+        update_job(job_id, total=stats['total_pages'], done=stats['pages'],
+                   message=f"Synced {stats['pages']}/{stats['total_pages']} pages, "
+                           f"{stats['inserted']} new / {stats['updated']} updated cards.")
+
+    stats = run_ingest(on_page=progress)
+    summary = f"Synced/Updated {stats['inserted'] + stats['updated']} cards across {stats['total_pages']} pages."
+    if stats['failed_pages']:
+        summary += f" {len(stats['failed_pages'])} pages failed."
+    update_job(job_id, message=summary,
+               detail={'failed_pages': stats['failed_pages']} if stats['failed_pages'] else None)
+
+# --- Pricing (STRICT MODE) ---
+# Shared by /admin/update_price/<id> and the bulk price refresh job.
+
+PRICE_QUERY_BATCH = 20   # ids / names OR'ed into one API query
+PRICE_CONCURRENCY = int(os.environ.get('PRICE_CONCURRENCY', SYNC_CONCURRENCY))
+
+def clean_card_name(card_name):
+    return re.sub(r'[^\w\s]', '', (card_name or "").split('(')[0]).strip()
+
+def select_price_candidate(card, candidates):
+    """Returns (match, error). With a card number the API hits are trusted; without one the set
+    name must match (exact, or unambiguous containment). Ambiguity FAILS safely."""
+    valid_matches = []
+    user_set_clean = (card.set_name or "").lower().replace('set', '').strip()
+    
+    for cand in candidates:
+        # If we queried by number, we trust the result heavily
+        if card.card_number:
+            valid_matches.append(cand)
+        else:
+            # If no number, we MUST match set name reasonably well
+            api_set = cand['set']['name'].lower().replace('set', '').strip()
+            if user_set_clean == api_set:
+                 valid_matches.append(cand)
+            # Allow strict containment if unambiguous (e.g. User: "Evolutions", API: "XY - Evolutions")
+            elif user_set_clean in api_set and len(user_set_clean) > 4:
+                 valid_matches.append(cand)
+
+    if len(valid_matches) == 1:
+        return valid_matches[0], None
+    elif len(valid_matches) > 1:
+        return None, f'Ambiguous: Found {len(valid_matches)} matches (e.g. {valid_matches[0]["set"]["name"]}). Add Card Number for precision.'
+    return None, f'No exact match found for Name="{clean_card_name(card.card_name)}" Set="{card.set_name}" Number="{card.card_number}"'
+
+def get_market_price(prices_obj, price_type):
+    if prices_obj and price_type in prices_obj and prices_obj[price_type]:
+        return prices_obj[price_type].get('market', 0.0) or prices_obj[price_type].get('mid', 0.0)
+    return 0.0
+
+def finish_price_tiers(finish):
+    """TCGPlayer price tiers a card finish may be priced from, in order of preference."""
+    finish_lower = (finish or 'normal').lower()
+    tiers = []
+    if 'reverse' in finish_lower:
+        tiers.append('reverseHolofoil')
+    elif 'holo' in finish_lower or 'foil' in finish_lower:
+        tiers.append('holofoil')
+    elif '1st' in finish_lower:
+        tiers += ['1stEditionHolofoil', '1stEdition']
+    
+    # Fallback to Normal ONLY if finish wasn't specified as something else
+    if 'normal' in finish_lower or not finish:
+        tiers.append('normal')
+    return tiers
+
+def price_for_finish(prices, finish):
+    """Strict Finish Matching. Returns (price, error) - never a Normal price for a Holo card."""
+    new_price = 0.0
+    for tier in finish_price_tiers(finish):
+        new_price = get_market_price(prices, tier)
+        if new_price:
+            break
+    
+    # Absolute Last Resort: If the card exists but we missed the specific finish pricing,
+    # DO NOT UPDATE. (Prevent updating a Holo price with a Normal price)
+    if new_price == 0.0:
+        return 0.0, f'Card found, but no price for finish "{finish}". Available: {list(prices.keys())}'
+    return new_price, None
+
+def price_from_match(card, match):
+    """Returns (new_price, error) for one card against its matched API payload."""
+    tcgplayer = match.get('tcgplayer') or {}
+    if 'prices' not in tcgplayer:
+        return 0.0, 'No market price available.'
+    return price_for_finish(tcgplayer['prices'], card.finish)
+
+def price_from_cache(card, prices):
+    """Same as price_from_match, but against a cached CardReference.prices entry."""
+    if not prices:
+        return 0.0, 'No market price available.'
+    return price_for_finish(prices, card.finish)
+
+def price_update_row(card, new_price, image_url=None):
+    """Column values for a successful reprice (also backfills a missing image)."""
+    row = {'id': card.id, 'price': new_price, 'last_updated': datetime.utcnow()}
+    if not card.image_url and image_url:
+        row['image_url'] = image_url
+    return row
+
+# --- Price Cache ---
+# CardReference.prices holds the last seen TCGPlayer tiers per finish ({"holofoil": {"market", "mid", "low"}}).
+# Catalog syncs refresh it for free; repricing reads it first and only calls the API once it is stale.
+
+PRICE_CACHE_TTL = timedelta(hours=int(os.environ.get('PRICE_CACHE_TTL_HOURS', 24)))
+
+def price_cache_is_fresh(fetched_at):
+    return fetched_at is not None and datetime.utcnow() - fetched_at < PRICE_CACHE_TTL
+
+def load_price_cache(ref_ids, fresh_only=True):
+    """{ref_id: (prices or None, image_url)} for references whose cached prices are still fresh."""
+    cache = {}
+    ref_ids = list(ref_ids)
+    for start in range(0, len(ref_ids), MATCH_CHUNK_SIZE):
+        for r in db.session.query(
+            CardReference.id, CardReference.prices, CardReference.prices_updated_at, CardReference.image_url
+        ).filter(CardReference.id.in_(ref_ids[start:start + MATCH_CHUNK_SIZE])):
+            if not fresh_only or price_cache_is_fresh(r.prices_updated_at):
+                cache[r.id] = (json.loads(r.prices) if r.prices else None, r.image_url)
+    return cache
+
+def store_reference_prices(items):
+    """Write-through for prices fetched outside a catalog sync. Only touches known references;
+    the caller commits. Returns {ref_id: (prices or None, small image)} for every item."""
+    fetched = {}
+    for item in items:
+        if item.get('id'):
+            entry = price_cache_entry(item.get('tcgplayer'))
+            fetched[item['id']] = (json.loads(entry) if entry else None, (item.get('images') or {}).get('small'))
+    if not fetched:
+        return fetched
+
+    known = set()
+    ids = list(fetched)
+    for start in range(0, len(ids), MATCH_CHUNK_SIZE):
+        known.update(r.id for r in db.session.query(CardReference.id).filter(
+            CardReference.id.in_(ids[start:start + MATCH_CHUNK_SIZE])))
+    now = datetime.utcnow()
+    rows = [{'id': ref_id, 'prices': json.dumps(prices, separators=(',', ':')) if prices else None,
+             'prices_updated_at': now} for ref_id, (prices, _) in fetched.items() if ref_id in known]
+    if rows:
+        db.session.execute(db.update(CardReference), rows)
+        record_price_history({ref_id: fetched[ref_id][0] for ref_id in known if fetched[ref_id][0]})
+    return fetched
+
+def fetch_all_cards(http, q):
+    """Every page of results for one API query."""
+    items = []
+    page = 1
+    while True:
+        payload = fetch_card_page(http, page, q=q)
+        items.extend(payload.get('data', []))
+        if page * CATALOG_PAGE_SIZE >= (payload.get('totalCount') or 0):
+            return items
+        page += 1
+
+def refresh_reference_prices(ref_ids, http=None, on_batch=None):
+    """Re-fetches prices for the given references, PRICE_QUERY_BATCH ids per API query.
+    Returns {ref_id: (prices, image)} for every id the API returned."""
+    http = http or api_session(pool_size=PRICE_CONCURRENCY)
+    ref_ids = sorted(ref_ids)
+    batches = [ref_ids[start:start + PRICE_QUERY_BATCH] for start in range(0, len(ref_ids), PRICE_QUERY_BATCH)]
+    fetched = {}
+    with ThreadPoolExecutor(max_workers=PRICE_CONCURRENCY) as pool:
+        futures = {pool.submit(fetch_all_cards, http, " OR ".join(f'id:"{r}"' for r in chunk)): chunk
+                   for chunk in batches}
+        while futures:
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                chunk = futures.pop(future)
+                error = None
+                try:
+                    fetched.update(store_reference_prices(future.result()))
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    error = e
+                if on_batch:
+                    on_batch(chunk, fetched, error)
+    return fetched
+
+def refresh_stale_prices(limit=None, on_batch=None):
+    """TTL sweep: refreshes stale cached prices, owned references first (ingest.py prices)."""
+    cutoff = datetime.utcnow() - PRICE_CACHE_TTL
+    stale = db.or_(CardReference.prices_updated_at.is_(None), CardReference.prices_updated_at < cutoff)
+    owned = db.session.query(Card.reference_id).filter(Card.reference_id.isnot(None)).distinct()
+    ref_ids = [r.id for r in db.session.query(CardReference.id).filter(stale, CardReference.id.in_(owned))]
+    if limit is not None:
+        ref_ids = ref_ids[:limit]
+    refresh_reference_prices(ref_ids, on_batch=on_batch)
+    return len(ref_ids)
+
+# --- Price History ---
+# Fed by every price-cache write (syncs + repricing). A sample is only appended when a tier's
+# market price differs from its latest stored sample; a second change on the same day overwrites it,
+# and a change back to the previous day's price drops that day's sample again.
+
+PRICE_HISTORY_MAX_POINTS = 366
+
+def latest_price_samples(ref_ids, before_day=None):
+    """{(reference_id, finish): (day, cents)} for the newest sample of every tier (older than before_day if given)."""
+    latest = {}
+    ref_ids = list(ref_ids)
+    for start in range(0, len(ref_ids), MATCH_CHUNK_SIZE):
+        newest = db.session.query(
+            PriceHistory.reference_id, PriceHistory.finish, db.func.max(PriceHistory.day).label('day')
+        ).filter(PriceHistory.reference_id.in_(ref_ids[start:start + MATCH_CHUNK_SIZE]))
+        if before_day is not None:
+            newest = newest.filter(PriceHistory.day < before_day)
+        newest = newest.group_by(PriceHistory.reference_id, PriceHistory.finish).subquery()
+        for r in db.session.query(PriceHistory).join(newest, db.and_(
+            PriceHistory.reference_id == newest.c.reference_id,
+            PriceHistory.finish == newest.c.finish,
+            PriceHistory.day == newest.c.day,
+        )):
+            latest[(r.reference_id, r.finish)] = (r.day, r.cents)
+    return latest
+
+def record_price_history(entries, day=None):
+    """entries: {reference_id: cached prices dict}. Appends changed tiers; the caller commits.
+    Compared against the last sample before `day`: today's row is overwritten, or deleted when
+    the price went back to that sample."""
+    day = day or datetime.utcnow().date().toordinal()
+    samples = {}
+    for ref_id, prices in entries.items():
+        for tier in prices or {}:
+            cents = int(round(get_market_price(prices, tier) * 100))
+            if cents > 0:
+                samples[(ref_id, tier)] = cents
+    if not samples:
+        return 0
+
+    previous = latest_price_samples(entries, before_day=day)
+    ref_ids = sorted(entries)
+    today = {}
+    for start in range(0, len(ref_ids), MATCH_CHUNK_SIZE):
+        for r in db.session.query(PriceHistory.reference_id, PriceHistory.finish, PriceHistory.cents).filter(
+                PriceHistory.reference_id.in_(ref_ids[start:start + MATCH_CHUNK_SIZE]), PriceHistory.day == day):
+            today[(r.reference_id, r.finish)] = r.cents
+
+    rows, reverted = [], []
+    for (ref_id, tier), cents in samples.items():
+        if previous.get((ref_id, tier), (None, None))[1] == cents:
+            if (ref_id, tier) in today:
+                reverted.append({'r': ref_id, 'f': tier})
+        elif today.get((ref_id, tier)) != cents:
+            rows.append({'reference_id': ref_id, 'finish': tier, 'day': day, 'cents': cents})
+    if reverted:
+        table = PriceHistory.__table__
+        db.session.execute(table.delete().where(
+            table.c.reference_id == db.bindparam('r'), table.c.finish == db.bindparam('f'), table.c.day == day
+        ), reverted)
+    if not rows:
+        return 0
+
+    dialect_insert = get_dialect_insert()
+    if dialect_insert is None:
+        for row in rows:
+            db.session.merge(PriceHistory(**row))
+        return len(rows)
+    stmt = dialect_insert(PriceHistory.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['reference_id', 'finish', 'day'],
+        set_={'cents': stmt.excluded.cents},
+    )
+    db.session.execute(stmt, rows)
+    return len(rows)
+
+def price_history_series(keys, start_day, end_day, points=60):
+    """Downsampled step series for many (reference_id, finish) keys at once.
+    Returns (days, {key: [cents or None per day]}); each point is the last sample on or before that day."""
+    span = max(end_day - start_day, 0)
+    points = max(1, min(points, span + 1, PRICE_HISTORY_MAX_POINTS))
+    days = sorted({start_day + round(i * span / max(points - 1, 1)) for i in range(points)})
+
+    samples = {key: [] for key in keys}
+    ref_ids = sorted({ref_id for ref_id, _ in keys})
+    for start in range(0, len(ref_ids), MATCH_CHUNK_SIZE):
+        chunk = ref_ids[start:start + MATCH_CHUNK_SIZE]
+        # Last sample before the window, so the series starts with a value instead of a gap
+        before = db.session.query(
+            PriceHistory.reference_id, PriceHistory.finish, db.func.max(PriceHistory.day).label('day')
+        ).filter(PriceHistory.reference_id.in_(chunk), PriceHistory.day < start_day).group_by(
+            PriceHistory.reference_id, PriceHistory.finish).subquery()
+        carried = db.session.query(PriceHistory.reference_id, PriceHistory.finish, PriceHistory.day, PriceHistory.cents).join(
+            before, db.and_(PriceHistory.reference_id == before.c.reference_id,
+                            PriceHistory.finish == before.c.finish, PriceHistory.day == before.c.day))
+        window = db.session.query(PriceHistory.reference_id, PriceHistory.finish, PriceHistory.day, PriceHistory.cents).filter(
+            PriceHistory.reference_id.in_(chunk), PriceHistory.day >= start_day, PriceHistory.day <= end_day)
+        for r in carried.union_all(window).order_by(PriceHistory.day):
+            key = (r.reference_id, r.finish)
+            if key in samples:
+                samples[key].append((r.day, r.cents))
+
+    series = {}
+    for key, rows in samples.items():
+        values, i, current = [], 0, None
+        for d in days:
+            while i < len(rows) and rows[i][0] <= d:
+                current = rows[i][1]
+                i += 1
+            values.append(current)
+        series[key] = values
+    return days, series
+
+def run_price_refresh(job_id, owner_id, card_ids):
+    """
+    BULK PRICE REFRESH
+    - Linked cards are priced from the CardReference price cache; only stale references hit the API.
+    - Unlinked cards are grouped by card name and looked up remotely.
+    - Up to PRICE_QUERY_BATCH ids/names are OR'ed into one API query, PRICE_CONCURRENCY in flight.
+    - Same strict candidate + finish rules as update_single_price. Writes one bulk UPDATE per batch.
+    """
+    cards = []
+    for start in range(0, len(card_ids), MATCH_CHUNK_SIZE):
+        cards += Card.query.filter(Card.user_id == owner_id, Card.id.in_(card_ids[start:start + MATCH_CHUNK_SIZE])).all()
+
+    by_ref, by_name = {}, {}
+    for card in cards:
+        if card.reference_id:
+            by_ref.setdefault(card.reference_id, []).append(card)
+        else:
+            by_name.setdefault(clean_card_name(card.card_name).lower(), []).append(card)
+
+    cache = load_price_cache(by_ref)
+    stale_refs = sorted(r for r in by_ref if r not in cache)
+
+    batches = []
+    for start in range(0, len(stale_refs), PRICE_QUERY_BATCH):
+        chunk = stale_refs[start:start + PRICE_QUERY_BATCH]
+        batches.append(('ref', chunk, " OR ".join(f'id:"{r}"' for r in chunk)))
+    names = sorted(n for n in by_name if n)
+    for start in range(0, len(names), PRICE_QUERY_BATCH):
+        chunk = names[start:start + PRICE_QUERY_BATCH]
+        batches.append(('name', chunk, " OR ".join(f'name:"{n}"' for n in chunk)))
+
+    failures = {str(c.id): 'Card has no name to search.' for c in by_name.get('', [])}
+    updated = {}
+    done = len(failures)
+    update_job(job_id, total=len(cards), done=done,
+               message=f"Pricing {len(cards)} cards ({len(by_ref) - len(stale_refs)} references cached, {len(batches)} API batches)...")
+
+    def price_linked(keys):
+        rows = []
+        for key in keys:
+            for card in by_ref[key]:
+                if key not in cache:
+                    failures[str(card.id)] = f'Linked reference {key} not found in API.'
+                    continue
+                prices, image_url = cache[key]
+                new_price, error = price_from_cache(card, prices)
+                if error:
+                    failures[str(card.id)] = error
+                else:
+                    rows.append(price_update_row(card, new_price, image_url))
+                    updated[str(card.id)] = new_price
+        return rows
+
+    def price_named(keys, items):
+        rows = []
+        for key in keys:
+            candidates = [i for i in items if clean_card_name(i.get('name')).lower() == key]
+            for card in by_name[key]:
+                if card.card_number:
+                    num_key = normalize_number(card.card_number)
+                    card_candidates = [c for c in candidates if normalize_number(c.get('number')) == num_key]
+                else:
+                    card_candidates = candidates
+                match, error = select_price_candidate(card, card_candidates)
+                if not error:
+                    new_price, error = price_from_match(card, match)
+                if error:
+                    failures[str(card.id)] = error
+                else:
+                    rows.append(price_update_row(card, new_price, (match.get('images') or {}).get('small')))
+                    updated[str(card.id)] = new_price
+        return rows
+
+    def write(rows):
+        if rows:
+            db.session.execute(db.update(Card), rows)
+            bump_inventory_version(db.session, [owner_id])
+        db.session.commit()
+
+    cached_keys = [k for k in by_ref if k in cache]
+    write(price_linked(cached_keys))
+    done += sum(len(by_ref[k]) for k in cached_keys)
+    update_job(job_id, done=done, message=f"Priced {len(updated)} cards from cache, fetching the rest...")
+
+    http = api_session(pool_size=PRICE_CONCURRENCY)
+    with ThreadPoolExecutor(max_workers=PRICE_CONCURRENCY) as pool:
+        futures = {pool.submit(fetch_all_cards, http, q): (kind, keys) for kind, keys, q in batches}
+        while futures:
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                kind, keys = futures.pop(future)
+                groups = by_ref if kind == 'ref' else by_name
+                try:
+                    items = future.result()
+                    cache.update(store_reference_prices(items))
+                    write(price_linked(keys) if kind == 'ref' else price_named(keys, items))
+                except Exception as e:
+                    db.session.rollback()
+                    for k in keys:
+                        for card in groups[k]:
+                            failures[str(card.id)] = f'API Error: {str(e)}'
+                            updated.pop(str(card.id), None)
+                done += sum(len(groups[k]) for k in keys)
+            update_job(job_id, done=done, message=f"Updated {len(updated)} of {len(cards)} cards ({len(failures)} failed)...")
+
+    update_job(job_id, message=f"Updated {len(updated)} cards. {len(failures)} could not be priced.",
+               detail={'updated': updated, 'failures': failures})
+
+# --- Pokedex Completion ---
+# Every CardReferenceFinish row of a tracked species or of a set is a slot; a Card with the same
+# reference and finish_code fills it. CompletionCounter keeps the totals and each user's owned count.
+# Card writes adjust the owned counts by +/-1 from the flush hooks below; catalog-side changes
+# (syncs, force_variant, new trackers) recount the affected keys.
+#   python rebuild_completion.py   -> full repair
+
+COMPLETION_SCOPES = ('species', 'set')
+CATALOG_TOTALS = 0   # CompletionCounter.user_id holding total slots
+
+def owned_slots_query():
+    """Distinct (user_id, reference_id, finish_code) slots owned, restricted to finishes the reference has."""
+    return db.select(Card.user_id, Card.reference_id, Card.finish_code).join(
+        CardReferenceFinish, db.and_(CardReferenceFinish.reference_id == Card.reference_id,
+                                     CardReferenceFinish.finish_code == Card.finish_code)
+    ).distinct().subquery()
+
+def build_completion(scope, keys=None):
+    """Recounts totals and every user's owned slots for these keys (all keys of the scope if None).
+    Two grouped SQL queries per scope, whatever the number of keys."""
+    owned = owned_slots_query()
+    if scope == 'species':
+        names = keys if keys is not None else [t.species_name for t in MasterTracker.query.all()]
+        names_by_key = {}
+        for name in names:
+            names_by_key.setdefault(species_key(name), []).append(name)
+        group = CardSpecies.species
+        totals = db.select(group, db.func.count()).join(
+            CardReferenceFinish, CardReferenceFinish.reference_id == CardSpecies.reference_id
+        ).where(group.in_(list(names_by_key))).group_by(group)
+        owned_counts = db.select(group, owned.c.user_id, db.func.count()).join(
+            owned, owned.c.reference_id == CardSpecies.reference_id
+        ).where(group.in_(list(names_by_key))).group_by(group, owned.c.user_id)
+        resolve = lambda sp: names_by_key[sp]
+        all_keys = names
+    else:
+        group = CardReference.set_id
+        totals = db.select(group, db.func.count()).join(
+            CardReferenceFinish, CardReferenceFinish.reference_id == CardReference.id
+        ).where(group.isnot(None)).group_by(group)
+        owned_counts = db.select(group, owned.c.user_id, db.func.count()).join(
+            owned, owned.c.reference_id == CardReference.id
+        ).where(group.isnot(None)).group_by(group, owned.c.user_id)
+        if keys is not None:
+            totals = totals.where(group.in_(list(keys)))
+            owned_counts = owned_counts.where(group.in_(list(keys)))
+        resolve = lambda set_id: [set_id]
+        all_keys = keys or []
+
+    # Keys without any slot still get a totals row, so they count as built
+    total_by_key = {key: 0 for key in all_keys}
+    for group_key, n in db.session.execute(totals):
+        for key in resolve(group_key):
+            total_by_key[key] = n
+    rows = [{'user_id': CATALOG_TOTALS, 'scope': scope, 'key': key, 'slots': n} for key, n in total_by_key.items()]
+    for group_key, user_id, n in db.session.execute(owned_counts):
+        rows += [{'user_id': user_id, 'scope': scope, 'key': key, 'slots': n} for key in resolve(group_key)]
+
+    query = CompletionCounter.query.filter(CompletionCounter.scope == scope)
+    if keys is not None:
+        query = query.filter(CompletionCounter.key.in_(list(keys)))
+    query.delete(synchronize_session=False)
+    if rows:
+        db.session.execute(db.insert(CompletionCounter), rows)
+    return len(rows)
+
+def rebuild_completion_counters():
+    """Full repair of every counter (rebuild_completion.py, snapshot imports, nuke_cache.py). Caller commits."""
+    return {scope: build_completion(scope) for scope in COMPLETION_SCOPES}
+
+def recount_reference_completion(ref):
+    """Recounts the species and set a single reference belongs to (after its finishes change)."""
+    recount_references_completion([ref.id])
+
+def recount_references_completion(ref_ids):
+    """Recounts every species and set these references belong to (new printings or finishes from a sync)."""
+    ref_ids = sorted(set(ref_ids))
+    keys, set_ids = set(), set()
+    for start in range(0, len(ref_ids), MATCH_CHUNK_SIZE):
+        chunk = ref_ids[start:start + MATCH_CHUNK_SIZE]
+        keys.update(sp for (sp,) in db.session.query(CardSpecies.species).filter(CardSpecies.reference_id.in_(chunk)))
+        set_ids.update(set_id for (set_id,) in db.session.query(CardReference.set_id).filter(
+            CardReference.id.in_(chunk), CardReference.set_id.isnot(None)))
+    species = [t.species_name for t in MasterTracker.query.all() if species_key(t.species_name) in keys]
+    if species:
+        build_completion('species', species)
+    if set_ids:
+        build_completion('set', sorted(set_ids))
+
+def owned_slot_state(session, slots, in_stock=False):
+    """Which of these (user_id, reference_id, finish_code) slots currently have at least one Card
+    (with quantity > 0 if in_stock)."""
+    slots = {slot for slot in slots if all(slot)}
+    if not slots:
+        return set()
+    users = {u for u, _, _ in slots}
+    refs = list({r for _, r, _ in slots})
+    owned = set()
+    with session.no_autoflush:
+        for start in range(0, len(refs), MATCH_CHUNK_SIZE):
+            stmt = db.select(Card.user_id, Card.reference_id, Card.finish_code).where(
+                Card.user_id.in_(users), Card.reference_id.in_(refs[start:start + MATCH_CHUNK_SIZE]))
+            if in_stock:
+                stmt = stmt.where(Card.quantity > 0)
+            owned.update(tuple(row) for row in session.execute(stmt))
+    return owned & slots
+
+def apply_completion_deltas(session, slots, before, after):
+    """Turns slot ownership changes into +/-1 updates on existing counters (keys never built are left
+    for build_completion)."""
+    changed = {slot: (1 if slot in after else -1) for slot in (before ^ after) & slots}
+    if not changed:
+        return
+    for user_id in {u for u, _, _ in changed}:
+        invalidate_hunt_cache(session, {r for u, r, _ in changed if u == user_id}, user_id=user_id)
+    with session.no_autoflush:
+        refs = {r.id: r for r in session.execute(db.select(CardReference.id, CardReference.set_id).where(
+            CardReference.id.in_(list({r for _, r, _ in changed}))))}
+        slot_exists = {tuple(row) for row in session.execute(db.select(
+            CardReferenceFinish.reference_id, CardReferenceFinish.finish_code
+        ).where(CardReferenceFinish.reference_id.in_(list(refs))))}
+        trackers = {}
+        for (name,) in session.execute(db.select(MasterTracker.species_name)):
+            trackers.setdefault(species_key(name), []).append(name)
+        ref_species = {}
+        for ref_id, sp in session.execute(db.select(CardSpecies.reference_id, CardSpecies.species).where(
+                CardSpecies.reference_id.in_(list(refs)), CardSpecies.species.in_(list(trackers)))):
+            ref_species.setdefault(ref_id, []).extend(trackers[sp])
+
+        deltas = {}
+        for (user_id, ref_id, f), delta in changed.items():
+            ref = refs.get(ref_id)
+            if not ref or (ref_id, f) not in slot_exists:
+                continue
+            keys = [('species', name) for name in ref_species.get(ref_id, [])]
+            if ref.set_id:
+                keys.append(('set', ref.set_id))
+            for scope, key in keys:
+                deltas[(user_id, scope, key)] = deltas.get((user_id, scope, key), 0) + delta
+        deltas = {k: d for k, d in deltas.items() if d}
+        if not deltas:
+            return
+
+        built = {(r.scope, r.key) for r in session.execute(db.select(CompletionCounter.scope, CompletionCounter.key).where(
+            CompletionCounter.user_id == CATALOG_TOTALS,
+            CompletionCounter.key.in_(list({key for _, _, key in deltas}))))}
+        existing = {(r.user_id, r.scope, r.key) for r in session.execute(db.select(
+            CompletionCounter.user_id, CompletionCounter.scope, CompletionCounter.key
+        ).where(CompletionCounter.user_id.in_(list({u for u, _, _ in deltas})),
+                CompletionCounter.key.in_(list({key for _, _, key in deltas}))))}
+
+    table = CompletionCounter.__table__
+    updates, inserts = [], []
+    for (user_id, scope, key), delta in deltas.items():
+        if (scope, key) not in built:
+            continue
+        if (user_id, scope, key) in existing:
+            updates.append({'u': user_id, 's': scope, 'k': key, 'd': delta})
+        elif delta > 0:
+            inserts.append({'user_id': user_id, 'scope': scope, 'key': key, 'slots': delta})
+    conn = session.connection()
+    if updates:
+        conn.execute(table.update().where(
+            table.c.user_id == db.bindparam('u'), table.c.scope == db.bindparam('s'), table.c.key == db.bindparam('k')
+        ).values(slots=table.c.slots + db.bindparam('d')), updates)
+    if inserts:
+        conn.execute(table.insert(), inserts)
+
+@event.listens_for(db.session, 'before_flush')
+def _completion_before_flush(session, flush_context, instances):
+    slots = set()
+    stored_ids = []
+    for card in session.new:
+        if isinstance(card, Card):
+            slots.add((card.user_id, card.reference_id, finish_code(card.finish)))
+    for card in session.deleted:
+        if isinstance(card, Card):
+            stored_ids.append(card.id)
+    for card in session.dirty:
+        if isinstance(card, Card) and session.is_modified(card):
+            state = db.inspect(card)
+            if any(state.attrs[a].history.has_changes() for a in ('user_id', 'reference_id', 'finish', 'quantity')):
+                stored_ids.append(card.id)
+                slots.add((card.user_id, card.reference_id, finish_code(card.finish)))
+    # Old values straight from the table (expired objects don't keep them in their history)
+    with session.no_autoflush:
+        for start in range(0, len(stored_ids), MATCH_CHUNK_SIZE):
+            rows = session.execute(db.select(Card.user_id, Card.reference_id, Card.finish_code).where(
+                Card.id.in_(stored_ids[start:start + MATCH_CHUNK_SIZE])))
+            slots.update(tuple(row) for row in rows)
+    slots = {slot for slot in slots if all(slot)}
+    if slots:
+        session.info['completion_slots'] = (slots, owned_slot_state(session, slots))
+
+@event.listens_for(db.session, 'after_flush')
+def _completion_after_flush(session, flush_context):
+    pending = session.info.pop('completion_slots', None)
+    if pending:
+        slots, before = pending
+        after = owned_slot_state(session, slots)
+        apply_completion_deltas(session, slots, before, after)
+        sync_trade_slots(session, slots)
+
+def read_completion(user_id, scope, keys):
+    """[{'name', 'total', 'owned', 'percent'}] in keys order, building counters never built before."""
+    def load():
+        rows = CompletionCounter.query.filter(
+            CompletionCounter.scope == scope, CompletionCounter.key.in_(list(keys)),
+            CompletionCounter.user_id.in_([CATALOG_TOTALS, user_id])).all()
+        totals = {r.key: r.slots for r in rows if r.user_id == CATALOG_TOTALS}
+        owned = {r.key: r.slots for r in rows if r.user_id == user_id and user_id != CATALOG_TOTALS}
+        return totals, owned
+
+    totals, owned = load()
+    missing = [key for key in keys if key not in totals]
+    if missing:
+        build_completion(scope, missing)
+        db.session.commit()
+        totals, owned = load()
+
+    stats = []
+    for key in keys:
+        total_slots = totals.get(key, 0)
+        owned_count = owned.get(key, 0)
+        pct = int((owned_count / total_slots) * 100) if total_slots > 0 else 0
+        stats.append({'name': key, 'total': total_slots, 'owned': owned_count, 'percent': pct})
+    return stats
+
+# --- Hunt List Cache ---
+# Hunt mode is opened on phones at card shows, so each (user, species) list is computed once, stored in
+# HuntCache and served with an ETag. Entries are dropped only when that user's ownership of one of the
+# species' slots flips (completion flush hooks) or the species' catalog rows are re-indexed.
+
+def invalidate_hunt_cache(session, ref_ids=(), species=(), user_id=None):
+    """Drops cached hunt lists for the species of these references and/or these species keys
+    (only this user's if user_id is given). Safe inside flush hooks; caller commits."""
+    keys = set(species)
+    ref_ids = list(ref_ids)
+    with session.no_autoflush:
+        for start in range(0, len(ref_ids), MATCH_CHUNK_SIZE):
+            keys.update(sp for (sp,) in session.execute(db.select(CardSpecies.species).where(
+                CardSpecies.reference_id.in_(ref_ids[start:start + MATCH_CHUNK_SIZE])).distinct()))
+    if not keys:
+        return
+    table = HuntCache.__table__
+    stmt = table.delete().where(table.c.species.in_(list(keys)))
+    if user_id is not None:
+        stmt = stmt.where(table.c.user_id == user_id)
+    session.connection().execute(stmt)
+
+def build_hunt_targets(user_id, species):
+    """Missing finish slots of one species for one user, in release order, as compact rows:
+    [ref_id, name, set_name, number, year, image_url, [finish_code, ...]]"""
+    # Missing variants = the species' finish slots with no matching card of yours (one anti-join)
+    owned = db.exists().where(
+        Card.user_id == user_id,
+        Card.reference_id == CardReferenceFinish.reference_id,
+        Card.finish_code == CardReferenceFinish.finish_code,
+    )
+    rows = db.session.query(
+        CardReference.id, CardReference.name, CardReference.set_name, CardReference.number,
+        CardReference.release_date, CardReference.image_url, CardReferenceFinish.finish_code
+    ).join(
+        CardReferenceFinish, CardReferenceFinish.reference_id == CardReference.id
+    ).filter(
+        CardReference.id.in_(species_reference_ids(species)), ~owned
+    ).order_by(CardReference.release_date.asc(), CardReference.id, CardReferenceFinish.finish_code)
+
+    targets = []
+    for ref_id, name, set_name, number, released, image_url, code in rows:
+        if not targets or targets[-1][0] != ref_id:
+            targets.append([ref_id, name, set_name, number, (released or '')[:4], image_url, []])
+        targets[-1][6].append(code)
+    return targets
+
+def read_hunt_targets(user_id, species):
+    """(targets, etag) for a user's hunt list, building and storing the cache entry on a miss."""
+    key = species_key(species)
+    entry = db.session.get(HuntCache, (user_id, key))
+    if entry is not None:
+        return json.loads(entry.targets), entry.etag
+
+    targets = build_hunt_targets(user_id, key)
+    payload = json.dumps(targets, separators=(',', ':'))
+    row = {'user_id': user_id, 'species': key, 'targets': payload, 'built_at': datetime.utcnow(),
+           'etag': hashlib.sha1(f"{user_id}:{key}:{payload}".encode('utf-8')).hexdigest()}
+    dialect_insert = get_dialect_insert()
+    if dialect_insert is None:
+        db.session.merge(HuntCache(**row))
+    else:
+        # Two workers may miss at once; the second write just replaces the first
+        stmt = dialect_insert(HuntCache.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'species'],
+            set_={'targets': stmt.excluded.targets, 'etag': stmt.excluded.etag, 'built_at': stmt.excluded.built_at},
+        )
+        db.session.execute(stmt, [row])
+    db.session.commit()
+    return targets, row['etag']
+
+# --- Trade Matching ---
+# TradeSlot maps every (reference_id, finish_code) slot to the users who have it in stock and the users
+# hunting it, so "who has what I'm missing" / "who wants what I have" is one self-join per user.
+# Only collectors hunt: a user wants the missing slots of a tracked species once they own at least one slot
+# of it, so want rows are bounded by the species each user actually collects, not users x tracked slots.
+# Card writes resync their slots from the flush hooks; catalog and tracker changes rebuild the affected
+# references (the same places that recount completion).
+
+# Written by a full rebuild, like the CATALOG_TOTALS completion rows; its reference id matches no card
+TRADE_INDEX_BUILT = {'user_id': CATALOG_TOTALS, 'side': 'done', 'reference_id': '*', 'finish_code': 0}
+
+def tracked_species_keys(session=None):
+    return {species_key(name) for (name,) in (session or db.session).execute(db.select(MasterTracker.species_name))}
+
+def trade_index_built():
+    return db.session.query(TradeSlot.user_id).filter_by(**TRADE_INDEX_BUILT).first() is not None
+
+def claim_trade_index_build():
+    """Writes the built marker unless it is there. True means this caller claimed the build and must run
+    rebuild_trade_slots() before committing; a worker booting alongside waits on the write lock, then sees it."""
+    dialect_insert = get_dialect_insert()
+    if dialect_insert is None:
+        if trade_index_built():
+            return False
+        db.session.execute(TradeSlot.__table__.insert(), [TRADE_INDEX_BUILT])
+        return True
+    stmt = dialect_insert(TradeSlot.__table__).values(TRADE_INDEX_BUILT).on_conflict_do_nothing()
+    return bool(db.session.execute(stmt).rowcount)
+
+def collector_species(keys, user_ids=None):
+    """Subquery of distinct (user_id, species): users owning at least one slot of these species."""
+    stmt = db.select(Card.user_id, CardSpecies.species).join(
+        CardReferenceFinish, db.and_(CardReferenceFinish.reference_id == Card.reference_id,
+                                     CardReferenceFinish.finish_code == Card.finish_code)
+    ).join(CardSpecies, CardSpecies.reference_id == Card.reference_id).where(CardSpecies.species.in_(list(keys)))
+    if user_ids is not None:
+        stmt = stmt.where(Card.user_id.in_(list(user_ids)))
+    return stmt.distinct().subquery()
+
+def want_slots_select(keys, ref_ids, user_ids=None):
+    """INSERT source for the want rows of these references: slots of a species the user collects that the
+    user owns no card of."""
+    collectors = collector_species(keys, user_ids)
+    owned = db.exists().where(Card.user_id == collectors.c.user_id, Card.reference_id == CardReferenceFinish.reference_id,
+                              Card.finish_code == CardReferenceFinish.finish_code)
+    return db.select(
+        collectors.c.user_id, db.literal('want'), CardReferenceFinish.reference_id, CardReferenceFinish.finish_code
+    ).select_from(collectors).join(
+        CardSpecies, CardSpecies.species == collectors.c.species
+    ).join(
+        CardReferenceFinish, CardReferenceFinish.reference_id == CardSpecies.reference_id
+    ).where(CardReferenceFinish.reference_id.in_(list(ref_ids)), ~owned).distinct()
+
+TRADE_SLOT_COLUMNS = ['user_id', 'side', 'reference_id', 'finish_code']
+
+def sync_trade_slots(session, slots):
+    """Rewrites the TradeSlot rows of these (user_id, reference_id, finish_code) slots. A user whose only
+    owned slots of a tracked species are among them may have started or stopped collecting it, so their
+    wants for that whole species are recomputed too. Safe inside flush hooks."""
+    slots = {slot for slot in slots if all(slot)}
+    if not slots:
+        return
+    in_stock = owned_slot_state(session, slots, in_stock=True)
+    refs = list({r for _, r, _ in slots})
+    users = {u for u, _, _ in slots}
+    real, ref_species = set(), {}
+    keys = tracked_species_keys(session)
+    want_refs = {}
+    for user_id, ref_id, _ in slots:
+        want_refs.setdefault(user_id, set()).add(ref_id)
+    with session.no_autoflush:
+        for start in range(0, len(refs), MATCH_CHUNK_SIZE):
+            chunk = refs[start:start + MATCH_CHUNK_SIZE]
+            real.update(tuple(row) for row in session.execute(db.select(
+                CardReferenceFinish.reference_id, CardReferenceFinish.finish_code
+            ).where(CardReferenceFinish.reference_id.in_(chunk))))
+            if keys:
+                for ref_id, sp in session.execute(db.select(CardSpecies.reference_id, CardSpecies.species).where(
+                        CardSpecies.reference_id.in_(chunk), CardSpecies.species.in_(keys))):
+                    ref_species.setdefault(ref_id, set()).add(sp)
+        if ref_species:
+            touched = {(u, sp) for u, r, _ in slots for sp in ref_species.get(r, ())}
+            kept = set()
+            for user_id, sp, ref_id, code in session.execute(db.select(
+                Card.user_id, CardSpecies.species, Card.reference_id, Card.finish_code
+            ).join(CardReferenceFinish, db.and_(CardReferenceFinish.reference_id == Card.reference_id,
+                                                CardReferenceFinish.finish_code == Card.finish_code)
+            ).join(CardSpecies, CardSpecies.reference_id == Card.reference_id).where(
+                Card.user_id.in_(users), CardSpecies.species.in_({sp for _, sp in touched})
+            ).distinct()):
+                if (user_id, ref_id, code) not in slots:
+                    kept.add((user_id, sp))
+            for user_id, sp in touched - kept:
+                want_refs[user_id].update(r for (r,) in session.execute(
+                    db.select(CardSpecies.reference_id).where(CardSpecies.species == sp)))
+
+    table = TradeSlot.__table__
+    conn = session.connection()
+    conn.execute(table.delete().where(
+        table.c.user_id == db.bindparam('u'), table.c.reference_id == db.bindparam('r'),
+        table.c.finish_code == db.bindparam('f')
+    ), [{'u': u, 'r': r, 'f': f} for u, r, f in slots])
+    haves = [{'user_id': u, 'side': 'have', 'reference_id': r, 'finish_code': f}
+             for u, r, f in slots if (r, f) in real and (u, r, f) in in_stock]
+    if haves:
+        conn.execute(table.insert(), haves)
+    for user_id, ref_ids in want_refs.items():
+        ref_ids = sorted(ref_ids)
+        for start in range(0, len(ref_ids), MATCH_CHUNK_SIZE):
+            chunk = ref_ids[start:start + MATCH_CHUNK_SIZE]
+            conn.execute(table.delete().where(
+                table.c.user_id == user_id, table.c.side == 'want', table.c.reference_id.in_(chunk)))
+            if keys:
+                conn.execute(table.insert().from_select(TRADE_SLOT_COLUMNS, want_slots_select(keys, chunk, [user_id])))
+
+def species_trade_references(ref_ids):
+    """These references plus every reference sharing a tracked species with them: a finish added or dropped
+    by the catalog can start or end a user's collection of the species, which moves all of its want rows."""
+    ref_ids = set(ref_ids)
+    keys = tracked_species_keys()
+    if not keys:
+        return sorted(ref_ids)
+    species = set()
+    chunk_ids = sorted(ref_ids)
+    for start in range(0, len(chunk_ids), MATCH_CHUNK_SIZE):
+        species.update(sp for (sp,) in db.session.query(CardSpecies.species).filter(
+            CardSpecies.reference_id.in_(chunk_ids[start:start + MATCH_CHUNK_SIZE]), CardSpecies.species.in_(keys)))
+    if species:
+        ref_ids.update(r for (r,) in db.session.query(CardSpecies.reference_id).filter(CardSpecies.species.in_(species)))
+    return sorted(ref_ids)
+
+TRADE_REBUILD_USER_BATCH = 200
+
+def rebuild_trade_slots(ref_ids=None, user_ids=None):
+    """Recomputes TradeSlot for these references and/or users (everything if both are None, which also
+    marks the index as built). Each INSERT ... SELECT covers at most MATCH_CHUNK_SIZE references x
+    TRADE_REBUILD_USER_BATCH users. Caller commits."""
+    table = TradeSlot.__table__
+    keys = list(tracked_species_keys())
+    full = ref_ids is None and user_ids is None
+    if ref_ids is None:
+        # Whole catalog: clear once (this also drops rows of references that left the finish index),
+        # then walk the indexed references in chunks
+        delete = table.delete()
+        if user_ids is not None:
+            delete = delete.where(table.c.user_id.in_(list(user_ids)))
+        db.session.execute(delete)
+        ref_ids = [r for (r,) in db.session.query(CardReferenceFinish.reference_id).distinct().order_by(
+            CardReferenceFinish.reference_id)]
+        clear_chunks = False
+    else:
+        ref_ids = sorted(set(ref_ids))
+        clear_chunks = True
+    if user_ids is None:
+        # Only users with cards can have or want anything
+        user_ids = [u for (u,) in db.session.query(Card.user_id).distinct()]
+    user_ids = sorted(set(user_ids))
+    user_chunks = [user_ids[start:start + TRADE_REBUILD_USER_BATCH]
+                   for start in range(0, len(user_ids), TRADE_REBUILD_USER_BATCH)]
+
+    count = 0
+    for ref_start in range(0, len(ref_ids), MATCH_CHUNK_SIZE):
+        chunk = ref_ids[ref_start:ref_start + MATCH_CHUNK_SIZE]
+        for users in user_chunks:
+            if clear_chunks:
+                db.session.execute(table.delete().where(table.c.reference_id.in_(chunk), table.c.user_id.in_(users)))
+            have = db.select(Card.user_id, db.literal('have'), Card.reference_id, Card.finish_code).join(
+                CardReferenceFinish, db.and_(CardReferenceFinish.reference_id == Card.reference_id,
+                                             CardReferenceFinish.finish_code == Card.finish_code)
+            ).where(Card.quantity > 0, Card.reference_id.in_(chunk), Card.user_id.in_(users)).distinct()
+            count += db.session.execute(table.insert().from_select(TRADE_SLOT_COLUMNS, have)).rowcount or 0
+            if keys:
+                count += db.session.execute(table.insert().from_select(
+                    TRADE_SLOT_COLUMNS, want_slots_select(keys, chunk, users))).rowcount or 0
+    if full:
+        db.session.execute(table.insert(), [TRADE_INDEX_BUILT])
+    return count
+
+def trade_matches(user_id):
+    """{'they_have': [...], 'they_want': [...]} for one user: every other user holding a slot this user is
+    missing, and every other user hunting a slot this user has in stock. One indexed self-join."""
+    mine = db.aliased(TradeSlot)
+    theirs = db.aliased(TradeSlot)
+    rows = db.session.execute(db.select(
+        mine.side, theirs.user_id, User.username, CardReference.id, CardReference.name, CardReference.set_name,
+        CardReference.number, CardReference.image_url, mine.finish_code
+    ).join(theirs, db.and_(
+        theirs.reference_id == mine.reference_id, theirs.finish_code == mine.finish_code,
+        theirs.side != mine.side, theirs.user_id != mine.user_id
+    )).join(User, User.id == theirs.user_id).join(
+        CardReference, CardReference.id == mine.reference_id
+    ).where(mine.user_id == user_id).order_by(User.username, CardReference.name, CardReference.id, mine.finish_code))
+
+    result = {'they_have': [], 'they_want': []}
+    for side, other_id, username, ref_id, name, set_name, number, image_url, code in rows:
+        result['they_have' if side == 'want' else 'they_want'].append({
+            'user_id': other_id, 'username': username,
+            'reference_id': ref_id, 'name': name, 'set_name': set_name, 'number': number,
+            'image_url': image_url, 'finish': FINISH_LABELS.get(code),
+        })
+    return result
+
+# --- Trade Builder ---
+# The /trade screen never downloads a whole inventory. Each side picks a trader, searches their in-stock
+# cards through an indexed prefix scan (TRADE_SEARCH_LIMIT rows per keystroke), and adds lines to
+# session['trade']. Every change returns the valuation of both sides, priced in one query.
+
+TRADE_SIDES = ('a', 'b')
+TRADE_SEARCH_LIMIT = 30
+
+def empty_trade():
+    return {side: {'user': None, 'lines': {}} for side in TRADE_SIDES}
+
+def trade_search(user_id, query, limit=TRADE_SEARCH_LIMIT):
+    """In-stock cards of one trader whose name starts with the query (index range on name_key), topped up
+    with name/set substring matches when the prefix alone doesn't fill the list."""
+    key = normalize_name(query)
+    if not key:
+        return []
+    base = Card.query.filter(Card.user_id == user_id, Card.quantity > 0)
+    cards = base.filter(Card.name_key >= key, Card.name_key < key + '\uffff').order_by(
+        Card.name_key, Card.id).limit(limit).all()
+    if len(cards) < limit:
+        seen = [c.id for c in cards]
+        filters = [db.or_(Card.card_name.ilike(f'%{term}%'), Card.set_name.ilike(f'%{term}%')) for term in query.split()]
+        if seen:
+            filters.append(Card.id.notin_(seen))
+        cards += base.filter(*filters).order_by(Card.card_name, Card.id).limit(limit - len(cards)).all()
+    return cards
+
+def trade_valuation(trade):
+    """Lines, asking totals and market totals for both sides, plus the differences (a - b).
+    Cards and their cached reference prices for both sides come from one query."""
+    card_ids = {int(card_id) for side in TRADE_SIDES for card_id in trade[side]['lines']}
+    rows = {}
+    for start in range(0, len(card_ids), MATCH_CHUNK_SIZE):
+        chunk = sorted(card_ids)[start:start + MATCH_CHUNK_SIZE]
+        for row in db.session.query(
+            Card.id, Card.user_id, Card.card_name, Card.set_name, Card.finish, Card.condition, Card.price,
+            Card.quantity, Card.image_url, Card.game, CardReference.prices
+        ).outerjoin(CardReference, CardReference.id == Card.reference_id).filter(Card.id.in_(chunk)):
+            rows[row.id] = row
+
+    owners = {trade[side]['user'] for side in TRADE_SIDES if trade[side]['user']}
+    user_ids = dict(db.session.query(User.username, User.id).filter(User.username.in_(owners))) if owners else {}
+    result = {}
+    for side in TRADE_SIDES:
+        lines, total, market_total = [], 0.0, 0.0
+        for card_id, qty in trade[side]['lines'].items():
+            row = rows.get(int(card_id))
+            # Sold out or moved to someone else since it was added: drop it from the valuation
+            if not row or row.user_id != user_ids.get(trade[side]['user']):
+                continue
+            qty = min(qty, row.quantity or 0)
+            if qty <= 0:
+                continue
+            market, _ = price_from_cache(row, json.loads(row.prices) if row.prices else None)
+            market = market or row.price or 0.0
+            lines.append({
+                'id': row.id, 'name': row.card_name, 'set_name': row.set_name, 'finish': row.finish,
+                'condition': row.condition, 'qty': qty, 'available': row.quantity,
+                'price': row.price or 0.0, 'market': market, 'image': thumb_url(row.image_url, 'sm', row.game),
+            })
+            total += (row.price or 0.0) * qty
+            market_total += market * qty
+        result[side] = {'user': trade[side]['user'], 'lines': lines,
+                        'total': round(total, 2), 'market_total': round(market_total, 2)}
+    result['diff'] = round(result['a']['total'] - result['b']['total'], 2)
+    result['market_diff'] = round(result['a']['market_total'] - result['b']['market_total'], 2)
+    return result
+
+# --- POS Tickets ---
+# A terminal's ticket id lives in session['pos_ticket']; the ticket and its lines live in the database, so a
+# reload or a crashed browser picks up where it left off. Each line operation touches one PosLine row and
+# moves the ticket totals with one relative UPDATE; the POS screen gets back only the changed line + totals.
+
+def get_pos_ticket(user_id, ticket_id):
+    ticket = db.session.get(PosTicket, ticket_id) if ticket_id else None
+    if ticket and ticket.user_id == user_id and ticket.status == 'open':
+        return ticket
+    return None
+
+def current_pos_ticket(create=True):
+    """This terminal's open ticket, starting a new one if it has none (or it was completed elsewhere)."""
+    ticket = get_pos_ticket(current_user.id, session.get('pos_ticket'))
+    if not ticket and create:
+        ticket = PosTicket(user_id=current_user.id)
+        db.session.add(ticket)
+        db.session.commit()
+        session['pos_ticket'] = ticket.id
+    return ticket
+
+def pos_ticket_dict(ticket):
+    lines = PosLine.query.filter_by(ticket_id=ticket.id).order_by(PosLine.id).all()
+    return {'id': ticket.id, 'totals': ticket.totals(), 'lines': [line.to_dict() for line in lines]}
+
+def move_ticket_totals(ticket_id, amount=0.0, direction='out', items=0):
+    column = PosTicket.total_out if direction == 'out' else PosTicket.total_in
+    db.session.execute(db.update(PosTicket).where(PosTicket.id == ticket_id).values({
+        column: column + amount, PosTicket.item_count: PosTicket.item_count + items,
+        PosTicket.version: PosTicket.version + 1, PosTicket.updated_at: datetime.utcnow(),
+    }))
+
+def pos_add_line(ticket, direction, name, base_price, multiplier=1.0, card_id=None, reference_id=None):
+    """Adds one unit and returns its line. Selling the same inventory card again bumps that line's
+    quantity instead. Raises ValueError when an out line would exceed the card's stock."""
+    price = round(base_price * multiplier, 2)
+    line = None
+    if card_id is not None:
+        line = PosLine.query.filter_by(ticket_id=ticket.id, direction=direction, card_id=card_id).first()
+    if direction == 'out' and card_id is not None:
+        in_stock = db.session.query(Card.quantity).filter_by(id=card_id).scalar() or 0
+        if (line.quantity if line else 0) >= in_stock:
+            raise ValueError(f"Only {in_stock} in stock.")
+    if line:
+        db.session.execute(db.update(PosLine).where(PosLine.id == line.id).values(quantity=PosLine.quantity + 1))
+        price = line.price
+    else:
+        line = PosLine(ticket_id=ticket.id, direction=direction, card_id=card_id, reference_id=reference_id,
+                       name=name[:200], base_price=base_price, multiplier=multiplier, price=price)
+        db.session.add(line)
+    move_ticket_totals(ticket.id, price, direction, 1)
+    db.session.commit()
+    return line
+
+def pos_remove_line(ticket, line_id):
+    """Drops a whole line. Returns False if it isn't on this ticket."""
+    line = PosLine.query.filter_by(id=line_id, ticket_id=ticket.id).first()
+    if not line:
+        return False
+    move_ticket_totals(ticket.id, -line.price * line.quantity, line.direction, -line.quantity)
+    db.session.delete(line)
+    db.session.commit()
+    return True
+
+def pos_clear_ticket(ticket):
+    PosLine.query.filter_by(ticket_id=ticket.id).delete()
+    db.session.execute(db.update(PosTicket).where(PosTicket.id == ticket.id).values(
+        total_out=0.0, total_in=0.0, item_count=0, version=PosTicket.version + 1, updated_at=datetime.utcnow()))
+    db.session.commit()
+
+# --- POS Checkout ---
+# Checkout is one transaction: claim the ticket (status + version), take stock for every out line with
+# conditional decrements, bulk-insert the Sales and add the trade-ins to inventory. If any card came up
+# short, everything rolls back and the conflicting lines are reported; nothing is oversold.
+
+TRADE_IN_SET_NAME = 'Trade-In'
+
+def take_stock(user_id, wanted):
+    """Takes {card_id: qty} out of one user's stock. Each card is only decremented if it still has at least
+    qty (quantity >= n in the UPDATE itself), so two terminals or workers can't both sell the last copy.
+    Cards that reach 0 are deleted, like a manual sale. Returns {card_id: available} for the cards that came
+    up short, after rolling the whole transaction back; {} on success (caller commits)."""
+    if not wanted:
+        return {}
+    table = Card.__table__
+    card_ids = list(wanted)
+    slots = {(user_id, r, f) for r, f in db.session.query(Card.reference_id, Card.finish_code).filter(
+        Card.id.in_(card_ids), Card.user_id == user_id)}
+    before = owned_slot_state(db.session, slots)
+
+    stmt = table.update().where(
+        table.c.id == db.bindparam('card_id'), table.c.user_id == user_id, table.c.quantity >= db.bindparam('n')
+    ).values(quantity=table.c.quantity - db.bindparam('n'), last_updated=datetime.utcnow())
+    rows = [{'card_id': card_id, 'n': n} for card_id, n in wanted.items()]
+    conn = db.session.connection()
+    if db.engine.dialect.supports_sane_multi_rowcount:
+        applied = conn.execute(stmt, rows).rowcount
+    else:
+        applied = sum(conn.execute(stmt, row).rowcount for row in rows)
+    if applied != len(rows):
+        db.session.rollback()
+        stock = dict(db.session.query(Card.id, Card.quantity).filter(Card.id.in_(card_ids), Card.user_id == user_id))
+        return {card_id: stock.get(card_id) or 0 for card_id, n in wanted.items() if (stock.get(card_id) or 0) < n}
+
+    conn.execute(table.delete().where(table.c.id.in_(card_ids), table.c.quantity <= 0))
+    # Core statements skip the flush hooks, so keep the completion counters and trade index in step by hand
+    after = owned_slot_state(db.session, slots)
+    apply_completion_deltas(db.session, slots, before, after)
+    sync_trade_slots(db.session, slots)
+    bump_inventory_version(db.session, [user_id])
+    return {}
+
+def pos_checkout(ticket_id, user_id, expected_version=None):
+    """Completes an open ticket. Returns (summary, None) or (None, conflicts) with the ticket left open."""
+    claim = db.update(PosTicket).where(
+        PosTicket.id == ticket_id, PosTicket.user_id == user_id, PosTicket.status == 'open')
+    if expected_version is not None:
+        claim = claim.where(PosTicket.version == expected_version)
+    if not db.session.execute(claim.values(status='completed', updated_at=datetime.utcnow())).rowcount:
+        db.session.rollback()
+        return None, [{'error': 'This ticket changed or was already checked out. Reload and try again.'}]
+
+    lines = [line.to_dict() for line in PosLine.query.filter_by(ticket_id=ticket_id).order_by(PosLine.id)]
+    out_lines = [l for l in lines if l['direction'] == 'out']
+    in_lines = [l for l in lines if l['direction'] == 'in']
+    wanted = {}
+    for line in out_lines:
+        if line['card_id']:
+            wanted[line['card_id']] = wanted.get(line['card_id'], 0) + line['quantity']
+    cards = {c.id: c for c in db.session.query(Card.id, Card.card_name, Card.set_name).filter(
+        Card.id.in_(list(wanted)), Card.user_id == user_id)} if wanted else {}
+
+    shortages = take_stock(user_id, wanted)
+    if shortages:
+        return None, [{'line_id': l['id'], 'card_id': l['card_id'], 'name': l['name'],
+                       'wanted': l['quantity'], 'available': shortages[l['card_id']]}
+                      for l in out_lines if l['card_id'] in shortages]
+
+    now = datetime.utcnow()
+    sales = []
+    for line in out_lines:
+        card = cards.get(line['card_id'])
+        sales.append({'user_id': user_id, 'card_name': card.card_name if card else line['name'],
+                      'set_name': card.set_name if card else None, 'sale_price': round(line['price'] * line['quantity'], 2),
+                      'quantity': line['quantity'], 'sale_date': now})
+    if sales:
+        db.session.execute(db.insert(Sale), sales)
+
+    refs = {r.id: r for r in CardReference.query.filter(
+        CardReference.id.in_([l['reference_id'] for l in in_lines if l['reference_id']]))} if in_lines else {}
+    trade_ins = []
+    for line in in_lines:
+        ref = refs.get(line['reference_id'])
+        trade_ins.append(Card(
+            user_id=user_id, game='Pokemon' if ref else 'Other', quantity=line['quantity'], price=line['base_price'],
+            card_name=ref.name if ref else line['name'], set_name=ref.set_name if ref else TRADE_IN_SET_NAME,
+            card_number=ref.number if ref else None, reference_id=ref.id if ref else None,
+            image_url=ref.image_url if ref else None, condition='NM', finish='Normal',
+        ))
+    db.session.add_all(trade_ins)
+    db.session.commit()
+
+    ticket = db.session.get(PosTicket, ticket_id)
+    return {'ticket': ticket_id, 'sold': sum(l['quantity'] for l in out_lines), 'traded_in': len(trade_ins),
+            **ticket.totals()}, None
+
+# --- Storefront Cache ---
+# Public storefront pages and /api/inventory are rendered once per (user, inventory_version, variant) and
+# served with a strong ETag + Last-Modified, so browsers and the Cloudflare tunnel revalidate with a 304.
+# Every Card/Settings write bumps User.inventory_version: ORM writes from the flush hooks below, bulk
+# UPDATEs by calling bump_inventory_version (next to the Card key listeners) themselves. Rendered bodies live in a small per-worker LRU;
+# the version comes from the database, so workers never serve each other's stale pages.
+
+STOREFRONT_CACHE_SIZE = 256
+STOREFRONT_TEMPLATES = ('base.html', 'index.html', 'storefront_cards.html')
+
+def template_fingerprint(names):
+    """Hash of template sources, so a deploy that changes the markup also changes every ETag."""
+    digest = hashlib.sha1()
+    for name in names:
+        try:
+            with open(os.path.join(app.root_path, app.template_folder, name), 'rb') as f:
+                digest.update(f.read())
+        except OSError:
+            digest.update(name.encode('utf-8'))
+    return digest.hexdigest()[:12]
+
+STOREFRONT_FINGERPRINT = template_fingerprint(STOREFRONT_TEMPLATES)
+storefront_cache = OrderedDict()
+storefront_cache_lock = threading.Lock()
+
+@event.listens_for(db.session, 'before_flush')
+def _inventory_version_before_flush(session, flush_context, instances):
+    users = set()
+    with session.no_autoflush:
+        for obj in list(session.new) + list(session.deleted):
+            if isinstance(obj, (Card, Settings)):
+                users.add(obj.user_id)
+        for obj in session.dirty:
+            if isinstance(obj, (Card, Settings)) and session.is_modified(obj):
+                users.add(obj.user_id)
+                users.update(db.inspect(obj).attrs.user_id.history.deleted)   # card moved between users
+    if users:
+        session.info.setdefault('inventory_users', set()).update(users)
+
+@event.listens_for(db.session, 'after_flush')
+def _inventory_version_after_flush(session, flush_context):
+    users = session.info.pop('inventory_users', None)
+    if users:
+        bump_inventory_version(session, users)
+
+def storefront_etag(user, variant):
+    return hashlib.sha1(repr((STOREFRONT_FINGERPRINT, user.id, user.inventory_version or 0, variant)).encode('utf-8')).hexdigest()
+
+def storefront_headers(response, user, etag, public=True, encoding=None):
+    response.set_etag(etag)
+    if user.inventory_updated_at:
+        response.last_modified = user.inventory_updated_at
+    response.headers['Cache-Control'] = 'public, no-cache' if public else 'private, no-cache'
+    response.vary.add('Cookie')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+    return response
+
+def cached_storefront_response(user, variant, render, mimetype='text/html', public=True, encoding=None):
+    """Serves render() for the user's current inventory_version, with ETag / Last-Modified revalidation.
+    variant: everything besides the inventory the body depends on (query string, viewer, encoding...).
+    render() returns the body, or (body, extra headers). A matching If-None-Match gets a 304 without
+    rendering or touching the cache."""
+    key = (user.id, user.inventory_version or 0, variant)
+    etag = storefront_etag(user, variant)
+    if request.if_none_match.contains(etag):
+        return storefront_headers(make_response('', 304), user, etag, public)
+
+    with storefront_cache_lock:
+        entry = storefront_cache.get(key)
+        if entry is not None:
+            storefront_cache.move_to_end(key)
+    if entry is None:
+        entry = render()
+        if not isinstance(entry, tuple):
+            entry = (entry, {})
+        with storefront_cache_lock:
+            storefront_cache[key] = entry
+            while len(storefront_cache) > STOREFRONT_CACHE_SIZE:
+                storefront_cache.popitem(last=False)
+    body, headers = entry
+    response = make_response(body)
+    response.mimetype = mimetype
+    response.headers.update(headers)
+    return storefront_headers(response, user, etag, public, encoding).make_conditional(request)
+
+# --- Card Images ---
+# Pages never hot-link remote card art: thumb_url() points at /img/<size>/..., which serves the local copy
+# from instance/images with a year-long cache. On a miss it redirects to the source and hands the download /
+# resize to this worker's image-warmer threads, so a request never waits on a remote host or Pillow.
+# URLs are HMAC-signed and limited to IMAGE_HOSTS so the route can't be used as an open proxy.
+# Missing image_url values are resolved by a background job (Settings & Tools -> Resolve Card Images).
+
+IMAGE_ROOT = os.path.join(app.instance_path, 'images')
+IMAGE_SIZES = {'sm': 250, 'md': 500}   # max width in px; 'full' is the downloaded original
+IMAGE_HOSTS = {
+    'images.pokemontcg.io', 'cards.scryfall.io', 'c1.scryfall.com',
+    'tcg.pokemon.com', 'upload.wikimedia.org',
+}
+IMAGE_MAX_BYTES = 8 * 1024 * 1024
+IMAGE_RETRY_AFTER = timedelta(hours=24)     # after a failed download
+IMAGE_CACHE_MAX_AGE = 365 * 24 * 3600
+IMAGE_CONCURRENCY = int(os.environ.get('IMAGE_CONCURRENCY', 4))
+SCRYFALL_API_URL = "https://api.scryfall.com/cards"
+CARD_BACKS = {
+    'pokemon': "https://tcg.pokemon.com/assets/img/global/tcg-card-back-2x.jpg",
+    'default': "https://upload.wikimedia.org/wikipedia/en/a/aa/Magic_the_gathering-card_back.jpg",
+}
+
+def image_token(url):
+    return base64.urlsafe_b64encode(url.encode('utf-8')).decode('ascii').rstrip('=')
+
+def image_signature(token):
+    return hmac.new(app.config['SECRET_KEY'].encode('utf-8'), token.encode('ascii'), hashlib.sha256).hexdigest()[:16]
+
+def image_allowed(url):
+    parts = urlsplit(url or '')
+    return parts.scheme in ('http', 'https') and parts.hostname in IMAGE_HOSTS
 
-    last_updated = db.Column(db.DateTime, default=datetime.utcnow)
+@app.template_global()
+def thumb_url(image_url, size='sm', game=None):
+    """Local cached URL for a card image (a card back if there is none). Unknown hosts are left as-is."""
+    if not image_url:
+        image_url = CARD_BACKS['pokemon' if 'pokemon' in (game or '').lower() else 'default']
+    if not image_allowed(image_url):
+        return image_url
+    token = image_token(image_url)
+    return url_for('card_image', size=size, sig=image_signature(token), token=token)
 
-class Sale(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    card_name = db.Column(db.String(150), nullable=False)
-    set_name = db.Column(db.String(100))
-    sale_price = db.Column(db.Float, default=0.0)
-    quantity = db.Column(db.Integer, default=1)
-    sale_date = db.Column(db.DateTime, default=datetime.utcnow)
+def image_paths(url, size):
+    """(original path, path for this size) under IMAGE_ROOT, keyed by the source URL."""
+    key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+    ext = os.path.splitext(urlsplit(url).path)[1].lower()
+    if ext not in ('.png', '.jpg', '.jpeg', '.webp', '.gif'):
+        ext = '.jpg'
+    original = os.path.join(IMAGE_ROOT, 'full', key[:2], key + ext)
+    if size == 'full' or Image is None:
+        return original, original
+    return original, os.path.join(IMAGE_ROOT, size, key[:2], key + '.webp')
 
-# --- Startup & Migration Check ---
-with app.app_context():
-    db.create_all()
-    
-    admin_user = User.query.filter_by(username='flud').first()
-    if admin_user and not admin_user.is_admin:
-        admin_user.is_admin = True
-        db.session.commit()
+def write_atomic(path, data):
+    """Other workers may be writing the same file; whoever finishes last wins, readers never see a partial."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
 
-# --- Helper Functions ---
+def download_image(url, http=None):
+    """Path of the local original, downloading it on first use. Raises on failure; a failed URL is not
+    retried for IMAGE_RETRY_AFTER."""
+    original, _ = image_paths(url, 'full')
+    if os.path.exists(original):
+        return original
+    failed_marker = original + '.failed'
+    if os.path.exists(failed_marker) and time.time() - os.path.getmtime(failed_marker) < IMAGE_RETRY_AFTER.total_seconds():
+        raise RuntimeError(f"Recently failed: {url}")
+    try:
+        r = (http or requests).get(url, timeout=30, stream=True)
+        if r.status_code != 200 or not (r.headers.get('Content-Type') or '').startswith('image/'):
+            raise RuntimeError(f"HTTP {r.status_code} for {url}")
+        data = b''
+        for chunk in r.iter_content(64 * 1024):
+            data += chunk
+            if len(data) > IMAGE_MAX_BYTES:
+                raise RuntimeError(f"Image too large: {url}")
+    except Exception:
+        write_atomic(failed_marker, b'')
+        raise
+    write_atomic(original, data)
+    return original
 
-def get_user_settings(user_id):
-    settings = Settings.query.filter_by(user_id=user_id).first()
-    if not settings:
-        settings = Settings(user_id=user_id, show_prices=False)
-        db.session.add(settings)
+def ensure_image(url, size, http=None):
+    """Local file for url at this size, downloading / resizing on first use."""
+    original, path = image_paths(url, size)
+    if os.path.exists(path):
+        return path
+    download_image(url, http)
+    if path == original:
+        return path
+    with Image.open(original) as img:
+        img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+        width = IMAGE_SIZES[size]
+        img.thumbnail((width, width * 2), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, 'WEBP', quality=82, method=4)
+    write_atomic(path, out.getvalue())
+    return path
+
+image_queue = queue.Queue(maxsize=1000)
+image_pending = set()
+image_pending_lock = threading.Lock()
+
+def run_image_warmer():
+    http = requests.Session()
+    while True:
+        url, size = image_queue.get()
+        try:
+            ensure_image(url, size, http)
+        except Exception:
+            pass   # download_image leaves a .failed marker; the route keeps redirecting to the source
+        finally:
+            with image_pending_lock:
+                image_pending.discard((url, size))
+
+def warm_image(url, size):
+    """Queues url at this size for the background warmers; repeats and overflow are dropped."""
+    with image_pending_lock:
+        if (url, size) in image_pending:
+            return
+        image_pending.add((url, size))
+    try:
+        image_queue.put_nowait((url, size))
+    except queue.Full:
+        with image_pending_lock:
+            image_pending.discard((url, size))
+        return
+    for i in range(IMAGE_CONCURRENCY):
+        start_worker_thread(f'image-warmer-{i}', run_image_warmer)
+
+def resolve_card_image(http, card_name, set_name, game):
+    """Image URL for an unlinked card: pokemontcg.io for Pokemon, Scryfall for Magic, else None."""
+    game = (game or '').lower()
+    if 'magic' in game or 'mtg' in game:
+        r = http.get(f"{SCRYFALL_API_URL}/named", params={'fuzzy': card_name}, timeout=30)
+        time.sleep(0.1)   # Scryfall asks for <= 10 requests/second
+        if r.status_code != 200:
+            return None
+        data = r.json()
+        uris = data.get('image_uris') or ((data.get('card_faces') or [{}])[0].get('image_uris') or {})
+        return uris.get('normal') or uris.get('small')
+    if 'pokemon' in game:
+        name = clean_card_name(card_name)
+        queries = [f'name:"{name}" set.name:"{set_name}"', f'name:"{name}"'] if set_name else [f'name:"{name}"']
+        for q in queries:
+            items = fetch_card_page(http, 1, q=q, page_size=1).get('data') or []
+            if items:
+                return (items[0].get('images') or {}).get('small')
+    return None
+
+def run_image_backfill(job_id, owner_id):
+    """Fills missing image_url for one user's cards (and the references they link to), then warms the
+    storefront thumbnails of every in-stock card."""
+    missing = Card.query.filter(Card.user_id == owner_id, db.or_(Card.image_url.is_(None), Card.image_url == '')).all()
+
+    # 1. References without art: one batched API lookup
+    ref_ids = sorted({c.reference_id for c in missing if c.reference_id})
+    blank_refs = []
+    for start in range(0, len(ref_ids), MATCH_CHUNK_SIZE):
+        blank_refs += [r for (r,) in db.session.query(CardReference.id).filter(
+            CardReference.id.in_(ref_ids[start:start + MATCH_CHUNK_SIZE]),
+            db.or_(CardReference.image_url.is_(None), CardReference.image_url == ''))]
+    update_job(job_id, total=len(missing), message=f"Resolving images for {len(missing)} cards...")
+    if blank_refs:
+        fetched = refresh_reference_prices(blank_refs)
+        rows = [{'id': ref_id, 'image_url': image} for ref_id, (_, image) in fetched.items() if image]
+        if rows:
+            db.session.execute(db.update(CardReference), rows)
         db.session.commit()
-    return settings
 
-# --- Helper Functions CONT.---
+    # 2. Linked cards copy their reference's art
+    ref_images = {}
+    for start in range(0, len(ref_ids), MATCH_CHUNK_SIZE):
+        ref_images.update(db.session.query(CardReference.id, CardReference.image_url).filter(
+            CardReference.id.in_(ref_ids[start:start + MATCH_CHUNK_SIZE]), CardReference.image_url.isnot(None)).all())
+    rows = [{'id': c.id, 'image_url': ref_images[c.reference_id]} for c in missing if ref_images.get(c.reference_id)]
+    resolved = {row['id'] for row in rows}
 
-def get_clean_finishes(tcgplayer_data):
-    """Parses TCGPlayer pricing tiers to determine available card variants."""
-    if not tcgplayer_data or 'prices' not in tcgplayer_data:
-        return "Normal"
-    
-    raw_finishes = tcgplayer_data['prices'].keys()
-    clean_finishes = []
-    
-    for f in raw_finishes:
-        f_lower = f.lower()
-        if f_lower == 'normal': 
-            clean_finishes.append('Normal')
-        elif f_lower == 'holofoil': 
-            clean_finishes.append('Holo')
-        elif f_lower == 'reverseholofoil': 
-            clean_finishes.append('Reverse Holo')
-        elif f_lower == '1steditionholofoil': 
-            clean_finishes.append('1st Edition Holo')
-        elif f_lower == '1steditionnormal' or f_lower == '1stedition': 
-            clean_finishes.append('1st Edition')
-        elif f_lower == 'unlimitedholofoil': 
-            clean_finishes.append('Unlimited Holo')
-        else: 
-            # Fallback for unexpected finishes: split CamelCase
-            cleaned = re.sub('([A-Z])', r' \1', f).strip().title()
-            clean_finishes.append(cleaned)
-            
-    return ",".join(clean_finishes) if clean_finishes else "Normal"
+    # 3. Unlinked (or still blank) cards: one remote lookup per distinct name/set/game
+    groups = {}
+    for c in missing:
+        if c.id not in resolved:
+            groups.setdefault((c.card_name, c.set_name, c.game), []).append(c.id)
+    failures = {}
+    http = api_session(pool_size=1)
+    done = len(rows)
+    for (name, set_name, game), card_ids in groups.items():
+        try:
+            image = resolve_card_image(http, name, set_name, game)
+        except Exception as e:
+            image = None
+            failures[name] = str(e)[:200]
+        if image:
+            rows += [{'id': cid, 'image_url': image} for cid in card_ids]
+        else:
+            failures.setdefault(name, 'No image found')
+        done += len(card_ids)
+        update_job(job_id, done=done, message=f"Resolved {len(rows)} of {len(missing)} card images...")
+    if rows:
+        db.session.execute(db.update(Card), rows)
+        bump_inventory_version(db.session, [owner_id])
+    db.session.commit()
+
+    # 4. Warm the storefront-size thumbnails so the first visitor doesn't pay for them
+    urls = {u for (u,) in db.session.query(Card.image_url).filter(
+        Card.user_id == owner_id, Card.quantity > 0, Card.image_url.isnot(None)).distinct() if image_allowed(u)}
+    update_job(job_id, message=f"Resolved {len(rows)} card images. Caching {len(urls)} thumbnails...")
+    cached = 0
+    image_http = requests.Session()
+    with ThreadPoolExecutor(max_workers=IMAGE_CONCURRENCY) as pool:
+        for future in [pool.submit(ensure_image, url, 'sm', image_http) for url in urls]:
+            try:
+                future.result()
+                cached += 1
+            except Exception:
+                pass
+    update_job(job_id, message=f"Resolved {len(rows)} card images ({len(failures)} not found), cached {cached} thumbnails.",
+               detail={'failures': failures} if failures else None)
 
 # --- Routes ---
 
@@ -252,50 +3090,156 @@ def profile():
 def link_orphans():
     # Find all Pokemon cards in your inventory that aren't linked to the dictionary
     orphans = Card.query.filter_by(user_id=current_user.id, reference_id=None, game='Pokemon TCG').all()
-    count = 0
-    
-    for card in orphans:
-        ref_match = None
-        
-        # 1. Normalize the data (The "Straggler Hunter" fix)
-        # Converts "5/62" -> "5", and strips trailing spaces
-        clean_num = str(card.card_number).split('/')[0].strip() if card.card_number else None
-        clean_name = card.card_name.strip()
-        clean_set = card.set_name.strip()
-
-        # 2. Strict Number Match (but case-insensitive for names/sets)
-        if clean_num:
-            ref_match = CardReference.query.filter(
-                CardReference.name.ilike(clean_name),
-                CardReference.set_name.ilike(f"%{clean_set}%"),
-                CardReference.number == clean_num
-            ).first()
-            
-        # 3. Fallback to just Name + Set if Number still fails
-        if not ref_match:
-            ref_match = CardReference.query.filter(
-                CardReference.name.ilike(clean_name),
-                CardReference.set_name.ilike(f"%{clean_set}%")
-            ).first()
-        
-        # 4. Link it!
-        if ref_match:
-            card.reference_id = ref_match.id
-            count += 1
-            
+
+    # One catalog load + one bulk UPDATE for the whole batch
+    matches, report = link_references_bulk(orphans)
     db.session.commit()
-    flash(f"🔗 Successfully linked {count} orphaned cards to the Pokedex!")
+
+    msg = f"🔗 Successfully linked {len(matches)} orphaned cards to the Pokedex!"
+    if report['ambiguous']:
+        msg += f" {len(report['ambiguous'])} ambiguous (add a card number to disambiguate)."
+    flash(msg)
     return redirect(url_for('admin'))
 
 # --- PUBLIC STOREFRONTS ---
+# Storefronts are opened from QR codes on phones, so only one page of cards is ever rendered. Search,
+# filters and sort run in SQL; pages are keyset-paginated on (sort column, id) via the ix_card_user_* indexes.
+
+STOREFRONT_PAGE_SIZE = 48
+# sort key -> (column, descending)
+STOREFRONT_SORTS = {
+    'price-desc': (Card.price, True),
+    'price-asc': (Card.price, False),
+    'name-asc': (Card.card_name, False),
+    'set-asc': (Card.set_name, False),
+    'newest': (Card.id, True),
+}
+
+def storefront_filters(args):
+    """Cleaned storefront filters from a request's query string."""
+    sort = args.get('sort', 'price-desc')
+    return {
+        'q': (args.get('q') or '').strip(),
+        'set': args.get('set') or '',
+        'game': args.get('game') or '',
+        'finish': args.get('finish') or '',
+        'graded': args.get('graded') if args.get('graded') in ('1', '0') else '',
+        'condition': args.get('condition') or '',
+        'sort': sort if sort in STOREFRONT_SORTS else 'price-desc',
+    }
+
+def storefront_query(user_id, filters):
+    """In-stock cards of one user matching the filters (unordered)."""
+    query = Card.query.filter(Card.user_id == user_id, Card.quantity > 0)
+    if filters['q']:
+        query = query.filter(Card.card_name.ilike(f"%{filters['q']}%"))
+    if filters['set']:
+        query = query.filter(Card.set_name == filters['set'])
+    if filters['game']:
+        query = query.filter(Card.game == filters['game'])
+    if filters['condition']:
+        query = query.filter(Card.condition == filters['condition'])
+    if filters['finish']:
+        query = query.filter(Card.finish_code == finish_code(filters['finish']))
+    if filters['graded'] == '1':
+        query = query.filter(Card.grading_company.isnot(None), Card.grading_company != '')
+    elif filters['graded'] == '0':
+        query = query.filter(db.or_(Card.grading_company.is_(None), Card.grading_company == ''))
+    return query
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """[sort value, id] from an encode_cursor string, or None if it's missing or mangled."""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except ValueError:
+        return None
+    if not (isinstance(values, list) and len(values) == 2 and isinstance(values[1], int)
+            and isinstance(values[0], (str, int, float))):
+        return None
+    return values
+
+def storefront_page(user_id, filters, cursor=None, limit=STOREFRONT_PAGE_SIZE):
+    """One page of storefront cards after the cursor. Returns (cards, next cursor or None)."""
+    column, descending = STOREFRONT_SORTS[filters['sort']]
+    query = storefront_query(user_id, filters)
+    after = decode_cursor(cursor)
+    if after:
+        value, last_id = after
+        if descending:
+            query = query.filter(db.or_(column < value, db.and_(column == value, Card.id < last_id)))
+        else:
+            query = query.filter(db.or_(column > value, db.and_(column == value, Card.id > last_id)))
+    order = (column.desc(), Card.id.desc()) if descending else (column.asc(), Card.id.asc())
+    cards = query.order_by(*order).limit(limit + 1).all()
+    if len(cards) <= limit:
+        return cards, None
+    cards = cards[:limit]
+    last = cards[-1]
+    return cards, encode_cursor([getattr(last, column.key), last.id])
+
+def storefront_options(user_id):
+    """Filter dropdown values and the in-stock card count, from one grouped query."""
+    rows = db.session.query(Card.game, Card.set_name, Card.condition, Card.finish_code, db.func.count()).filter(
+        Card.user_id == user_id, Card.quantity > 0
+    ).group_by(Card.game, Card.set_name, Card.condition, Card.finish_code).all()
+    return {
+        'games': sorted({r[0] for r in rows if r[0]}),
+        'sets': sorted({r[1] for r in rows if r[1]}),
+        'conditions': sorted({r[2] for r in rows if r[2]}),
+        'finishes': [FINISH_LABELS[code] for code in sorted({r[3] for r in rows if r[3] in FINISH_LABELS})],
+        'total': sum(r[4] for r in rows),
+    }
+
+def storefront_viewer(owner):
+    """Who is looking, as far as the rendered storefront markup cares (quote buttons, navbar)."""
+    if not current_user.is_authenticated:
+        return 'guest'
+    return 'owner' if current_user.id == owner.id else 'member'
 
 @app.route('/u/<username>')
 def user_storefront(username):
     user = User.query.filter_by(username=username.lower()).first_or_404()
-    settings = get_user_settings(user.id)
-    # Default Sort: Price High to Low
-    inventory = Card.query.filter_by(user_id=user.id).filter(Card.quantity > 0).order_by(Card.price.desc()).all()
-    return render_template('index.html', inventory=inventory, show_prices=settings.show_prices, owner=user)
+    viewer = storefront_viewer(user)
+    cart_size = len(session.get('cart') or [])
+
+    def render():
+        settings = get_user_settings(user.id, create=False)
+        filters = storefront_filters(request.args)
+        inventory, next_cursor = storefront_page(user.id, filters)
+        options = storefront_options(user.id)
+        active = any(filters[k] for k in filters if k != 'sort')
+        total = storefront_query(user.id, filters).count() if active else options['total']
+        return render_template('index.html', inventory=inventory, show_prices=settings.show_prices, owner=user,
+                               filters=filters, options=options, total=total, next_cursor=next_cursor)
+
+    variant = ('page', viewer, cart_size, tuple(sorted(request.args.items(multi=True))))
+    return cached_storefront_response(user, variant, render, public=(viewer == 'guest' and not cart_size))
+
+@app.route('/u/<username>/cards')
+def user_storefront_page(username):
+    """Next page (infinite scroll) or a re-filtered first page, as rendered grid/list fragments."""
+    user = User.query.filter_by(username=username.lower()).first_or_404()
+    viewer = storefront_viewer(user)
+
+    def render():
+        settings = get_user_settings(user.id, create=False)
+        filters = storefront_filters(request.args)
+        cursor = request.args.get('after')
+        inventory, next_cursor = storefront_page(user.id, filters, cursor)
+        fragment = lambda view: render_template('storefront_cards.html', inventory=inventory, view=view,
+                                                show_prices=settings.show_prices, owner=user)
+        data = {'grid': fragment('grid'), 'list': fragment('list'), 'next': next_cursor}
+        if not cursor:
+            data['total'] = storefront_query(user.id, filters).count()
+        return json.dumps(data)
+
+    variant = ('cards', viewer, tuple(sorted(request.args.items(multi=True))))
+    return cached_storefront_response(user, variant, render, mimetype='application/json', public=(viewer == 'guest'))
 
 @app.route('/u/<username>/qr')
 def user_qr(username):
@@ -304,30 +3248,248 @@ def user_qr(username):
 
 @app.route('/trade')
 def trade_tool():
-    users = User.query.all()
-    return render_template('trade.html', users=users)
+    usernames = [u for (u,) in db.session.query(User.username).order_by(User.username)]
+    return render_template('trade.html', usernames=usernames, trade=trade_valuation(session.get('trade') or empty_trade()))
+
+@app.route('/api/trade/search')
+def api_trade_search():
+    """Type-ahead within one side's trader. Cards already on the table are still listed (qty shown)."""
+    trade = session.get('trade') or empty_trade()
+    side = request.args.get('side')
+    if side not in TRADE_SIDES or not trade[side]['user']:
+        return jsonify([])
+    user = User.query.filter_by(username=trade[side]['user']).first()
+    if not user:
+        return jsonify([])
+    return jsonify([{
+        'id': c.id, 'name': c.card_name, 'set_name': c.set_name, 'finish': c.finish, 'condition': c.condition,
+        'quantity': c.quantity, 'price': c.price,
+        'image': thumb_url(c.image_url, 'sm', c.game),
+    } for c in trade_search(user.id, request.args.get('q', ''))])
+
+@app.route('/api/trade', methods=['POST'])
+def api_trade():
+    """Trade table actions: trader (pick a side's user), add / remove a card, clear. Returns the valuation."""
+    trade = session.get('trade') or empty_trade()
+    payload = request.get_json(silent=True) or {}
+    action, side = payload.get('action'), payload.get('side')
+    if action != 'clear' and side not in TRADE_SIDES:
+        return jsonify({'success': False, 'error': 'Unknown side.'}), 400
+
+    if action == 'trader':
+        username = (payload.get('username') or '').lower()
+        if username and not User.query.filter_by(username=username).first():
+            return jsonify({'success': False, 'error': f'No trader named {username}.'}), 404
+        trade[side] = {'user': username or None, 'lines': {}}
+    elif action in ('add', 'remove'):
+        card_id = str(payload.get('card_id', ''))
+        lines = trade[side]['lines']
+        if action == 'add':
+            card = db.session.get(Card, int(card_id)) if card_id.isdigit() else None
+            owner = db.session.get(User, card.user_id) if card else None
+            if not card or not owner or owner.username != trade[side]['user']:
+                return jsonify({'success': False, 'error': 'Card is not in this trader\'s inventory.'}), 400
+            if lines.get(card_id, 0) >= (card.quantity or 0):
+                return jsonify({'success': False, 'error': f'Only {card.quantity} in stock.'}), 409
+            lines[card_id] = lines.get(card_id, 0) + 1
+        elif card_id in lines:
+            lines[card_id] -= 1
+            if lines[card_id] <= 0:
+                del lines[card_id]
+    elif action == 'clear':
+        for s in TRADE_SIDES:
+            trade[s]['lines'] = {}
+    else:
+        return jsonify({'success': False, 'error': 'Unknown action.'}), 400
+
+    session['trade'] = trade
+    session.modified = True
+    return jsonify({'success': True, **trade_valuation(trade)})
+
+@app.route('/api/trade_matches')
+@login_required
+def api_trade_matches():
+    """Who has what you're missing (your hunt lists) and who hunts what you have in stock."""
+    return jsonify(trade_matches(current_user.id))
+
+# Inventory API: keyset pages of in-stock cards (JSON array + Link: rel="next") or one NDJSON stream.
+# Both select only the requested columns as row tuples, never ORM objects, and compress with br/gzip.
+INVENTORY_API_FIELDS = {
+    'id': Card.id,
+    'card_name': Card.card_name,
+    'set_name': Card.set_name,
+    'price': Card.price,
+    'quantity': Card.quantity,
+    'condition': Card.condition,
+    'finish': Card.finish,
+    'variant': Card.variant,
+    'grading_company': Card.grading_company,
+    'grade': Card.grade,
+    'is_first_edition': Card.is_first_edition,
+}
+INVENTORY_API_PAGE_SIZE = 500
+INVENTORY_API_MAX_PAGE = 2000
+INVENTORY_STREAM_BATCH = 500
+COMPRESS_MIN_BYTES = 1024
+
+def negotiate_encoding():
+    """'br', 'gzip' or None, from the request's Accept-Encoding."""
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+def compress_body(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+def compress_stream(chunks, encoding):
+    """Compresses an iterator of byte chunks on the fly, flushing after each chunk so rows reach the
+    client as soon as they are read."""
+    if encoding is None:
+        yield from chunks
+        return
+    if encoding == 'br':
+        compressor = brotli.Compressor()
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)   # wbits 31 = gzip container
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+def inventory_api_select(user_id, fields, q=None, set_name=None, after=None):
+    """SELECT id + the requested columns of a user's in-stock cards, in id order."""
+    stmt = db.select(Card.id, *[INVENTORY_API_FIELDS[f] for f in fields]).where(
+        Card.user_id == user_id, Card.quantity > 0)
+    if q:
+        stmt = stmt.where(Card.card_name.ilike(f"%{q}%"))
+    if set_name:
+        stmt = stmt.where(Card.set_name.ilike(f"%{set_name}%"))
+    if after:
+        stmt = stmt.where(Card.id > after)
+    return stmt.order_by(Card.id)
 
 @app.route('/api/inventory/<username>')
 def api_inventory(username):
+    """In-stock cards of a user.
+    ?fields=id,card_name,price (default: all)  ?q=<name contains>  ?set=<set name contains>
+    Without limit/after: every matching card as one JSON array, as before pagination existed
+    ?limit=500 (max 2000) &after=<last id>: JSON array, next page in the Link header (rel="next")
+    ?format=ndjson: one JSON object per line for every matching card, streamed"""
     user = User.query.filter_by(username=username.lower()).first_or_404()
-    inventory = Card.query.filter_by(user_id=user.id).filter(Card.quantity > 0).all()
-    
-    data = []
-    for card in inventory:
-        data.append({
-            'id': card.id,
-            'card_name': card.card_name,
-            'set_name': card.set_name,
-            'price': card.price,
-            'quantity': card.quantity,
-            'condition': card.condition,
-            'finish': card.finish,
-            'variant': card.variant,
-            'grading_company': card.grading_company,
-            'grade': card.grade,
-            'is_first_edition': card.is_first_edition
-        })
-    return jsonify(data)
+    fields = [f.strip() for f in request.args.get('fields', '').split(',') if f.strip()] or list(INVENTORY_API_FIELDS)
+    unknown = [f for f in fields if f not in INVENTORY_API_FIELDS]
+    if unknown:
+        return jsonify({'error': f"Unknown fields: {', '.join(unknown)}", 'fields': list(INVENTORY_API_FIELDS)}), 400
+    try:
+        after = int(request.args.get('after') or 0)
+        limit = min(int(request.args.get('limit') or INVENTORY_API_PAGE_SIZE), INVENTORY_API_MAX_PAGE)
+    except ValueError:
+        return jsonify({'error': 'after and limit must be integers.'}), 400
+    if limit < 1:
+        return jsonify({'error': 'limit must be at least 1.'}), 400
+    paginated = 'limit' in request.args or 'after' in request.args
+    q, set_name = (request.args.get('q') or '').strip(), (request.args.get('set') or '').strip()
+    encoding = negotiate_encoding()
+    variant = ('api', encoding, tuple(sorted(request.args.items(multi=True))))
+    stmt = inventory_api_select(user.id, fields, q, set_name, after)
+
+    if request.args.get('format') == 'ndjson':
+        etag = storefront_etag(user, variant)
+        if request.if_none_match.contains(etag):
+            return storefront_headers(make_response('', 304), user, etag)
+
+        def lines():
+            batch = []
+            for row in db.session.execute(stmt.execution_options(yield_per=INVENTORY_STREAM_BATCH)):
+                batch.append(json.dumps(dict(zip(fields, row[1:])), separators=(',', ':')))
+                if len(batch) >= INVENTORY_STREAM_BATCH:
+                    yield ("\n".join(batch) + "\n").encode('utf-8')
+                    batch = []
+            if batch:
+                yield ("\n".join(batch) + "\n").encode('utf-8')
+
+        response = app.response_class(stream_with_context(compress_stream(lines(), encoding)),
+                                      mimetype='application/x-ndjson')
+        return storefront_headers(response, user, etag, encoding=encoding)
+
+    def render():
+        rows = db.session.execute(stmt.limit(limit + 1) if paginated else stmt).all()
+        headers = {}
+        if paginated and len(rows) > limit:
+            rows = rows[:limit]
+            # A stray ?username= would clash with the route argument
+            args = {k: v for k, v in request.args.items() if k not in ('username', 'after')}
+            args['after'] = rows[-1][0]
+            headers['Link'] = f'<{url_for("api_inventory", username=user.username, **args)}>; rel="next"'
+        body = json.dumps([dict(zip(fields, row[1:])) for row in rows], separators=(',', ':')).encode('utf-8')
+        return body, headers
+
+    # Compressed bodies are cached as-is; each encoding is its own representation (and ETag)
+    def render_encoded():
+        body, headers = render()
+        if encoding and len(body) >= COMPRESS_MIN_BYTES:
+            return compress_body(body, encoding), {**headers, 'Content-Encoding': encoding}
+        return body, headers
+
+    response = cached_storefront_response(user, variant, render_encoded, mimetype='application/json')
+    if encoding:
+        response.vary.add('Accept-Encoding')
+    return response
+
+@app.route('/api/price_history')
+@login_required
+def price_history():
+    """Downsampled market price series for many of your cards at once (+ optional portfolio total).
+    ?card_ids=1,2,3 (default: all in stock) &start=YYYY-MM-DD &end=YYYY-MM-DD &points=60 &total=1"""
+    try:
+        end = date.fromisoformat(request.args['end']) if request.args.get('end') else datetime.utcnow().date()
+        start = date.fromisoformat(request.args['start']) if request.args.get('start') else end - timedelta(days=90)
+        points = int(request.args.get('points', 60))
+    except ValueError:
+        return jsonify({'error': 'Use YYYY-MM-DD dates and an integer points value.'}), 400
+    if start > end:
+        return jsonify({'error': 'start must be on or before end.'}), 400
+
+    query = db.session.query(Card.id, Card.reference_id, Card.finish, Card.quantity).filter(Card.user_id == current_user.id)
+    if request.args.get('card_ids'):
+        card_ids = [int(i) for i in request.args['card_ids'].split(',') if i.strip().isdigit()]
+        cards = []
+        for chunk_start in range(0, len(card_ids), MATCH_CHUNK_SIZE):
+            cards += query.filter(Card.id.in_(card_ids[chunk_start:chunk_start + MATCH_CHUNK_SIZE])).all()
+    else:
+        cards = query.filter(Card.quantity > 0).all()
+
+    linked = [c for c in cards if c.reference_id]
+    keys = {(c.reference_id, tier) for c in linked for tier in finish_price_tiers(c.finish)}
+    days, series = price_history_series(keys, start.toordinal(), end.toordinal(), points)
+
+    data = {}
+    total = [0] * len(days)
+    for card in linked:
+        # Same tier preference as repricing: first tier that has any history
+        values = next((series[(card.reference_id, tier)] for tier in finish_price_tiers(card.finish)
+                       if any(v is not None for v in series[(card.reference_id, tier)])), None)
+        if values is None:
+            continue
+        data[str(card.id)] = [v / 100 if v is not None else None for v in values]
+        for i, v in enumerate(values):
+            if v is not None:
+                total[i] += v * (card.quantity or 0)
+
+    result = {
+        'dates': [date.fromordinal(d).isoformat() for d in days],
+        'series': data,
+        'missing': [c.id for c in cards if str(c.id) not in data],
+    }
+    if request.args.get('total') in ('1', 'true'):
+        result['total'] = [v / 100 for v in total]
+    return jsonify(result)
 
 # --- AUTOCOMPLETE & SYNC ---
 
@@ -337,21 +3499,8 @@ def search_reference():
     query = request.args.get('q', '').lower().strip()
     if len(query) < 2: return jsonify([])
     
-    # Split the search query into individual words
-    terms = query.split()
-    
-    # Require EVERY word to appear in either the card name OR the set name
-    filters = []
-    for term in terms:
-        filters.append(
-            db.or_(
-                CardReference.name.ilike(f'%{term}%'),
-                CardReference.set_name.ilike(f'%{term}%')
-            )
-        )
-    
-    # Query using db.and_ to enforce all filters, order by newest releases first
-    results = CardReference.query.filter(db.and_(*filters)).order_by(CardReference.release_date.desc()).limit(20).all()
+    # Ranked FTS lookup: EVERY word must prefix-match the card name OR the set name
+    results = search_reference_index(query, limit=20)
     
     data = []
     for card in results:
@@ -370,74 +3519,58 @@ def search_reference():
 def sync_db():
     if not current_user.is_admin:
         return redirect(url_for('admin'))
-    
-    try:
-        api_url = "https://api.pokemontcg.io/v2/cards"
-        params = {'pageSize': 250} 
-        headers = {'User-Agent': 'FludInventory/1.0', 'Accept': 'application/json'}
-        
-        r = requests.get(api_url, params=params, headers=headers, timeout=30, verify=False)
-        
-        if r.status_code == 200:
-            data = r.json()
-            count = 0
-            if 'data' in data:
-                for item in data['data']:
-                    try:
-                        c_id = item.get('id')
-                        if not c_id: continue
-                        
-                        exists = CardReference.query.get(c_id)
-                        
-                        # Safely extract set data
-                        card_set = item.get('set') or {}
-                        fresh_release = card_set.get('releaseDate')
-                        fresh_finishes = get_clean_finishes(item.get('tcgplayer'))
-                        images = item.get('images') or {}
-                        
-                        if not exists:
-                            # Insert New Card
-                            ref = CardReference(
-                                id=c_id,
-                                name=item.get('name', 'Unknown'),
-                                set_name=card_set.get('name', 'Unknown'),
-                                set_id=card_set.get('id'),
-                                number=item.get('number', ''),
-                                image_url=images.get('small'),
-                                release_date=fresh_release,
-                                available_finishes=fresh_finishes
-                            )
-                            db.session.add(ref)
-                            count += 1
-                        else:
-                            # Update Existing Card
-                            updated = False
-                            if exists.available_finishes != fresh_finishes:
-                                exists.available_finishes = fresh_finishes
-                                updated = True
-                            if not exists.release_date and fresh_release:
-                                exists.release_date = fresh_release
-                                updated = True
-                                
-                            if updated:
-                                count += 1
-                                
-                    except Exception as e:
-                        print(f"CRASH ON CARD {item.get('id')}: {str(e)}", flush=True)
-                        continue
-                
-                db.session.commit()
-                flash(f"Synced/Updated {count} cards in reference cache.")
-            else:
-                flash("Sync Failed: Invalid data format from API.")
-        else:
-            flash(f"Sync Failed: API Error {r.status_code}")
-            
-    except Exception as e:
-        flash(f"Sync Error: {str(e)}")
-        
+
+    job = get_active_job('catalog_sync')
+    if job:
+        flash(f"Catalog sync already running ({job.done}/{job.total} pages).")
+    else:
+        start_background_job('catalog_sync', run_catalog_sync, user_id=current_user.id)
+        flash("Catalog sync started in the background. Progress is shown above the inventory.")
+    return redirect(url_for('admin'))
+
+@app.route('/admin/images/backfill', methods=['POST'])
+@login_required
+def image_backfill():
+    job = get_active_job('image_backfill', user_id=current_user.id)
+    if job:
+        flash(f"Image lookup already running ({job.done}/{job.total} cards).")
+    else:
+        start_background_job('image_backfill', run_image_backfill, user_id=current_user.id, owner_id=current_user.id)
+        flash("🖼️ Resolving card images in the background. Progress is shown above the inventory.")
     return redirect(url_for('admin'))
 
+@app.route('/img/<size>/<sig>/<token>')
+def card_image(size, sig, token):
+    """Serves the cached (and resized) copy of an allow-listed remote image. See thumb_url()."""
+    if size != 'full' and size not in IMAGE_SIZES:
+        abort(404)
+    if not hmac.compare_digest(sig, image_signature(token)):
+        abort(404)
+    try:
+        url = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('utf-8')
+    except (ValueError, UnicodeDecodeError):
+        abort(404)
+    if not image_allowed(url):
+        abort(404)
+    _, path = image_paths(url, size)
+    if not os.path.exists(path):
+        # Not cached yet: the browser loads the source this time, a warmer thread fetches it for next time
+        warm_image(url, size)
+        return redirect(url)
+    response = send_file(path, mimetype=mimetypes.guess_type(path)[0] or 'image/webp',
+                         max_age=IMAGE_CACHE_MAX_AGE, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/admin/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    job = BackgroundJob.query.get_or_404(job_id)
+    if job.user_id != current_user.id and not current_user.is_admin:
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify(job.to_dict())
+
 @app.route('/api/pos_search')
 @login_required
 def pos_search():
@@ -492,18 +3625,14 @@ def pos_search():
             
         inv_data = list(grouped_inv.values())
         
-        # 2. Search Master Dictionary
-        dict_filters = []
-        for term in terms:
-            dict_filters.append(db.or_(CardReference.name.ilike(f'%{term}%'), CardReference.set_name.ilike(f'%{term}%')))
-            
-        dict_results = CardReference.query.filter(db.and_(*dict_filters)).order_by(CardReference.release_date.desc()).limit(15).all()
+        # 2. Search Master Dictionary (in-memory index, no SQL on the hot path)
+        dict_results = reference_autocomplete.search(query, limit=15)
         dict_data = [{
-            'id': r.id,
-            'name': r.name or "Unknown",
-            'set': r.set_name or "Unknown",
-            'number': r.number or "",
-            'image': r.image_url or ""
+            'id': r[0],
+            'name': r[1],
+            'set': r[2],
+            'number': r[3],
+            'image': r[4]
         } for r in dict_results]
         
         return jsonify({'inventory': inv_data, 'dictionary': dict_data})
@@ -527,7 +3656,23 @@ def update_single_price(card_id):
         return jsonify({'success': False, 'error': 'Unauthorized'}), 403
 
     try:
-        clean_name = re.sub(r'[^\w\s]', '', card.card_name.split('(')[0]).strip()
+        # 0. PRICE CACHE: linked cards skip the API while the reference's prices are fresh
+        if card.reference_id:
+            cached = load_price_cache([card.reference_id]).get(card.reference_id)
+            if cached:
+                new_price, error = price_from_cache(card, cached[0])
+                if error:
+                    return jsonify({'success': False, 'error': error})
+                for key, value in price_update_row(card, new_price, cached[1]).items():
+                    setattr(card, key, value)
+                db.session.commit()
+                return jsonify({
+                    'success': True, 
+                    'new_price': new_price, 
+                    'message': f'Updated to ${new_price:.2f} (cached)'
+                })
+
+        clean_name = clean_card_name(card.card_name)
         
         # 1. BUILD STRICT QUERY
         # Using exact match operator (!) from PokemonTCG API
@@ -546,81 +3691,60 @@ def update_single_price(card_id):
         r = requests.get(api_url, params=params, headers=headers, timeout=15, verify=False)
         data = r.json()
         
-        match = None
-        candidates = data.get('data', [])
-        
         # 2. FILTER CANDIDATES
-        valid_matches = []
-        user_set_clean = (card.set_name or "").lower().replace('set', '').strip()
-        
-        for cand in candidates:
-            # If we queried by number, we trust the result heavily
-            if card.card_number:
-                valid_matches.append(cand)
-            else:
-                # If no number, we MUST match set name reasonably well
-                api_set = cand['set']['name'].lower().replace('set', '').strip()
-                if user_set_clean == api_set:
-                     valid_matches.append(cand)
-                # Allow strict containment if unambiguous (e.g. User: "Evolutions", API: "XY - Evolutions")
-                elif user_set_clean in api_set and len(user_set_clean) > 4:
-                     valid_matches.append(cand)
-
-        if len(valid_matches) == 1:
-            match = valid_matches[0]
-        elif len(valid_matches) > 1:
-            return jsonify({'success': False, 'error': f'Ambiguous: Found {len(valid_matches)} matches (e.g. {valid_matches[0]["set"]["name"]}). Add Card Number for precision.'})
-        else:
-             return jsonify({'success': False, 'error': f'No exact match found for Name="{clean_name}" Set="{card.set_name}" Number="{card.card_number}"'})
+        match, error = select_price_candidate(card, data.get('data', []))
+        if error:
+            return jsonify({'success': False, 'error': error})
 
-        # --- Pricing Logic ---
-        new_price = 0.0
-        
-        def get_price(prices_obj, price_type):
-            if prices_obj and price_type in prices_obj and prices_obj[price_type]:
-                return prices_obj[price_type].get('market', 0.0) or prices_obj[price_type].get('mid', 0.0)
-            return 0.0
-
-        if 'tcgplayer' in match and 'prices' in match['tcgplayer']:
-            prices = match['tcgplayer']['prices']
-            finish_lower = (card.finish or 'normal').lower()
-            
-            # Strict Finish Matching
-            if 'reverse' in finish_lower:
-                new_price = get_price(prices, 'reverseHolofoil')
-            elif 'holo' in finish_lower or 'foil' in finish_lower:
-                new_price = get_price(prices, 'holofoil')
-            elif '1st' in finish_lower:
-                new_price = get_price(prices, '1stEditionHolofoil') or get_price(prices, '1stEdition')
-            
-            # Fallback to Normal ONLY if finish wasn't specified as something else
-            if new_price == 0.0 and ('normal' in finish_lower or not card.finish):
-                new_price = get_price(prices, 'normal')
-            
-            # Absolute Last Resort: If the card exists but we missed the specific finish pricing,
-            # DO NOT UPDATE. (Prevent updating a Holo price with a Normal price)
-            if new_price == 0.0:
-                 return jsonify({'success': False, 'error': f'Card found, but no price for finish "{card.finish}". Available: {list(prices.keys())}'})
-
-        if new_price > 0:
-            card.price = new_price
-            card.last_updated = datetime.utcnow()
-            # Update image if missing
-            if not card.image_url and 'images' in match:
-                card.image_url = match['images']['small']
-            
-            db.session.commit()
-            return jsonify({
-                'success': True, 
-                'new_price': new_price, 
-                'message': f'Updated to ${new_price:.2f}'
-            })
-        else:
-            return jsonify({'success': False, 'error': 'No market price available.'})
+        # 3. PRICING (Strict Finish Matching)
+        new_price, error = price_from_match(card, match)
+        if error:
+            return jsonify({'success': False, 'error': error})
+
+        for key, value in price_update_row(card, new_price, (match.get('images') or {}).get('small')).items():
+            setattr(card, key, value)
+        store_reference_prices(data.get('data', []))
+        db.session.commit()
+        return jsonify({
+            'success': True, 
+            'new_price': new_price, 
+            'message': f'Updated to ${new_price:.2f}'
+        })
 
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/admin/price_refresh', methods=['POST'])
+@login_required
+def bulk_price_refresh():
+    """Starts a background repricing job for the posted card ids (or filter=all|stale)."""
+    payload = request.get_json(silent=True) or request.form
+    job = get_active_job('price_refresh', user_id=current_user.id)
+    if job:
+        return jsonify({'success': False, 'error': 'A price refresh is already running.', 'job_id': job.id}), 409
+
+    query = db.session.query(Card.id).filter(Card.user_id == current_user.id)
+    raw_ids = payload.get('card_ids') if hasattr(payload, 'get') else None
+    if isinstance(raw_ids, str):
+        raw_ids = raw_ids.split(',')
+    if not raw_ids and hasattr(payload, 'getlist'):
+        raw_ids = payload.getlist('card_ids')
+
+    if raw_ids:
+        card_ids = [int(i) for i in raw_ids if str(i).strip().isdigit()]
+    elif payload.get('filter') == 'stale':
+        cutoff = datetime.utcnow() - timedelta(days=int(payload.get('days', 7)))
+        card_ids = [r.id for r in query.filter(db.or_(Card.last_updated.is_(None), Card.last_updated < cutoff))]
+    else:
+        card_ids = [r.id for r in query]
+
+    if not card_ids:
+        return jsonify({'success': False, 'error': 'No cards selected.'}), 400
+
+    job = start_background_job('price_refresh', run_price_refresh, user_id=current_user.id,
+                               owner_id=current_user.id, card_ids=card_ids)
+    return jsonify({'success': True, 'job_id': job.id, 'total': len(card_ids)})
+
 # --- CART & QUOTE SYSTEM ---
 
 @app.route('/cart/add/<int:card_id>')
@@ -632,6 +3756,7 @@ def add_to_cart(card_id):
     if card and card.quantity > 0:
         if card_id not in session['cart']:
             session['cart'].append(card_id)
+            session.modified = True
             if not request.args.get('ajax'):
                 flash(f"Added {card.card_name} to quote request.")
         else:
@@ -651,6 +3776,7 @@ def add_to_cart(card_id):
 def remove_from_cart(card_id):
     if 'cart' in session and card_id in session['cart']:
         session['cart'].remove(card_id)
+        session.modified = True
         flash("Item removed.")
     return redirect(url_for('view_cart'))
 
@@ -675,6 +3801,9 @@ def submit_quote():
 
     customer_email = request.form.get('email')
     customer_note = request.form.get('notes')
+    if not customer_email:
+        flash("Please enter your email address.")
+        return redirect(url_for('view_cart'))
     
     cart_items = Card.query.filter(Card.id.in_(cart_ids)).all()
     
@@ -696,8 +3825,7 @@ def submit_quote():
         
         item_list += name_line
 
-    try:
-        admin_body = f"""
+    admin_body = f"""
         New Quote Request
         =================
         Customer Email: {customer_email}
@@ -708,16 +3836,8 @@ def submit_quote():
         Customer Notes:
         {customer_note}
         """
-        
-        msg_admin = Message(
-            subject=f"TCG Quote Request: {len(cart_items)} Items",
-            recipients=[os.environ.get("ADMIN_EMAIL")], 
-            body=admin_body,
-            reply_to=customer_email
-        )
-        mail.send(msg_admin)
 
-        customer_body = f"""
+    customer_body = f"""
         Hello!
         
         We have received your request for the following cards:
@@ -727,20 +3847,20 @@ def submit_quote():
         
         Thank you!
         """
-        
-        msg_customer = Message(
-            subject="Quote Request Received - Flud Media",
-            recipients=[customer_email],
-            body=customer_body
-        )
-        mail.send(msg_customer)
-        
-        session.pop('cart', None)
-        return render_template('success.html')
-        
-    except Exception as e:
-        flash(f"Error sending email: {str(e)}")
+
+    # Both notifications are queued with the request; the outbox sender delivers them in the background
+    if not queue_email(f"TCG Quote Request: {len(cart_items)} Items", [ADMIN_EMAIL], admin_body,
+                       reply_to=customer_email, kind='quote_admin'):
+        # Never tell the customer we have their request when nobody will receive it
+        print("⚠️ Quote request rejected: no admin address configured", flush=True)
+        flash("Quote requests are unavailable right now. Please try again later.")
         return redirect(url_for('view_cart'))
+    queue_email("Quote Request Received - Flud Media", [customer_email], customer_body, kind='quote_customer')
+    db.session.commit()
+    wake_outbox()
+
+    session.pop('cart', None)
+    return render_template('success.html')
 
 
 # --- ADMIN PANEL ---
@@ -751,7 +3871,10 @@ def admin():
     settings = get_user_settings(current_user.id)
     inventory = Card.query.filter_by(user_id=current_user.id).order_by(Card.id.desc()).all()
     cache_count = CardReference.query.count()
-    return render_template('admin.html', inventory=inventory, settings=settings, cache_count=cache_count)
+    sync_job = get_active_job('catalog_sync') if current_user.is_admin else None
+    image_job = get_active_job('image_backfill', user_id=current_user.id)
+    return render_template('admin.html', inventory=inventory, settings=settings, cache_count=cache_count,
+                           sync_job=sync_job, image_job=image_job)
 
 @app.route('/sales')
 @login_required
@@ -788,6 +3911,12 @@ def delete_user(user_id):
         return redirect(url_for('super_admin'))
         
     db.session.delete(user_to_delete)
+    CompletionCounter.query.filter_by(user_id=user_id).delete()
+    HuntCache.query.filter_by(user_id=user_id).delete()
+    TradeSlot.query.filter_by(user_id=user_id).delete()
+    ticket_ids = db.session.query(PosTicket.id).filter_by(user_id=user_id)
+    PosLine.query.filter(PosLine.ticket_id.in_(ticket_ids)).delete(synchronize_session=False)
+    PosTicket.query.filter_by(user_id=user_id).delete()
     db.session.commit()
     flash(f"User {user_to_delete.username} deleted.")
     return redirect(url_for('super_admin'))
@@ -825,7 +3954,7 @@ def add_card():
         set_name = request.form.get('set_name')
         card_number = request.form.get('card_number')
         
-        ref_match = CardReference.query.filter_by(name=card_name, set_name=set_name).first()
+        ref_match = match_reference(card_name, set_name, card_number)
         ref_id = ref_match.id if ref_match else None
 
         new_card = Card(
@@ -863,6 +3992,8 @@ def paste_import():
     if not raw_text: return redirect(url_for('admin'))
     
     count = 0
+    new_cards = []
+    pokemon_cards = []
     lines = raw_text.strip().split('\n')
     for line in lines:
         line = line.strip()
@@ -875,7 +4006,7 @@ def paste_import():
                     name = match.group(2).strip()
                     set_code = match.group(3)
                     num = match.group(4) if match.group(4) else ""
-                    db.session.add(Card(user_id=current_user.id, game="Magic: The Gathering", card_name=name, set_name=set_code, card_number=num, quantity=qty))
+                    new_cards.append(Card(user_id=current_user.id, game="Magic: The Gathering", card_name=name, set_name=set_code, card_number=num, quantity=qty))
                     count += 1
             elif game_mode == 'pokemon':
                 parts = line.split()
@@ -884,9 +4015,16 @@ def paste_import():
                     if parts[0].isdigit() or (parts[0][:-1].isdigit() and parts[0].endswith('x')):
                         qty = int(parts[0].replace('x','')); parts.pop(0)
                     num = parts[-1]; set_code = parts[-2]; name = " ".join(parts[:-2])
-                    db.session.add(Card(user_id=current_user.id, game="Pokemon TCG", card_name=name, set_name=set_code, card_number=num, quantity=qty))
+                    card = Card(user_id=current_user.id, game="Pokemon TCG", card_name=name, set_name=set_code, card_number=num, quantity=qty)
+                    new_cards.append(card)
+                    pokemon_cards.append(card)
                     count += 1
         except: pass
+
+    # Link the whole paste against the dictionary in one pass
+    if pokemon_cards:
+        attach_references(pokemon_cards)
+    db.session.add_all(new_cards)
     db.session.commit()
     flash(f"Imported {count} cards.")
     return redirect(url_for('admin'))
@@ -910,6 +4048,7 @@ def upload_csv():
                 return default
 
             total_qty_imported = 0
+            new_cards = []
             
             for _, row in df.iterrows():
                 qty = 1
@@ -944,34 +4083,7 @@ def upload_csv():
                 img_val = get_val(row, ['image', 'image url', 'photo url'], '')
                 loc_val = get_val(row, ['location', 'binder'], '')
 
-                ref_match = None
-                # 1. Try a strict match including Card Number first (Gold Standard)
-                if num_val:
-                    ref_match = CardReference.query.filter_by(name=name_val, set_name=set_val, number=num_val).first()
-                # 2. Fallback to just Name + Set if Number is missing
-                if not ref_match:
-                    ref_match = CardReference.query.filter_by(name=name_val, set_name=set_val).first()
-                
-                ref_id = ref_match.id if ref_match else None
-
-                db.session.add(Card(
-                    user_id=current_user.id,
-                    reference_id=ref_id, # <-- INJECTED HERE
-                    game=game_val,
-                    set_name=set_val,
-                    card_name=name_val,
-                    card_number=num_val,
-                    condition=cond_val,
-                    price=price_val,
-                    quantity=qty,
-                    finish=finish_val,
-                    image_url=img_val,
-                    location=loc_val
-                ))
-                total_qty_imported += qty
-
-
-                db.session.add(Card(
+                new_cards.append(Card(
                     user_id=current_user.id,
                     game=game_val,
                     set_name=set_val,
@@ -986,6 +4098,9 @@ def upload_csv():
                 ))
                 total_qty_imported += qty
                 
+            # Strict Name + Number match first (Gold Standard), then Name + Set - whole file at once
+            attach_references(new_cards)
+            db.session.add_all(new_cards)
             db.session.commit()
             flash(f'Imported {total_qty_imported} cards')
         except Exception as e:
@@ -1072,22 +4187,19 @@ def update_card(id):
             else:
                 final_sale_price = (card.price * qty_sold) * multiplier
 
-            if card.quantity >= qty_sold:
-                card.quantity -= qty_sold
-                if card.quantity == 0:
-                    db.session.delete(card)
+            sale = Sale(
+                user_id=current_user.id,
+                card_name=card.card_name,
+                set_name=card.set_name,
+                sale_price=final_sale_price,
+                quantity=qty_sold
+            )
+            msg = f"Sold {qty_sold}x {card.card_name} for ${final_sale_price:.2f}"
+            if discount_pct > 0: msg += f" ({discount_pct}% off)"
 
-                sale = Sale(
-                    user_id=current_user.id,
-                    card_name=card.card_name,
-                    set_name=card.set_name,
-                    sale_price=final_sale_price,
-                    quantity=qty_sold
-                )
+            # Conditional decrement: another terminal may have sold copies since this page loaded
+            if qty_sold > 0 and not take_stock(current_user.id, {card.id: qty_sold}):
                 db.session.add(sale)
-                
-                msg = f"Sold {qty_sold}x {card.card_name} for ${final_sale_price:.2f}"
-                if discount_pct > 0: msg += f" ({discount_pct}% off)"
                 flash(msg)
             else:
                 flash("Not enough quantity.")
@@ -1118,63 +4230,43 @@ def update_card(id):
 @login_required
 def pokedex_hub():
     trackers = MasterTracker.query.all()
-    stats = []
-    
-    for t in trackers:
-        species = t.species_name
-        # Find all cards that belong to this species
-        master_cards = CardReference.query.filter(CardReference.name.ilike(f"%{species}%")).all()
-        
-        total_slots = 0
-        owned_count = 0
-        
-        for ref in master_cards:
-            finishes = ref.available_finishes.split(',') if ref.available_finishes else ["Normal"]
-            for f in finishes:
-                total_slots += 1  # Every variant (1st Ed, Holo, etc.) is its own "slot"
-                
-                # Check if user owns THIS specific variant
-                is_owned = Card.query.filter_by(
-                    user_id=current_user.id,
-                    reference_id=ref.id,
-                    finish=f
-                ).first()
-                if is_owned:
-                    owned_count += 1
-        
-        pct = int((owned_count / total_slots) * 100) if total_slots > 0 else 0
-        stats.append({'name': species, 'total': total_slots, 'owned': owned_count, 'percent': pct})
-        
-    return render_template('pokedex.html', stats=stats)
+    stats = read_completion(current_user.id, 'species', [t.species_name for t in trackers])
+
+    # Sets you have started, best completion first
+    set_ids = [r.key for r in CompletionCounter.query.filter_by(user_id=current_user.id, scope='set')]
+    set_stats = read_completion(current_user.id, 'set', set_ids) if set_ids else []
+    set_names = dict(db.session.query(CardReference.set_id, CardReference.set_name).filter(
+        CardReference.set_id.in_(set_ids)).distinct()) if set_ids else {}
+    for stat in set_stats:
+        stat['set_name'] = set_names.get(stat['name'], stat['name'])
+    set_stats.sort(key=lambda st: (-st['percent'], st['set_name']))
+    return render_template('pokedex.html', stats=stats, set_stats=set_stats)
 
 @app.route('/pokedex/<species>')
 @login_required
 def pokedex_binder(species):
-    # Group by artwork for the UI
-    master_cards = CardReference.query.filter(
-        CardReference.name.ilike(f"%{species}%")
+    # Group by artwork for the UI (indexed species lookup)
+    master_cards = CardReference.query.options(db.selectinload(CardReference.finish_rows)).filter(
+        CardReference.id.in_(species_reference_ids(species))
     ).order_by(CardReference.release_date.desc()).all()
 
     if not master_cards:
         return redirect(url_for('pokedex_hub'))
 
-    ref_ids = [c.id for c in master_cards]
-    owned_cards = Card.query.filter(
+    # (reference_id, finish_code) pairs you own -> the template's ✅ / ❌ per finish
+    owned_slots = {tuple(row) for row in db.session.query(Card.reference_id, Card.finish_code).filter(
         Card.user_id == current_user.id,
-        Card.reference_id.in_(ref_ids)
-    ).all()
+        Card.reference_id.in_(species_reference_ids(species))
+    ).distinct()}
 
-    # Map owned cards to their artwork IDs
-    owned_dict = {}
-    for oc in owned_cards:
-        if oc.reference_id not in owned_dict:
-            owned_dict[oc.reference_id] = []
-        owned_dict[oc.reference_id].append(oc)
+    tracker = MasterTracker.query.filter(db.func.lower(MasterTracker.species_name) == species.lower()).first()
+    completion = read_completion(current_user.id, 'species', [tracker.species_name])[0] if tracker else None
 
     return render_template('pokedex_binder.html', 
                            species=species.capitalize(), 
                            master_cards=master_cards, 
-                           owned_dict=owned_dict)
+                           owned_slots=owned_slots,
+                           completion=completion)
 
 @app.route('/api/toggle_favorite', methods=['POST'])
 @login_required
@@ -1187,11 +4279,17 @@ def toggle_favorite():
     
     if existing:
         db.session.delete(existing)
+        CompletionCounter.query.filter_by(scope='species', key=species_name).delete()
+        db.session.flush()
+        rebuild_trade_slots([r for (r,) in species_reference_ids(species_name)])
         db.session.commit()
         flash(f"Removed {species_name} from Master Sets.")
     else:
         new_tracker = MasterTracker(species_name=species_name)
         db.session.add(new_tracker)
+        db.session.flush()
+        build_completion('species', [species_name])
+        rebuild_trade_slots([r for (r,) in species_reference_ids(species_name)])
         db.session.commit()
         flash(f"Added {species_name} umbrella to Master Sets. Tracking all variants!")
         
@@ -1240,12 +4338,18 @@ def force_variant():
     new_finish = request.form.get('new_finish')
     
     card_ref = CardReference.query.get(ref_id)
-    if card_ref and new_finish:
-        current_finishes = card_ref.available_finishes.split(',') if card_ref.available_finishes else []
-        
-        if new_finish not in current_finishes:
-            current_finishes.append(new_finish)
-            card_ref.available_finishes = ",".join(current_finishes)
+    code = finish_code(new_finish)
+    if card_ref and code:
+        new_finish = FINISH_LABELS[code]
+        if not CardReferenceFinish.query.get((card_ref.id, code)):
+            db.session.add(CardReferenceFinish(reference_id=card_ref.id, finish_code=code))
+            # Keep the display/sync copy in step
+            current_finishes = [f.strip() for f in (card_ref.available_finishes or "").split(',') if f.strip()]
+            card_ref.available_finishes = ",".join(current_finishes + [new_finish])
+            db.session.flush()
+            recount_reference_completion(card_ref)
+            invalidate_hunt_cache(db.session, [card_ref.id])
+            rebuild_trade_slots(species_trade_references([card_ref.id]))
             db.session.commit()
             flash(f"✅ Successfully forced '{new_finish}' variant onto {card_ref.name}!")
         else:
@@ -1253,42 +4357,30 @@ def force_variant():
             
     return redirect(request.referrer or url_for('pokedex_hub'))
 
+HUNT_TEMPLATES = ('base.html', 'hunt_mode.html')
+HUNT_FINGERPRINT = template_fingerprint(HUNT_TEMPLATES)
+
 @app.route('/hunt/<species>')
 @login_required
 def hunt_mode(species):
-    # THE FIX: Wildcard search for Hunt Mode
-    master_cards = CardReference.query.filter(
-        CardReference.name.ilike(f"%{species}%")
-    ).order_by(CardReference.release_date.asc()).all()
-
-    ref_ids = [c.id for c in master_cards]
-    owned_cards = Card.query.filter(
-        Card.user_id == current_user.id,
-        Card.reference_id.in_(ref_ids)
-    ).all()
-
-    owned_dict = {}
-    for oc in owned_cards:
-        if oc.reference_id not in owned_dict:
-            owned_dict[oc.reference_id] = []
-        owned_dict[oc.reference_id].append(oc.finish.lower())
-
-    hunt_targets = []
-    for ref in master_cards:
-        if not ref.available_finishes:
-            continue
-            
-        available = [f.strip() for f in ref.available_finishes.split(',')]
-        owned = owned_dict.get(ref.id, [])
-        missing = [f for f in available if f.lower() not in owned]
-        
-        if missing:
-            hunt_targets.append({
-                'ref': ref,
-                'missing_finishes': missing
-            })
-
-    return render_template('hunt_mode.html', species=species.capitalize(), targets=hunt_targets)
+    # Species index: "Alolan Meowth", "Team Rocket's Meowth", ... but never "Mewtwo" for "Mew"
+    targets, data_etag = read_hunt_targets(current_user.id, species)
+    # The cached tag only covers the data; a deploy that changes the markup must re-render every phone
+    etag = hashlib.sha1(f"{HUNT_FINGERPRINT}:{data_etag}".encode('utf-8')).hexdigest()
+    # A 304 can't deliver queued flash messages, so only revalidate when none are waiting
+    if request.if_none_match.contains(etag) and not session.get('_flashes'):
+        # Nothing changed since the phone last loaded it: skip rendering entirely
+        response = make_response('', 304)
+    else:
+        hunt_targets = [{
+            'ref': {'id': ref_id, 'name': name, 'set_name': set_name, 'number': number,
+                    'release_year': year, 'image_url': image_url},
+            'missing_finishes': [FINISH_LABELS[code] for code in codes],
+        } for ref_id, name, set_name, number, year, image_url, codes in targets]
+        response = make_response(render_template('hunt_mode.html', species=species.capitalize(), targets=hunt_targets))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @app.route('/api/force_api_fetch', methods=['POST'])
 @login_required
@@ -1299,32 +4391,18 @@ def force_api_fetch():
     
     api_id = api_id.strip()
 
-    url = f"https://api.pokemontcg.io/v2/cards/{api_id}"
-    response = requests.get(url)
-    
-    if response.status_code == 200:
-        api_data = response.json().get('data', {})
-        
-        existing = CardReference.query.get(api_id)
-        if existing:
-            flash(f"ℹ️ {api_id} already exists in your local dictionary.")
-            return redirect(url_for('admin'))
+    existing = CardReference.query.get(api_id)
+    if existing:
+        flash(f"ℹ️ {api_id} already exists in your local dictionary.")
+        return redirect(url_for('admin'))
 
-        images = api_data.get('images', {})
-        card_set = api_data.get('set', {})
-        
-        new_ref = CardReference(
-            id=api_data.get('id'),
-            name=api_data.get('name'),
-            set_name=card_set.get('name'),
-            set_id=card_set.get('id'),
-            number=api_data.get('number'),
-            image_url=images.get('large') or images.get('small'),
-            release_date=card_set.get('releaseDate'),
-            available_finishes=get_clean_finishes(api_data.get('tcgplayer')),
-            is_favorite=True 
-        )
-        db.session.add(new_ref)
+    api_data = fetch_card(api_session(pool_size=1), api_id)
+    if api_data:
+        row = reference_row(api_data)
+        images = api_data.get('images') or {}
+        row['image_url'] = images.get('large') or images.get('small')
+        row['is_favorite'] = True
+        upsert_references([row])
         db.session.commit()
         flash(f"✅ Successfully injected {api_data.get('name')} ({api_id}) into your Pokedex!")
     else:
@@ -1337,57 +4415,117 @@ def force_api_fetch():
 @app.route('/pos')
 @login_required
 def point_of_sale():
-    # Initialize a fresh POS cart in the session
-    if 'pos_cart' not in session:
-        session['pos_cart'] = {'in': [], 'out': [], 'net': 0.0}
-    return render_template('pos.html')
+    # Resume this terminal's open ticket (survives reloads / browser crashes), or start one
+    ticket = current_pos_ticket()
+    parked = PosTicket.query.filter(
+        PosTicket.user_id == current_user.id, PosTicket.status == 'open',
+        PosTicket.id != ticket.id, PosTicket.item_count > 0
+    ).order_by(PosTicket.updated_at.desc()).all()
+    return render_template('pos.html', ticket=pos_ticket_dict(ticket), parked=parked)
+
+@app.route('/api/pos/ticket')
+@login_required
+def pos_ticket():
+    """Full ticket, for (re)drawing the cart. Line actions return only what changed."""
+    return jsonify(pos_ticket_dict(current_pos_ticket()))
+
+@app.route('/api/pos/checkout', methods=['POST'])
+@login_required
+def pos_checkout_route():
+    """Finalizes this terminal's ticket. 409 with per-line conflicts if stock ran out meanwhile."""
+    ticket = current_pos_ticket(create=False)
+    if not ticket or not ticket.item_count:
+        return jsonify({'status': 'error', 'error': 'Nothing to check out.'}), 400
+    version = (request.get_json(silent=True) or {}).get('version')
+    summary, conflicts = pos_checkout(ticket.id, current_user.id, int(version) if version is not None else None)
+    if conflicts:
+        return jsonify({'status': 'conflict', 'conflicts': conflicts}), 409
+    session.pop('pos_ticket', None)
+    return jsonify({'status': 'success', **summary})
 
 @app.route('/api/pos/action', methods=['POST'])
 @login_required
 def pos_action():
-    """Handles all rapid AJAX requests for the POS."""
-    if 'pos_cart' not in session:
-        session['pos_cart'] = {'in': [], 'out': [], 'net': 0.0}
-        
+    """Handles all rapid AJAX requests for the POS. Replies with the changed line (or removed id) and totals."""
     action = request.json.get('action')
     data = request.json.get('data', {})
-    
-    # Calculate current net (Out - In)
-    def update_net():
-        total_out = sum(item['price'] for item in session['pos_cart']['out'])
-        total_in = sum(item['price'] for item in session['pos_cart']['in'])
-        session['pos_cart']['net'] = total_out - total_in
-
-    if action == 'add_out':
-        # Selling a card from inventory
-        session['pos_cart']['out'].append({
-            'id': data.get('id'), 
-            'name': data.get('name'), 
-            'price': float(data.get('price', 0))
-        })
-    elif action == 'add_in':
-        # Taking a card/item in on trade
-        base_price = float(data.get('price', 0))
-        multiplier = float(data.get('multiplier', 1.0))
-        final_credit = base_price * multiplier
-        
-        session['pos_cart']['in'].append({
-            'name': data.get('name'), 
-            'price': final_credit,
-            'base_price': base_price,
-            'multiplier': multiplier
-        })
-    elif action == 'clear':
-        session['pos_cart'] = {'in': [], 'out': [], 'net': 0.0}
-        
-    update_net()
-    session.modified = True
-    
-    return jsonify({
-        'status': 'success',
-        'cart': session['pos_cart']
-    })
+    ticket = current_pos_ticket()
+    result = {'status': 'success', 'ticket': ticket.id}
+
+    try:
+        if action == 'add_out':
+            # Selling a card from inventory (or a "ghost" item typed in by hand)
+            card = Card.query.filter_by(id=int(data['id']), user_id=current_user.id).first() \
+                if str(data.get('id', '')).isdigit() else None
+            if card:
+                line = pos_add_line(ticket, 'out', data.get('name') or card.card_name, card.price or 0.0, card_id=card.id)
+            else:
+                line = pos_add_line(ticket, 'out', data.get('name') or 'Manual Item', float(data.get('price') or 0))
+            result['line'] = line.to_dict()
+        elif action == 'add_in':
+            # Taking a card/item in on trade
+            reference_id = data.get('id') if data.get('id') not in (None, '', 'ghost') else None
+            line = pos_add_line(ticket, 'in', data.get('name') or 'Manual Item', float(data.get('price') or 0),
+                                multiplier=float(data.get('multiplier') or 1.0), reference_id=reference_id)
+            result['line'] = line.to_dict()
+        elif action == 'remove':
+            if not pos_remove_line(ticket, int(data.get('line_id', 0))):
+                return jsonify({'status': 'error', 'error': 'Line not found.'}), 404
+            result['removed'] = int(data['line_id'])
+        elif action == 'clear':
+            pos_clear_ticket(ticket)
+            result['cleared'] = True
+        elif action in ('resume', 'new'):
+            # Park this ticket and switch to another open one / a fresh one
+            other = get_pos_ticket(current_user.id, data.get('ticket_id')) if action == 'resume' else None
+            if action == 'resume' and not other:
+                return jsonify({'status': 'error', 'error': 'Ticket not found.'}), 404
+            session.pop('pos_ticket', None)
+            if other:
+                session['pos_ticket'] = other.id
+            return jsonify({'status': 'success', **pos_ticket_dict(current_pos_ticket())})
+        else:
+            return jsonify({'status': 'error', 'error': 'Unknown action.'}), 400
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'status': 'error', 'error': str(e)}), 409
+
+    result['totals'] = db.session.get(PosTicket, ticket.id).totals()
+    return jsonify(result)
+
+# --- Startup & Migration Check ---
+# Runs once at import, after every definition above: the backfills below reach into almost every
+# section, so calling this any earlier turns a missing name into a "skipped" upgrade.
+
+def run_startup():
+    with app.app_context():
+        db.create_all()
+        try:
+            upgrade_schema()
+            backfill_match_keys()
+            backfill_finish_codes()
+            backfill_card_prices()
+            if db.session.query(CardReference.id).first():
+                if not db.session.query(CardSpecies.reference_id).first():
+                    rebuild_species_index()
+                if not db.session.query(CardReferenceFinish.reference_id).first():
+                    rebuild_finish_index()
+                if claim_trade_index_build():
+                    rebuild_trade_slots()
+                db.session.commit()
+        except SQLAlchemyError as e:
+            # Only database trouble (locked file, odd legacy schema) is survivable; code errors must surface
+            db.session.rollback()
+            print(f"Schema upgrade skipped: {str(e)}", flush=True)
+        init_reference_fts()
+        init_catalog_changelog()
+
+        admin_user = User.query.filter_by(username='flud').first()
+        if admin_user and not admin_user.is_admin:
+            admin_user.is_admin = True
+            db.session.commit()
 
+run_startup()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -1,35 +1,23 @@
-from app import app, db, Card, CardReference
+from app import app, db, Card, link_references_bulk
 
 def run_bridge():
     with app.app_context():
         print("Starting the Bridge Script...")
-        inventory = Card.query.all()
-        updated_count = 0
-        missed_count = 0
-        
-        for card in inventory:
-            if card.reference_id:
-                continue  # Skip if already linked
-            
-            # Search the cache for an exact match
-            query = CardReference.query.filter(CardReference.name == card.card_name)
-            if card.set_name:
-                query = query.filter(CardReference.set_name == card.set_name)
-            if card.card_number:
-                query = query.filter(CardReference.number == card.card_number)
-            
-            match = query.first()
-            if match:
-                card.reference_id = match.id
-                updated_count += 1
-            else:
-                print(f"⚠️ No dictionary match found for: {card.card_name} ({card.set_name})")
-                missed_count += 1
+        inventory = Card.query.filter(Card.reference_id.is_(None)).all()
         
+        # One catalog load + one bulk UPDATE for every unlinked card
+        matches, report = link_references_bulk(inventory)
         db.session.commit()
-        print(f"✅ Successfully linked {updated_count} cards to the Pokedex dictionary!")
+
+        for miss in report['unmatched']:
+            print(f"⚠️ No dictionary match found for: {miss['name']} ({miss['set']})")
+        for amb in report['ambiguous']:
+            print(f"❓ Ambiguous match for: {amb['name']} ({amb['set']}) -> {', '.join(amb['candidates'])}")
+
+        print(f"✅ Successfully linked {len(matches)} cards to the Pokedex dictionary!")
+        missed_count = len(report['unmatched']) + len(report['ambiguous'])
         if missed_count > 0:
-            print(f"⚠️ {missed_count} cards could not be linked (likely due to typos or missing set info).")
+            print(f"⚠️ {missed_count} cards could not be linked (likely due to typos, missing set info or duplicate printings).")
 
 if __name__ == '__main__':
     run_bridge()
\ No newline at end of file
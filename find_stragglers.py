@@ -1,26 +1,5 @@
 import csv
-import re
-from app import app, db, CardReference
-
-def normalize_name(name):
-    """Strips suffixes like ' - 107/088' or ' (Delta Species)'"""
-    if not name: return ""
-    # Remove everything after a dash, parenthesis, or hash symbol
-    clean = re.split(r' \-| \(| #', name)[0]
-    return clean.strip().lower()
-
-def normalize_number(num):
-    """Converts #074/132 -> 74, #SM51 -> SM51, #013 -> 13"""
-    if not num: return ""
-    num = str(num).replace('#', '').split('/')[0]
-    # Remove leading zeros from the numeric part (e.g., 008 -> 8)
-    # but keep letters (e.g., SWSH005 -> SWSH5 or SWSH005 depending on API)
-    # Most common API format for numbers is stripping leading zeros:
-    match = re.search(r'([a-zA-Z]*)(0*)(\d+)', num)
-    if match:
-        prefix, zeros, digits = match.groups()
-        return f"{prefix}{digits}".strip()
-    return num.strip()
+from app import app, db, CardReference, normalize_name, normalize_number
 
 def compare_inventory():
     with app.app_context():
@@ -45,12 +24,11 @@ def compare_inventory():
             return
 
         # 2. Load Database References (Cleaned)
-        db_refs = CardReference.query.all()
+        # The DB side is already normalized into the indexed match-key columns
+        db_refs = db.session.query(CardReference.name_key, CardReference.number_key).all()
         db_map = set()
-        for c in db_refs:
-            # We normalize the DB side too just in case
-            db_key = f"{normalize_name(c.name)}|{normalize_number(c.number)}"
-            db_map.add(db_key)
+        for name_key, number_key in db_refs:
+            db_map.add(f"{name_key}|{number_key}")
 
         print(f"📊 Spreadsheet: {len(spreadsheet_targets)} records found.")
         print(f"🖥️  Database: {len(db_map)} unique artwork references loaded.")
@@ -0,0 +1,157 @@
+import argparse
+import json
+import os
+from app import (app, db, CardReference, api_session, fetch_card, run_ingest,
+                 normalize_pages, diff_pages, write_pages, refresh_stale_prices, PRICE_CACHE_TTL)
+
+# Replaces seed_cache.py / build_cache.py / deep_dive.py / patch_variants.py.
+# Every mode runs the same fetch -> normalize -> diff -> write pipeline from app.py.
+#
+#   python ingest.py build                 Full dictionary build (resumes after a crash)
+#   python ingest.py species Meowth        Deep-dive one species (*Meowth*), flags hits as favorites
+#   python ingest.py favorites             Re-pull variant data for every favorited name
+#   python ingest.py id base1-4 swsh1-1    Fetch specific API ids
+#   python ingest.py prices                Refresh stale cached prices for cards someone owns
+#
+# Add --dry-run to see what would change, --restart to ignore a saved checkpoint.
+
+CHECKPOINT_PATH = os.path.join(app.instance_path, 'ingest_checkpoint.json')
+
+def load_checkpoints():
+    try:
+        with open(CHECKPOINT_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_checkpoint(key, value):
+    checkpoints = load_checkpoints()
+    if value is None:
+        checkpoints.pop(key, None)
+    else:
+        checkpoints[key] = value
+    os.makedirs(os.path.dirname(CHECKPOINT_PATH), exist_ok=True)
+    tmp_path = CHECKPOINT_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoints, f, indent=2)
+    os.replace(tmp_path, CHECKPOINT_PATH)
+
+def print_stats(stats, dry_run):
+    verb = "Would add" if dry_run else "Added"
+    print(f"➕ {verb} {stats['inserted']} new cards.")
+    print(f"🔄 {'Would update' if dry_run else 'Updated'} {stats['updated']} existing cards.")
+    if stats.get('prices_refreshed'):
+        print(f"💲 {'Would refresh' if dry_run else 'Refreshed'} cached prices for {stats['prices_refreshed']} cards.")
+    if stats['failed_pages']:
+        print(f"⚠️ {len(stats['failed_pages'])} pages failed: {stats['failed_pages']} (re-run to retry them)")
+
+def run_paged(key, q=None, favorite=False, update_only=False, dry_run=False, restart=False):
+    """Paged pipeline run with a checkpoint after every committed page."""
+    checkpoint = None if restart else load_checkpoints().get(key)
+    start_page = checkpoint['next_page'] if checkpoint else 1
+    if start_page > 1:
+        print(f"⏩ Resuming '{key}' from page {start_page} (use --restart to start over)")
+
+    def on_page(page, stats):
+        print(f"✅ Page {page}/{stats['total_pages']} done. "
+              f"{stats['inserted']} new / {stats['updated']} updated so far.", flush=True)
+        if not dry_run:
+            # Resume from the first failed page, otherwise from the page after this one
+            failed = stats['failed_pages']
+            save_checkpoint(key, {'next_page': min(failed) if failed else page + 1})
+
+    stats = run_ingest(q=q, favorite=favorite, update_only=update_only, dry_run=dry_run,
+                       start_page=start_page, on_page=on_page)
+    if not dry_run and not stats['failed_pages']:
+        save_checkpoint(key, None)
+    return stats
+
+def mode_build(args):
+    print("🚀 Starting Master Dictionary Build...")
+    stats = run_paged('build', dry_run=args.dry_run, restart=args.restart)
+    print_stats(stats, args.dry_run)
+
+def mode_species(args):
+    target = " ".join(args.name)
+    print(f"\n🚀 Initiating Deep-Dive Protocol for: *{target}*")
+    # Double wildcard search to catch Alolan, Dark, VMAX, Promos, etc.
+    stats = run_paged(f"species:{target.lower()}", q=f"name:*{target}*", favorite=True,
+                      dry_run=args.dry_run, restart=args.restart)
+    print_stats(stats, args.dry_run)
+
+def mode_favorites(args):
+    # Only query cards you are actively tracking to save time!
+    names = sorted({r.name for r in db.session.query(CardReference.name).filter_by(is_favorite=True)})
+    checkpoint = None if args.restart else load_checkpoints().get('favorites')
+    done = set(checkpoint['done']) if checkpoint else set()
+    print(f"Starting variant patch for {len(names)} names ({len(done)} already done)")
+
+    totals = {'inserted': 0, 'updated': 0, 'prices_refreshed': 0, 'failed_pages': []}
+    for name in names:
+        if name in done:
+            continue
+        print(f"Fetching variants for {name}...")
+        stats = run_ingest(q=f'name:"{name}"', update_only=True, dry_run=args.dry_run)
+        totals['updated'] += stats['updated']
+        totals['prices_refreshed'] += stats['prices_refreshed']
+        totals['failed_pages'] += stats['failed_pages']
+        if not args.dry_run and not stats['failed_pages']:
+            done.add(name)
+            save_checkpoint('favorites', {'done': sorted(done)})
+
+    if not args.dry_run and not totals['failed_pages']:
+        save_checkpoint('favorites', None)
+    print_stats(totals, args.dry_run)
+
+def mode_id(args):
+    http = api_session(pool_size=1)
+    items = []
+    for api_id in args.api_ids:
+        item = fetch_card(http, api_id.strip())
+        if item:
+            items.append(item)
+        else:
+            print(f"❌ API could not find a card with ID: {api_id}")
+    # Single-id fetches are deliberate: flag them as favorites like /api/force_api_fetch does
+    stats = write_pages(diff_pages(normalize_pages([(1, items)]), favorite=True), dry_run=args.dry_run)
+    print_stats(stats, args.dry_run)
+
+def mode_prices(args):
+    print(f"💲 Refreshing cached prices older than {PRICE_CACHE_TTL} for owned cards...")
+    failed = []
+
+    def on_batch(chunk, fetched, error):
+        if error:
+            failed.extend(chunk)
+            print(f"⚠️ Batch of {len(chunk)} failed: {error}", flush=True)
+        else:
+            print(f"✅ {len(fetched)} references priced so far.", flush=True)
+
+    count = refresh_stale_prices(limit=args.limit, on_batch=on_batch)
+    print(f"💲 Checked {count} stale references ({len(failed)} failed).")
+
+def main():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--dry-run', action='store_true', help="Fetch and diff, but write nothing")
+    common.add_argument('--restart', action='store_true', help="Ignore any saved checkpoint")
+
+    parser = argparse.ArgumentParser(description="Pokemon TCG catalog ingest")
+    modes = parser.add_subparsers(dest='mode', required=True)
+    modes.add_parser('build', parents=[common], help="Full catalog build").set_defaults(func=mode_build)
+    species = modes.add_parser('species', parents=[common], help="Deep-dive one species")
+    species.add_argument('name', nargs='+')
+    species.set_defaults(func=mode_species)
+    modes.add_parser('favorites', parents=[common], help="Patch variants for favorited names").set_defaults(func=mode_favorites)
+    single = modes.add_parser('id', parents=[common], help="Fetch specific API ids")
+    single.add_argument('api_ids', nargs='+')
+    single.set_defaults(func=mode_id)
+    prices = modes.add_parser('prices', help="Refresh stale cached prices (TTL sweep)")
+    prices.add_argument('--limit', type=int, help="Refresh at most this many references")
+    prices.set_defaults(func=mode_prices)
+
+    args = parser.parse_args()
+    with app.app_context():
+        args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,4 @@
-from app import app, db, CardReference
+from app import app, db, CardReference, rebuild_species_index, rebuild_finish_index, rebuild_completion_counters, rebuild_trade_slots
 
 def nuke_dictionary():
     with app.app_context():
@@ -6,9 +6,13 @@ def nuke_dictionary():
         try:
             # Delete all rows in the CardReference table
             num_deleted = db.session.query(CardReference).delete()
+            rebuild_species_index()
+            rebuild_finish_index()
+            rebuild_completion_counters()
+            rebuild_trade_slots()
             db.session.commit()
             print(f"✅ Successfully wiped {num_deleted} cards from the dictionary cache!")
-            print("You are clear to run build_cache.py.")
+            print("You are clear to run: python ingest.py build")
         except Exception as e:
             db.session.rollback()
             print(f"❌ Error wiping cache: {str(e)}")
@@ -0,0 +1,27 @@
+from app import (app, db, CompletionCounter, rebuild_species_index, rebuild_finish_index,
+                 rebuild_completion_counters, rebuild_trade_slots)
+
+# Repair tool: re-extracts the species and finish indexes, recounts every Pokedex completion counter
+# (per species and per set) and rebuilds the trade matching index from scratch. All of them are normally
+# kept current by the app; run this after manual DB edits, a crash, or a change to the species/finish
+# normalization rules.
+
+def rebuild():
+    with app.app_context():
+        print("🔢 Rebuilding Pokedex completion counters...")
+        try:
+            before = db.session.query(CompletionCounter).count()
+            refs = rebuild_species_index()
+            rebuild_finish_index()
+            print(f"🧬 Re-indexed species and finishes for {refs} dictionary cards.")
+            written = rebuild_completion_counters()
+            trade_rows = rebuild_trade_slots()
+            db.session.commit()
+            print(f"✅ Rebuilt {written['species']} species and {written['set']} set counter rows (was {before} rows).")
+            print(f"🤝 Rebuilt {trade_rows} trade index rows.")
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error rebuilding counters: {str(e)}")
+
+if __name__ == '__main__':
+    rebuild()
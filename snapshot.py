@@ -0,0 +1,155 @@
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from sqlalchemy import text
+from app import (app, db, CardReference, CatalogChange, CATALOG_RELOAD_MARKER,
+                 init_reference_fts, init_catalog_changelog, rebuild_reference_fts,
+                 rebuild_species_index, rebuild_finish_index, rebuild_completion_counters, rebuild_trade_slots,
+                 normalize_name, normalize_number)
+
+# Offline copy of the Master Dictionary (CardReference) so a fresh container doesn't have to
+# re-crawl the API. File format: gzip'd JSON Lines.
+#   line 1  -> header {"format", "version", "exported_at", "count", "columns"}
+#   line 2+ -> one JSON array per card, values in header["columns"] order
+# Columns a file doesn't list (e.g. prices in snapshots taken before they were cached) import as NULL.
+#
+#   python snapshot.py export instance/catalog_snapshot.jsonl.gz
+#   python snapshot.py import instance/catalog_snapshot.jsonl.gz [--replace | --if-empty]
+
+SNAPSHOT_FORMAT = 'fludinventory-catalog'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_COLUMNS = ['id', 'name', 'set_name', 'set_id', 'number', 'image_url', 'tcgplayer_id',
+                    'release_date', 'available_finishes', 'is_favorite', 'prices', 'prices_updated_at']
+DATETIME_COLUMNS = {'prices_updated_at'}
+IMPORT_BATCH_SIZE = 5000
+
+def export_snapshot(path):
+    table = CardReference.__table__
+    columns = [table.c[name] for name in SNAPSHOT_COLUMNS]
+    count = db.session.query(CardReference).count()
+
+    tmp_path = path + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        f.write(json.dumps({
+            'format': SNAPSHOT_FORMAT,
+            'version': SNAPSHOT_VERSION,
+            'exported_at': datetime.utcnow().isoformat(),
+            'count': count,
+            'columns': SNAPSHOT_COLUMNS,
+        }) + "\n")
+        for row in db.session.execute(db.select(*columns).order_by(table.c.id)).yield_per(IMPORT_BATCH_SIZE):
+            values = [value.isoformat() if isinstance(value, datetime) else value for value in row]
+            f.write(json.dumps(values, separators=(',', ':')) + "\n")
+    os.replace(tmp_path, path)
+    return count
+
+def read_snapshot(path):
+    """Yields row dicts after validating the header."""
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        header = json.loads(f.readline())
+        if header.get('format') != SNAPSHOT_FORMAT:
+            raise ValueError(f"{path} is not a catalog snapshot")
+        if header.get('version', 0) > SNAPSHOT_VERSION:
+            raise ValueError(f"Snapshot version {header['version']} is newer than this app understands ({SNAPSHOT_VERSION})")
+        columns = header['columns']
+        for line in f:
+            if line.strip():
+                row = dict(zip(columns, json.loads(line)))
+                row['name_key'] = normalize_name(row.get('name'))
+                row['number_key'] = normalize_number(row.get('number'))
+                for name in DATETIME_COLUMNS.intersection(row):
+                    if row[name]:
+                        row[name] = datetime.fromisoformat(row[name])
+                yield row
+
+def import_snapshot(path, replace=False):
+    """Bulk-loads a snapshot. On SQLite the card_reference triggers and indexes are dropped for
+    the load and rebuilt once at the end, which is far cheaper than maintaining them per row."""
+    table = CardReference.__table__
+    sqlite = db.engine.dialect.name == 'sqlite'
+    trigger_names = []
+
+    if replace:
+        db.session.query(CardReference).delete()
+        db.session.commit()
+    elif db.session.query(CardReference).count():
+        raise ValueError("CardReference is not empty (use --replace to overwrite it)")
+
+    if sqlite:
+        trigger_names = [r[0] for r in db.session.execute(text(
+            "SELECT name FROM sqlite_master WHERE type='trigger' AND tbl_name='card_reference'"
+        ))]
+        for name in trigger_names:
+            db.session.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+        db.session.commit()
+        for index in table.indexes:
+            index.drop(db.engine, checkfirst=True)
+
+    count = 0
+    try:
+        batch = []
+        for row in read_snapshot(path):
+            batch.append(row)
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                db.session.execute(table.insert(), batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            db.session.execute(table.insert(), batch)
+            count += len(batch)
+        rebuild_species_index()
+        rebuild_finish_index()
+        rebuild_completion_counters()
+        rebuild_trade_slots()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        if sqlite:
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
+            if trigger_names:
+                init_reference_fts()
+                init_catalog_changelog()
+                rebuild_reference_fts()
+            # Running workers patch their autocomplete from the feed; tell them to reload instead
+            db.session.add(CatalogChange(ref_id=CATALOG_RELOAD_MARKER))
+            db.session.commit()
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Export / import the Master Dictionary snapshot")
+    modes = parser.add_subparsers(dest='mode', required=True)
+    export_cmd = modes.add_parser('export')
+    export_cmd.add_argument('path')
+    import_cmd = modes.add_parser('import')
+    import_cmd.add_argument('path')
+    import_cmd.add_argument('--replace', action='store_true', help="Wipe the current dictionary first")
+    import_cmd.add_argument('--if-empty', action='store_true',
+                            help="Quietly skip if the dictionary already has cards or the file is missing (container start)")
+    args = parser.parse_args()
+
+    with app.app_context():
+        started = time.monotonic()
+        if args.mode == 'export':
+            count = export_snapshot(args.path)
+            print(f"📦 Exported {count} cards to {args.path} in {time.monotonic() - started:.1f}s")
+            return
+
+        if args.if_empty and (not os.path.exists(args.path) or db.session.query(CardReference.id).first()):
+            print("ℹ️ Snapshot import skipped (dictionary already populated or no snapshot file).")
+            return
+        try:
+            count = import_snapshot(args.path, replace=args.replace)
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        print(f"✅ Imported {count} cards from {args.path} in {time.monotonic() - started:.1f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import os
+import sys
+import tempfile
+
+import pytest
+from flask import g
+
+# app.py configures itself at import time, so point it at a scratch database first
+TEST_DB_DIR = tempfile.mkdtemp(prefix='fludinventory-tests-')
+os.environ['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(TEST_DB_DIR, 'inventory.db')
+os.environ.setdefault('ADMIN_EMAIL', 'admin@example.com')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as inventory_app  # noqa: E402
+from app import app, db  # noqa: E402
+
+# The per-worker threads (outbox sender, session sweeper, autocomplete warmer) would race the tests on the
+# shared database; mark them as already running so the first test request doesn't start them
+inventory_app.worker_threads.update({'session-sweeper', 'outbox-sender', 'autocomplete-warmer'})
+
+
+@pytest.fixture
+def app_ctx():
+    """An app context over an emptied database and empty in-process caches."""
+    with app.app_context():
+        yield app
+        db.session.rollback()
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+        db.session.remove()
+    inventory_app.storefront_cache.clear()
+    inventory_app.reference_autocomplete = inventory_app.ReferenceAutocomplete()
+
+
+def make_user(username):
+    from app import User
+    user = User(username=username)
+    user.set_password('secret')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+@pytest.fixture
+def user(app_ctx):
+    return make_user('ash')
+
+
+@pytest.fixture
+def client(app_ctx):
+    return app.test_client()
+
+
+def login(client, user):
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user.id)
+        sess['_fresh'] = True
+    # Test requests share the fixture's app context, so drop the user Flask-Login cached on g by an earlier one
+    g.pop('_login_user', None)
+    return client
+
+
+def add_references(*refs):
+    """Adds CardReference rows given as (id, name[, set_name, number, release_date, available_finishes]) and
+    indexes their species and finishes, like a catalog sync would."""
+    from app import CardReference, rebuild_species_index, rebuild_finish_index
+    defaults = ('', '', 'Base', '1', '1999/01/09', 'Normal,Holofoil')
+    for ref in refs:
+        ref_id, name, set_name, number, release_date, finishes = tuple(ref) + defaults[len(ref):]
+        db.session.add(CardReference(id=ref_id, name=name, set_name=set_name, set_id=set_name.lower(),
+                                     number=number, release_date=release_date, available_finishes=finishes))
+    db.session.commit()
+    rebuild_species_index()
+    rebuild_finish_index()
+    db.session.commit()
+
+
+def add_card(user, name='Pikachu', quantity=1, **fields):
+    from app import Card
+    values = dict(game='Pokemon', user_id=user.id, card_name=name, set_name='Base', price=1.0, quantity=quantity,
+                  finish='Normal', condition='NM')
+    values.update(fields)
+    card = Card(**values)
+    db.session.add(card)
+    db.session.commit()
+    return card
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self.payload = payload or {}
+
+    def json(self):
+        return self.payload
+
+
+class FakeCatalogAPI:
+    """Stands in for the requests session pointed at /v2/cards: serves `cards` page_size at a time.
+    Statuses queued in errors[page] are returned before that page succeeds."""
+
+    def __init__(self, cards, page_size=2, errors=None):
+        self.cards = cards
+        self.page_size = page_size
+        self.errors = {page: list(codes) for page, codes in (errors or {}).items()}
+        self.requests = []
+
+    def get(self, url, params=None, timeout=None):
+        params = params or {}
+        self.requests.append(dict(params))
+        page = params.get('page', 1)
+        if self.errors.get(page):
+            return FakeResponse(self.errors[page].pop(0))
+        start = (page - 1) * self.page_size
+        return FakeResponse(200, {'data': self.cards[start:start + self.page_size], 'totalCount': len(self.cards)})
@@ -0,0 +1,94 @@
+import pytest
+from sqlalchemy import event
+
+import app as inventory_app
+from app import db, CardReference, CatalogChange, CATALOG_RELOAD_MARKER, ReferenceAutocomplete
+from conftest import add_references, login
+
+
+@pytest.fixture
+def index(app_ctx):
+    add_references(
+        ('base1-58', 'Pikachu', 'Base', '58', '1999/01/09'),
+        ('swsh45-27', 'Pikachu V', 'Shining Fates', '27', '2021/02/19'),
+        ('jungle-60', 'Pikachu', 'Jungle', '60', '1999/06/16'),
+        ('neo2-12', 'Surfing Pikachu', 'Neo Discovery', '12', '2001/06/01'),
+        ('cel-24', 'Flying Raichu', 'Celebrations', '24', '2021/10/08'),
+    )
+    db.session.execute(db.update(CardReference).where(CardReference.id == 'swsh45-27').values(set_id='swsh45'))
+    db.session.commit()
+    autocomplete = ReferenceAutocomplete()
+    autocomplete.load_all()
+    return autocomplete
+
+
+def ids(results):
+    return [entry[0] for entry in results]
+
+
+def test_ranks_exact_then_prefix_then_word_then_newest(index):
+    # Exact name (newest first), then name prefix, then a later word of the name
+    assert ids(index.search('pikachu')) == ['jungle-60', 'base1-58', 'swsh45-27', 'neo2-12']
+    # Substring hits only: newest release first
+    assert ids(index.search('chu')) == ['cel-24', 'swsh45-27', 'neo2-12', 'jungle-60', 'base1-58']
+
+
+def test_matches_set_names_numbers_and_set_codes(index):
+    assert ids(index.search('pikachu jungle')) == ['jungle-60']
+    assert ids(index.search('pika 58')) == ['base1-58']
+    assert ids(index.search('fates')) == ['swsh45-27']
+    assert ids(index.search('swsh45')) == ['swsh45-27']
+    assert index.search('pikachu mewtwo') == []
+    assert index.search('!!') == []
+
+
+def test_catalog_changes_are_patched_in(index, monkeypatch):
+    reloads = []
+    monkeypatch.setattr(index, 'load_all', lambda *a, **kw: reloads.append(a))
+    db.session.add(CardReference(id='cel-5', name='Pikachu Cosplay', set_name='Celebrations', number='5',
+                                 release_date='2021/10/08'))
+    db.session.execute(db.update(CardReference).where(CardReference.id == 'cel-24').values(name='Flying Pikachu'))
+    db.session.execute(db.delete(CardReference).where(CardReference.id == 'jungle-60'))
+    db.session.commit()
+
+    index.refresh(force=True)
+    assert reloads == []
+    assert ids(index.search('pikachu')) == ['base1-58', 'cel-5', 'swsh45-27', 'cel-24', 'neo2-12']
+    assert index.search('raichu') == []
+    assert index.last_change_id == db.session.query(db.func.max(CatalogChange.id)).scalar()
+
+
+def test_reload_marker_and_feed_gaps_reload_everything(index, monkeypatch):
+    reloads = []
+    monkeypatch.setattr(index, 'load_all', lambda *a, **kw: reloads.append(a))
+    db.session.add(CatalogChange(ref_id=CATALOG_RELOAD_MARKER))
+    db.session.commit()
+    index.refresh(force=True)
+    assert len(reloads) == 1
+
+    index.last_change_id = -5   # rows it still needed were pruned
+    index.refresh(force=True)
+    assert len(reloads) == 2
+
+
+def test_searches_between_refreshes_skip_the_database(index):
+    statements = []
+    engine = db.engine
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+        for query in ('pik', 'pikachu base', 'fates', 'raichu'):
+            assert index.search(query)
+    finally:
+        event.remove(engine, 'before_cursor_execute', listener)
+    assert statements == []
+
+
+def test_warm_loads_the_worker_index(client, user):
+    add_references(('base1-58', 'Pikachu', 'Base', '58'))
+    inventory_app.reference_autocomplete.warm()
+    assert inventory_app.reference_autocomplete.loaded
+
+    login(client, user)
+    response = client.get('/api/pos_search?q=pika')
+    assert [card['id'] for card in response.get_json()['dictionary']] == ['base1-58']
@@ -0,0 +1,81 @@
+import threading
+
+import pytest
+
+import app as inventory_app
+from app import db, BackgroundJob, CardReference, fetch_card_page, iter_card_pages
+from conftest import FakeCatalogAPI, login, make_user
+
+
+def api_card(ref_id, name='Pikachu', tiers=('normal', 'holofoil')):
+    return {
+        'id': ref_id, 'name': name, 'number': ref_id.split('-')[-1],
+        'set': {'id': 'base1', 'name': 'Base', 'releaseDate': '1999/01/09'},
+        'tcgplayer': {'url': 'https://prices.pokemontcg.io/tcgplayer/' + ref_id,
+                      'prices': {tier: {'market': 1.0} for tier in tiers}},
+    }
+
+
+CATALOG = [api_card(f'base1-{i}') for i in range(1, 8)]
+
+
+@pytest.fixture(autouse=True)
+def small_pages(monkeypatch):
+    monkeypatch.setattr(inventory_app, 'CATALOG_PAGE_SIZE', 2)
+    monkeypatch.setattr(inventory_app.time, 'sleep', lambda seconds: None)
+
+
+def test_fetch_backs_off_on_rate_limits_then_gives_up(app_ctx):
+    http = FakeCatalogAPI(CATALOG, errors={1: [429, 503], 2: [500] * 5})
+    assert [card['id'] for card in fetch_card_page(http, 1)['data']] == ['base1-1', 'base1-2']
+    with pytest.raises(RuntimeError, match='API Error 500 on page 2'):
+        fetch_card_page(http, 2)
+    http = FakeCatalogAPI(CATALOG, errors={1: [404]})
+    with pytest.raises(RuntimeError, match='API Error 404'):
+        fetch_card_page(http, 1)
+    assert len(http.requests) == 1   # not retried
+
+
+def test_pages_are_yielded_in_order_with_failures_marked(app_ctx):
+    meta = {}
+    http = FakeCatalogAPI(CATALOG, errors={3: [500] * 5})
+    pages = list(iter_card_pages(http, meta=meta))
+    assert meta['total_pages'] == 4
+    assert [page for page, _ in pages] == [1, 2, 3, 4]
+    assert pages[2][1] is None
+    assert [card['id'] for card in pages[3][1]] == ['base1-7']
+
+
+def run_sync_job(client, monkeypatch, http):
+    monkeypatch.setattr(inventory_app, 'api_session', lambda *args, **kwargs: http)
+    client.post('/admin/sync_db')
+    job = BackgroundJob.query.order_by(BackgroundJob.id.desc()).first()
+    for thread in threading.enumerate():
+        if thread.name == f'job-catalog_sync-{job.id}':
+            thread.join(timeout=30)
+    db.session.expire_all()
+    return client.get(f'/admin/jobs/{job.id}').get_json()
+
+
+def test_sync_db_runs_the_whole_catalog_as_a_job(client, monkeypatch):
+    admin = make_user('flud')
+    admin.is_admin = True
+    db.session.commit()
+    login(client, admin)
+
+    status = run_sync_job(client, monkeypatch, FakeCatalogAPI(CATALOG, errors={3: [500] * 5}))
+    assert (status['status'], status['done'], status['total']) == ('done', 4, 4)
+    assert status['detail'] == {'failed_pages': [3]}
+    assert sorted(r.id for r in CardReference.query) == ['base1-1', 'base1-2', 'base1-3', 'base1-4', 'base1-7']
+    assert db.session.get(CardReference, 'base1-1').available_finishes == 'Normal,Holofoil'
+
+    status = run_sync_job(client, monkeypatch, FakeCatalogAPI(CATALOG))
+    assert status['status'] == 'done'
+    assert status['message'] == 'Synced/Updated 2 cards across 4 pages.'   # only the pages that failed before
+    assert CardReference.query.count() == 7
+
+
+def test_sync_db_is_admin_only(client, user):
+    login(client, user)
+    client.post('/admin/sync_db')
+    assert BackgroundJob.query.count() == 0
@@ -0,0 +1,45 @@
+from app import db, Card, take_stock
+
+
+def add_card(user, quantity):
+    card = Card(game='Pokemon', user_id=user.id, card_name='Pikachu', set_name='Base', price=1.0,
+                quantity=quantity, finish='Normal', condition='NM')
+    db.session.add(card)
+    db.session.commit()
+    return card.id
+
+
+def quantities(*card_ids):
+    db.session.expire_all()
+    return [card.quantity if card else None for card in (db.session.get(Card, card_id) for card_id in card_ids)]
+
+
+def test_takes_stock_and_deletes_sold_out_cards(user):
+    partial, last_copy = add_card(user, 3), add_card(user, 1)
+    assert take_stock(user.id, {partial: 2, last_copy: 1}) == {}
+    db.session.commit()
+    assert quantities(partial, last_copy) == [1, None]
+
+
+def test_oversell_rejects_the_whole_sale(user):
+    plenty, short = add_card(user, 5), add_card(user, 1)
+    assert take_stock(user.id, {plenty: 2, short: 2}) == {short: 1}
+    db.session.commit()
+    assert quantities(plenty, short) == [5, 1]
+
+
+def test_second_sale_of_the_last_copy_fails(user):
+    card_id = add_card(user, 1)
+    assert take_stock(user.id, {card_id: 1}) == {}
+    db.session.commit()
+    assert take_stock(user.id, {card_id: 1}) == {card_id: 0}
+
+
+def test_cannot_sell_another_users_card(user):
+    from app import User
+    other = User(username='misty', password_hash='x')
+    db.session.add(other)
+    db.session.commit()
+    card_id = add_card(other, 2)
+    assert take_stock(user.id, {card_id: 1}) == {card_id: 0}
+    assert quantities(card_id) == [2]
@@ -0,0 +1,120 @@
+import pytest
+
+import app as inventory_app
+from app import db, Card, CompletionCounter, MasterTracker, TradeSlot, TRADE_INDEX_BUILT, diff_pages, \
+    normalize_pages, read_completion, rebuild_completion_counters, rebuild_trade_slots, write_pages
+from conftest import add_card, add_references, login, make_user
+
+
+@pytest.fixture
+def catalog(app_ctx):
+    add_references(('base-1', 'Mew'), ('base-4', 'Mewtwo', 'Base', '4'), ('jungle-2', 'Mew ex', 'Jungle', '2'))
+    db.session.add(MasterTracker(species_name='Mew'))
+    db.session.commit()
+    rebuild_completion_counters()
+    rebuild_trade_slots()
+    db.session.commit()
+
+
+def counters():
+    return sorted((c.user_id, c.scope, c.key, c.slots) for c in CompletionCounter.query)
+
+
+def trade_slots():
+    return sorted((s.user_id, s.side, s.reference_id, s.finish_code) for s in TradeSlot.query.filter(
+        TradeSlot.user_id != TRADE_INDEX_BUILT['user_id']))
+
+
+def assert_matches_rebuild():
+    incremental = counters(), trade_slots()
+    rebuild_completion_counters()
+    rebuild_trade_slots()
+    db.session.commit()
+    assert incremental == (counters(), trade_slots())
+
+
+def owned(user, scope, key):
+    return read_completion(user.id, scope, [key])[0]['owned']
+
+
+def api_card(ref_id, name, set_id, tiers=('normal', 'holofoil')):
+    return {
+        'id': ref_id, 'name': name, 'number': ref_id.split('-')[-1],
+        'set': {'id': set_id, 'name': set_id.title(), 'releaseDate': '2000/01/01'},
+        'tcgplayer': {'url': 'https://prices.pokemontcg.io/tcgplayer/' + ref_id,
+                      'prices': {tier: {'market': 1.0} for tier in tiers}},
+    }
+
+
+def sync(*items):
+    return write_pages(diff_pages(normalize_pages([(1, list(items))])))
+
+
+def test_reading_a_new_tracker_builds_its_counters(catalog):
+    ash = make_user('ash')
+    add_card(ash, 'Mewtwo', reference_id='base-4', finish='Holofoil')
+    db.session.add(MasterTracker(species_name='Mewtwo'))
+    db.session.commit()
+    assert read_completion(ash.id, 'species', ['Mewtwo']) == \
+        [{'name': 'Mewtwo', 'total': 2, 'owned': 1, 'percent': 50}]
+    assert (ash.id, 'species', 'Mewtwo', 1) in counters()
+
+
+def test_card_writes_move_owned_counts(catalog):
+    ash = make_user('ash')
+    first = add_card(ash, 'Mew', reference_id='base-1', finish='Holofoil')
+    second = add_card(ash, 'Mew', reference_id='base-1', finish='Holofoil', quantity=0)
+    assert owned(ash, 'species', 'Mew') == 1   # one slot, however many copies
+    assert owned(ash, 'set', 'base') == 1
+
+    second.finish = 'Normal'
+    db.session.commit()
+    assert owned(ash, 'species', 'Mew') == 2
+    db.session.delete(first)
+    db.session.commit()
+    assert owned(ash, 'species', 'Mew') == 1
+    assert_matches_rebuild()
+
+
+def test_force_variant_adds_a_slot(client, catalog):
+    ash = make_user('ash')
+    add_card(ash, 'Mew', reference_id='base-1', finish='Reverse Holofoil')
+    assert read_completion(ash.id, 'species', ['Mew'])[0]['total'] == 4
+    assert owned(ash, 'species', 'Mew') == 0   # Not a finish base-1 has yet
+
+    login(client, ash)
+    client.post('/api/force_variant', data={'reference_id': 'base-1', 'new_finish': 'Reverse Holofoil'})
+    assert read_completion(ash.id, 'species', ['Mew']) == [{'name': 'Mew', 'total': 5, 'owned': 1, 'percent': 20}]
+    assert read_completion(ash.id, 'set', ['base'])[0]['total'] == 5
+    assert_matches_rebuild()
+
+
+def test_sync_recounts_only_the_touched_species_and_sets(catalog, monkeypatch):
+    ash = make_user('ash')
+    add_card(ash, 'Mew', reference_id='base-1', finish='Holofoil')
+    add_card(ash, 'Mewtwo', reference_id='base-4')
+
+    built = []
+    real_build = inventory_app.build_completion
+    monkeypatch.setattr(inventory_app, 'build_completion',
+                        lambda scope, keys=None: built.append((scope, keys)) or real_build(scope, keys))
+    stats = sync(api_card('neo-3', 'Mew', 'neo'), api_card('jungle-2', 'Mew ex', 'jungle', ('normal', 'reverseHolofoil')))
+    assert (stats['inserted'], stats['updated']) == (1, 1)
+    assert built == [('species', ['Mew']), ('set', ['jungle', 'neo'])]
+
+    assert read_completion(ash.id, 'species', ['Mew'])[0]['total'] == 6
+    assert {ref for _, side, ref, _ in trade_slots() if side == 'want'} == {'base-1', 'jungle-2', 'neo-3'}
+    assert_matches_rebuild()
+
+
+def test_sync_dropping_the_only_owned_finish_ends_the_collection(catalog):
+    ash = make_user('ash')
+    add_card(ash, 'Mew ex', reference_id='jungle-2', finish='Holofoil')
+    assert {ref for _, side, ref, _ in trade_slots() if side == 'want'} == {'base-1', 'jungle-2'}
+
+    sync(api_card('jungle-2', 'Mew ex', 'jungle', ('normal',)))
+    # The card no longer fills a slot, so ash stops hunting every Mew, not just jungle-2
+    assert trade_slots() == []
+    assert owned(ash, 'species', 'Mew') == 0
+    assert Card.query.count() == 1
+    assert_matches_rebuild()
@@ -0,0 +1,48 @@
+import pytest
+
+import app as inventory_app
+from app import db, HuntCache
+from conftest import add_card, add_references, login
+
+
+@pytest.fixture
+def hunter(client, user):
+    add_references(('base1-10', 'Mewtwo', 'Base', '10'), ('base1-11', 'Mew', 'Base', '11'),
+                   ('promo-8', 'Mew ex', 'Promo', '8', '2004/05/01', 'Holofoil'))
+    return login(client, user)
+
+
+def test_lists_missing_finishes_of_the_species_only(hunter):
+    response = hunter.get('/hunt/mew')
+    assert response.status_code == 200
+    assert b'Mew ex' in response.data and b'Mewtwo' not in response.data
+    assert response.headers['ETag'] and response.headers['Cache-Control'] == 'private, no-cache'
+
+
+def test_unchanged_list_revalidates_with_304(hunter):
+    etag = hunter.get('/hunt/mew').headers['ETag'].strip('"')
+    response = hunter.get('/hunt/mew', headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 304 and response.data == b''
+
+
+def test_owning_a_slot_invalidates_only_that_species(hunter, user):
+    mew_etag = hunter.get('/hunt/mew').headers['ETag']
+    mewtwo_etag = hunter.get('/hunt/mewtwo').headers['ETag']
+    add_card(user, 'Mew', reference_id='base1-11', finish='Holofoil')
+    assert db.session.get(HuntCache, (user.id, 'mewtwo')) is not None
+    assert hunter.get('/hunt/mew', headers={'If-None-Match': mew_etag}).status_code == 200
+    assert hunter.get('/hunt/mewtwo', headers={'If-None-Match': mewtwo_etag}).status_code == 304
+
+
+def test_template_change_changes_the_etag(hunter, monkeypatch):
+    etag = hunter.get('/hunt/mew').headers['ETag']
+    monkeypatch.setattr(inventory_app, 'HUNT_FINGERPRINT', 'new-deploy')
+    response = hunter.get('/hunt/mew', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag
+
+
+def test_pending_flashes_skip_the_304(hunter):
+    etag = hunter.get('/hunt/mew').headers['ETag']
+    with hunter.session_transaction() as sess:
+        sess['_flashes'] = [('message', 'Saved.')]
+    assert hunter.get('/hunt/mew', headers={'If-None-Match': etag}).status_code == 200
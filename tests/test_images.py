@@ -0,0 +1,102 @@
+import os
+import queue
+
+import pytest
+
+import app as inventory_app
+from app import CARD_BACKS, download_image, image_paths, image_signature, image_token, thumb_url
+from conftest import add_card
+
+ART = 'https://images.pokemontcg.io/base1/58.png'
+
+
+class FakeImageHost:
+    def __init__(self, status=200, content_type='image/png', body=b'\x89PNG fake'):
+        self.status, self.content_type, self.body = status, content_type, body
+        self.hits = 0
+
+    def get(self, url, timeout=None, stream=False):
+        self.hits += 1
+        host = self
+
+        class Response:
+            status_code = host.status
+            headers = {'Content-Type': host.content_type}
+
+            def iter_content(self, size):
+                yield host.body
+        return Response()
+
+
+@pytest.fixture
+def images(app_ctx, tmp_path, monkeypatch):
+    monkeypatch.setattr(inventory_app, 'IMAGE_ROOT', str(tmp_path))
+    monkeypatch.setattr(inventory_app, 'start_worker_thread', lambda name, target: None)
+    yield tmp_path
+    inventory_app.image_pending.clear()
+    while True:
+        try:
+            inventory_app.image_queue.get_nowait()
+        except queue.Empty:
+            break
+
+
+def test_thumb_urls_are_signed_local_paths(app_ctx):
+    with inventory_app.app.test_request_context():
+        token = image_token(ART)
+        assert thumb_url(ART, 'md') == f'/img/md/{image_signature(token)}/{token}'
+        assert thumb_url('https://evil.example/x.png') == 'https://evil.example/x.png'
+        assert thumb_url('', game='Pokemon TCG') == thumb_url(CARD_BACKS['pokemon'])
+
+
+def test_a_miss_redirects_to_the_source_and_queues_one_download(client, images):
+    with inventory_app.app.test_request_context():
+        url = thumb_url(ART, 'sm')
+    for _ in range(2):
+        response = client.get(url)
+        assert response.status_code == 302 and response.headers['Location'] == ART
+    assert inventory_app.image_pending == {(ART, 'sm')}
+    assert inventory_app.image_queue.qsize() == 1
+
+
+def test_a_hit_is_served_with_a_long_immutable_cache(client, images):
+    _, path = image_paths(ART, 'full')
+    os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG cached')
+    token = image_token(ART)
+    response = client.get(f'/img/full/{image_signature(token)}/{token}')
+    assert response.status_code == 200 and response.data == b'\x89PNG cached'
+    assert response.cache_control.immutable and response.cache_control.public
+    assert response.cache_control.max_age == inventory_app.IMAGE_CACHE_MAX_AGE
+
+
+def test_forged_or_foreign_urls_are_refused(client, images):
+    token = image_token(ART)
+    assert client.get(f'/img/sm/{"0" * 16}/{token}').status_code == 404
+    assert client.get(f'/img/xl/{image_signature(token)}/{token}').status_code == 404
+    foreign = image_token('https://evil.example/x.png')
+    assert client.get(f'/img/sm/{image_signature(foreign)}/{foreign}').status_code == 404
+    assert inventory_app.image_queue.qsize() == 0
+
+
+def test_downloads_are_cached_and_failures_back_off(images):
+    host = FakeImageHost()
+    path = download_image(ART, host)
+    assert open(path, 'rb').read() == b'\x89PNG fake'
+    assert download_image(ART, host) == path and host.hits == 1
+
+    broken = 'https://images.pokemontcg.io/base1/missing.png'
+    html = FakeImageHost(content_type='text/html')
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            download_image(broken, html)
+    assert html.hits == 1   # the .failed marker holds retries off
+    assert not os.path.exists(image_paths(broken, 'full')[0])
+
+
+def test_storefront_markup_never_hotlinks_card_art(client, images, user):
+    add_card(user, 'Pikachu', image_url=ART)
+    html = client.get('/u/ash').get_data(as_text=True)
+    assert ART not in html
+    assert f'/img/sm/{image_signature(image_token(ART))}/{image_token(ART)}' in html
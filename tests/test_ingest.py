@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+import app as inventory_app
+import ingest
+from app import db, CardReference, diff_pages, get_clean_finishes, normalize_pages, reference_row, write_pages
+from conftest import FakeCatalogAPI
+
+
+def api_card(ref_id, name='Pikachu', tiers=('normal', 'holofoil'), market=1.0):
+    return {
+        'id': ref_id, 'name': name, 'number': ref_id.split('-')[-1],
+        'set': {'id': 'base1', 'name': 'Base', 'releaseDate': '1999/01/09'},
+        'tcgplayer': {'url': 'https://prices.pokemontcg.io/tcgplayer/' + ref_id,
+                      'prices': {tier: {'market': market} for tier in tiers}},
+    }
+
+
+@pytest.fixture
+def api(monkeypatch, tmp_path):
+    monkeypatch.setattr(inventory_app, 'CATALOG_PAGE_SIZE', 2)
+    monkeypatch.setattr(inventory_app.time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(ingest, 'CHECKPOINT_PATH', str(tmp_path / 'ingest_checkpoint.json'))
+
+    def serve(http):
+        monkeypatch.setattr(inventory_app, 'api_session', lambda *args, **kwargs: http)
+        return http
+    return serve
+
+
+@pytest.mark.parametrize('tiers, finishes', [
+    ({'holofoil': {}, 'reverseHolofoil': {}}, 'Holofoil,Reverse Holofoil'),
+    ({'1stEditionHolofoil': {}, 'unlimitedHolofoil': {}}, '1st Edition Holofoil,Unlimited Holofoil'),
+    ({'normal': {}, 'holo': {}, 'foil': {}}, 'Normal,Holofoil'),
+    ({'shadowlessHolofoil': {}}, 'Shadowless Holofoil'),
+    ({}, 'Normal'),
+])
+def test_one_canonical_finish_mapper(tiers, finishes):
+    assert get_clean_finishes({'prices': tiers}) == finishes
+
+
+def test_diff_splits_inserts_updates_and_price_refreshes(app_ctx):
+    write_pages(diff_pages(normalize_pages([(1, [api_card('base1-1'), api_card('base1-2')])])))
+    pages = [(1, [api_card('base1-1', market=2.0), api_card('base1-2', tiers=('normal',)), api_card('base1-3'), {}]),
+             (2, None)]
+    page, inserts, updates, refreshed = next(diff_pages(normalize_pages(pages)))
+    assert [(r['id'], r['is_favorite']) for r in inserts] == [('base1-3', False)]
+    assert [(r['id'], r['available_finishes']) for r in updates] == [('base1-2', 'Normal')]
+    assert [r['id'] for r in refreshed] == ['base1-1']
+
+    # Favoriting is a real change too
+    _, inserts, updates, refreshed = next(diff_pages(normalize_pages(pages), favorite=True))
+    assert [(r['id'], r['is_favorite']) for r in inserts] == [('base1-3', True)]
+    assert [r['id'] for r in updates] == ['base1-1', 'base1-2'] and refreshed == []
+
+    _, inserts, updates, refreshed = next(diff_pages(normalize_pages(pages[:1]), update_only=True))
+    assert inserts == []
+
+    stats = write_pages(diff_pages(normalize_pages(pages)))
+    assert stats == {'pages': 2, 'inserted': 1, 'updated': 1, 'prices_refreshed': 2, 'failed_pages': [2]}
+    db.session.expire_all()
+    assert json.loads(db.session.get(CardReference, 'base1-1').prices)['normal']['market'] == 2.0
+
+
+def test_dry_run_writes_nothing(app_ctx):
+    stats = write_pages(diff_pages(normalize_pages([(1, [api_card('base1-1')])])), dry_run=True)
+    assert stats['inserted'] == 1
+    assert CardReference.query.count() == 0
+
+
+def test_build_resumes_from_the_first_failed_page(app_ctx, api):
+    catalog = [api_card(f'base1-{i}') for i in range(1, 8)]
+    http = api(FakeCatalogAPI(catalog, errors={2: [500] * 5}))
+    stats = ingest.run_paged('build')
+    assert (stats['inserted'], stats['failed_pages']) == (5, [2])
+    assert ingest.load_checkpoints() == {'build': {'next_page': 2}}
+
+    http = api(FakeCatalogAPI(catalog))
+    stats = ingest.run_paged('build')
+    assert [r['page'] for r in http.requests] == [2, 3, 4]
+    assert stats['inserted'] == 2
+    assert CardReference.query.count() == 7
+    assert ingest.load_checkpoints() == {}
+
+
+def test_species_deep_dive_flags_favorites(app_ctx, api):
+    http = api(FakeCatalogAPI([api_card('base1-56', 'Meowth'), api_card('swsh1-2', 'Galarian Meowth')]))
+    ingest.run_paged('species:meowth', q='name:*Meowth*', favorite=True)
+    assert http.requests[0]['q'] == 'name:*Meowth*'
+    assert {r.id for r in CardReference.query.filter_by(is_favorite=True)} == {'base1-56', 'swsh1-2'}
+
+
+def test_reference_row_keeps_match_keys_and_prices(app_ctx):
+    row = reference_row(api_card('base1-058', 'Pikachu - 58/102', market=1.5))
+    assert (row['name_key'], row['number_key']) == ('pikachu', '58')
+    assert json.loads(row['prices']) == {'normal': {'market': 1.5}, 'holofoil': {'market': 1.5}}
@@ -0,0 +1,77 @@
+import gzip
+import json
+
+import pytest
+from sqlalchemy import event
+
+from app import db, INVENTORY_API_FIELDS
+from conftest import add_card
+
+
+@pytest.fixture
+def stock(user):
+    cards = [add_card(user, f'Card {i:02}', set_name='Jungle' if i % 2 else 'Base', price=float(i))
+             for i in range(1, 8)]
+    add_card(user, 'Sold Out', quantity=0)
+    return [c.id for c in cards]
+
+
+def test_no_paging_arguments_returns_every_card_with_all_fields(client, stock):
+    response = client.get('/api/inventory/ash')
+    data = response.get_json()
+    assert [card['id'] for card in data] == stock
+    assert set(data[0]) == set(INVENTORY_API_FIELDS)
+    assert 'Link' not in response.headers
+
+
+def test_pages_follow_the_link_header(client, stock):
+    seen, url = [], '/api/inventory/ash?limit=3&fields=card_name&set=jungle&username=mallory'
+    while url:
+        response = client.get(url)
+        seen += response.get_json()
+        link = response.headers.get('Link')
+        url = link[1:link.index('>')] if link else None
+        if url:
+            assert 'username=' not in url.split('?')[1]
+    assert seen == [{'card_name': f'Card {i:02}'} for i in (1, 3, 5, 7)]
+
+
+def test_fields_filters_and_bad_arguments(client, stock):
+    assert client.get('/api/inventory/ash?fields=card_name,price&q=card 0').get_json()[:2] == \
+        [{'card_name': 'Card 01', 'price': 1.0}, {'card_name': 'Card 02', 'price': 2.0}]
+    assert client.get('/api/inventory/ash?fields=password_hash').status_code == 400
+    assert client.get('/api/inventory/ash?limit=abc').status_code == 400
+    assert client.get('/api/inventory/ash?limit=0').status_code == 400
+    assert client.get('/api/inventory/nobody').status_code == 404
+
+
+def test_ndjson_streams_row_tuples(client, stock):
+    statements = []
+    listener = lambda conn, cursor, sql, *rest: statements.append(sql)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        response = client.get('/api/inventory/ash?format=ndjson&fields=card_name,quantity')
+        body = response.get_data(as_text=True)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert response.mimetype == 'application/x-ndjson'
+    assert [json.loads(line) for line in body.splitlines()] == \
+        [{'card_name': f'Card {i:02}', 'quantity': 1} for i in range(1, 8)]
+    card_selects = [s for s in statements if 'FROM card' in s and s.lstrip().startswith('SELECT')]
+    assert len(card_selects) == 1 and 'card.grading_company' not in card_selects[0]
+
+
+def test_responses_are_gzipped_when_accepted(client, user):
+    for i in range(40):
+        add_card(user, f'A fairly long card name number {i}', set_name='Some Expansion Set')
+    response = client.get('/api/inventory/ash', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert len(json.loads(gzip.decompress(response.data))) == 40
+
+    streamed = client.get('/api/inventory/ash?format=ndjson', headers={'Accept-Encoding': 'gzip'})
+    assert streamed.headers['Content-Encoding'] == 'gzip'
+    assert len(gzip.decompress(streamed.data).decode('utf-8').splitlines()) == 40
+
+    small = client.get('/api/inventory/ash?limit=1', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers   # below COMPRESS_MIN_BYTES
@@ -0,0 +1,124 @@
+import pytest
+from sqlalchemy import event
+
+from app import db, Card, CardReference, MasterTracker, backfill_match_keys, match_reference, \
+    match_references_bulk, normalize_name, normalize_number, read_completion
+from conftest import add_card, add_references, login
+
+
+@pytest.mark.parametrize('raw, key', [
+    ('#074/132', '74'), ('#SM51', 'sm51'), ('#013', '13'), ('TG05/TG30', 'tg5'), ('', ''), (None, ''),
+])
+def test_normalize_number(raw, key):
+    assert normalize_number(raw) == key
+
+
+@pytest.mark.parametrize('raw, key', [
+    ('Charizard - 4/102', 'charizard'), ('Mewtwo (Delta Species)', 'mewtwo'), ('Pikachu #58', 'pikachu'),
+    ('  Dark Raichu ', 'dark raichu'), (None, ''),
+])
+def test_normalize_name(raw, key):
+    assert normalize_name(raw) == key
+
+
+def test_keys_follow_every_orm_write(user):
+    card = add_card(user, 'Charizard - Holo', card_number='#004/102')
+    assert (card.name_key, card.number_key) == ('charizard', '4')
+    card.card_name, card.card_number = 'Blastoise', '2/102'
+    db.session.commit()
+    assert (card.name_key, card.number_key) == ('blastoise', '2')
+
+    add_references(('base1-4', 'Charizard', 'Base', '004'))
+    ref = db.session.get(CardReference, 'base1-4')
+    assert (ref.name_key, ref.number_key) == ('charizard', '4')
+
+
+def test_backfill_fills_rows_written_before_the_columns(user):
+    add_references(('base1-4', 'Charizard', 'Base', '4'))
+    card = add_card(user, 'Charizard', card_number='4/102')
+    db.session.execute(db.update(CardReference).values(name_key=None, number_key=None))
+    db.session.execute(db.update(Card).values(name_key=None, number_key=None))
+    db.session.commit()
+
+    backfill_match_keys(batch_size=1)
+    db.session.expire_all()
+    assert db.session.get(CardReference, 'base1-4').name_key == 'charizard'
+    assert (db.session.get(Card, card.id).name_key, db.session.get(Card, card.id).number_key) == ('charizard', '4')
+
+
+@pytest.mark.parametrize('sql, index', [
+    ("SELECT id FROM card_reference WHERE name_key = 'pikachu' AND number_key = '58'", 'ix_card_reference_name_number'),
+    ("SELECT id FROM card_reference WHERE set_id = 'base1' AND number_key = '58'", 'ix_card_reference_set_number'),
+    ("SELECT id FROM card WHERE name_key = 'pikachu' AND number_key = '58'", 'ix_card_name_number'),
+])
+def test_matcher_lookups_use_the_composite_indexes(app_ctx, sql, index):
+    plan = ' '.join(str(row[-1]) for row in db.session.execute(db.text('EXPLAIN QUERY PLAN ' + sql)))
+    assert index in plan
+
+
+@pytest.fixture
+def catalog(app_ctx):
+    add_references(
+        ('base1-58', 'Pikachu', 'Base', '58'), ('base2-87', 'Pikachu', 'Base Set 2', '87'),
+        ('jungle-60', 'Pikachu', 'Jungle', '60'), ('jungle-61', 'Pikachu', 'Jungle', '61'),
+        ('base1-4', 'Charizard', 'Base', '4'),
+    )
+    for ref in CardReference.query:
+        ref.set_id = ref.id.split('-')[0]
+    db.session.commit()
+
+
+def test_batch_matcher_tiers_and_report(catalog):
+    matches, report = match_references_bulk([
+        ('number', 'Pikachu', 'Jungle', '#061/64'),    # tier 1: name + number
+        ('set', 'Charizard - Holo', 'Base', ''),       # tier 2: name + set
+        ('exact', 'Pikachu', 'Base', ''),              # "Base" is also inside "Base Set 2"; exact set wins
+        ('code', 'Pikachu', 'base2', ''),              # paste imports give set codes
+        ('ambiguous', 'Pikachu', 'Jungle', ''),
+        ('unknown', 'Mew', 'Base', '8'),
+    ])
+    assert matches == {'number': 'jungle-61', 'set': 'base1-4', 'exact': 'base1-58', 'code': 'base2-87'}
+    assert report['matched'] == 4
+    assert report['ambiguous'] == [{'key': 'ambiguous', 'name': 'Pikachu', 'set': 'Jungle',
+                                    'candidates': ['jungle-60', 'jungle-61']}]
+    assert report['unmatched'] == [{'key': 'unknown', 'name': 'Mew', 'set': 'Base'}]
+    assert match_reference('Pikachu', 'Jungle', '60').id == 'jungle-60'
+    assert match_reference('Pikachu', 'Jungle') is None
+
+
+def test_link_orphans_loads_once_and_writes_one_update(client, catalog, user):
+    db.session.add(MasterTracker(species_name='Pikachu'))
+    db.session.commit()
+    orphans = [add_card(user, 'Pikachu', set_name='Jungle', card_number=n, game='Pokemon TCG') for n in ('60', '61')]
+    add_card(user, 'Pikachu', set_name='Jungle', game='Pokemon TCG')   # ambiguous, stays unlinked
+    add_card(user, 'Pikachu', set_name='Jungle', card_number='60', game='Magic: The Gathering')
+
+    statements = []
+    listener = lambda *args: statements.append(args[2])
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        login(client, user)
+        client.post('/admin/link_orphans')
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+
+    catalog_reads = [s for s in statements if s.lstrip().startswith('SELECT') and 'FROM card_reference ' in s
+                     and 'name_key IN' in s]
+    card_updates = [s for s in statements if s.lstrip().startswith('UPDATE card SET reference_id')]
+    assert len(catalog_reads) == 1
+    assert len(card_updates) == 1
+    db.session.expire_all()
+    assert [db.session.get(Card, c.id).reference_id for c in orphans] == ['jungle-60', 'jungle-61']
+    assert Card.query.filter(Card.reference_id.isnot(None)).count() == 2
+    # Bulk links still move the completion counters
+    assert read_completion(user.id, 'species', ['Pikachu'])[0]['owned'] == 2
+
+
+def test_paste_import_links_the_whole_paste(client, catalog, user):
+    login(client, user)
+    client.post('/paste_import', data={'game_mode': 'pokemon',
+                                       'paste_data': '2x Pikachu base2 87\nCharizard Base 4\nMew Base 8'})
+    cards = {c.card_name: c for c in Card.query.filter_by(user_id=user.id)}
+    assert (cards['Pikachu'].reference_id, cards['Pikachu'].quantity) == ('base2-87', 2)
+    assert cards['Charizard'].reference_id == 'base1-4'
+    assert cards['Mew'].reference_id is None
@@ -0,0 +1,91 @@
+import json
+import smtplib
+from datetime import datetime, timedelta
+from unittest import mock
+
+from app import (db, mail, OutboxEmail, OUTBOX_CLAIM_TIMEOUT, OUTBOX_MAX_ATTEMPTS, queue_email,
+                 claim_outbox_batch, deliver_outbox)
+
+
+class FakeConnection:
+    def __init__(self, refuse=()):
+        self.refuse = refuse
+        self.sent = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def send(self, message):
+        if message.recipients[0] in self.refuse:
+            raise smtplib.SMTPRecipientsRefused({message.recipients[0]: (550, b'no such user')})
+        self.sent.append(message)
+
+
+def queue(recipient='cust@example.com'):
+    email = queue_email('Quote', [recipient], 'body', kind='quote_customer')
+    db.session.commit()
+    return email.id
+
+
+def test_queue_skips_blank_recipients(app_ctx):
+    assert queue_email('Quote', [None, ''], 'body') is None
+    email = queue_email('Quote', [None, 'a@example.com'], 'body')
+    assert json.loads(email.recipients) == ['a@example.com']
+
+
+def test_claimed_messages_are_not_claimed_twice(app_ctx):
+    email_id = queue()
+    assert [e.id for e in claim_outbox_batch()] == [email_id]
+    assert claim_outbox_batch() == []
+
+
+def test_stale_claims_are_reclaimed(app_ctx):
+    email_id = queue()
+    claim_outbox_batch()
+    email = db.session.get(OutboxEmail, email_id)
+    email.claimed_at = datetime.utcnow() - OUTBOX_CLAIM_TIMEOUT - timedelta(seconds=1)
+    db.session.commit()
+    assert [e.id for e in claim_outbox_batch()] == [email_id]
+
+
+def test_delivery_marks_sent(app_ctx):
+    email_id = queue()
+    conn = FakeConnection()
+    with mock.patch.object(mail, 'connect', return_value=conn):
+        assert deliver_outbox() == (1, 0)
+    email = db.session.get(OutboxEmail, email_id)
+    assert email.status == 'sent' and email.sent_at is not None
+    assert [m.recipients for m in conn.sent] == [['cust@example.com']]
+
+
+def test_refused_recipient_is_retried_later(app_ctx):
+    bad, good = queue('bad@example.com'), queue()
+    with mock.patch.object(mail, 'connect', return_value=FakeConnection(refuse={'bad@example.com'})):
+        assert deliver_outbox() == (1, 1)
+    email = db.session.get(OutboxEmail, bad)
+    assert (email.status, email.attempts) == ('pending', 1)
+    assert email.next_attempt_at > datetime.utcnow()
+    assert db.session.get(OutboxEmail, good).status == 'sent'
+    # Backed off: not due again yet
+    assert claim_outbox_batch() == []
+
+
+def test_connection_failure_releases_the_batch(app_ctx):
+    email_id = queue()
+    with mock.patch.object(mail, 'connect', side_effect=ConnectionRefusedError('down')):
+        assert deliver_outbox() == (0, 1)
+    email = db.session.get(OutboxEmail, email_id)
+    assert (email.status, email.attempts, email.last_error) == ('pending', 1, 'down')
+
+
+def test_gives_up_after_max_attempts(app_ctx):
+    email_id = queue()
+    email = db.session.get(OutboxEmail, email_id)
+    email.attempts = OUTBOX_MAX_ATTEMPTS - 1
+    db.session.commit()
+    with mock.patch.object(mail, 'connect', side_effect=ConnectionRefusedError('down')):
+        deliver_outbox()
+    assert db.session.get(OutboxEmail, email_id).status == 'failed'
@@ -0,0 +1,113 @@
+from sqlalchemy import event
+
+from app import app, db, Card, PosLine, PosTicket, get_pos_ticket, pos_add_line
+from conftest import add_card, login, make_user
+
+
+def act(client, action, **data):
+    return client.post('/api/pos/action', json={'action': action, 'data': data})
+
+
+def resum(ticket_id):
+    lines = PosLine.query.filter_by(ticket_id=ticket_id).all()
+    side = lambda d: round(sum(l.price * l.quantity for l in lines if l.direction == d), 2)
+    return {'out': side('out'), 'in': side('in'), 'items': sum(l.quantity for l in lines)}
+
+
+def test_lines_reply_with_only_the_change(client, user):
+    card = add_card(user, 'Charizard', quantity=2, price=300.0)
+    login(client, user)
+
+    first = act(client, 'add_out', id=str(card.id)).get_json()
+    again = act(client, 'add_out', id=str(card.id)).get_json()
+    assert 'lines' not in again
+    assert again['line']['id'] == first['line']['id']
+    assert again['line']['quantity'] == 2
+    assert again['totals'] == {'out': 600.0, 'in': 0.0, 'net': 600.0, 'items': 2, 'version': 2}
+
+    trade = act(client, 'add_in', id='base1-4', name='Charizard', price='100', multiplier='0.7').get_json()
+    assert (trade['line']['price'], trade['totals']['net']) == (70.0, 530.0)
+    manual = act(client, 'add_out', id='ghost', name='Sleeves', price='4.5').get_json()
+    assert manual['line']['card_id'] is None
+
+    removed = act(client, 'remove', line_id=first['line']['id']).get_json()
+    assert removed['removed'] == first['line']['id']
+    assert removed['totals'] == {'out': 4.5, 'in': 70.0, 'net': -65.5, 'items': 2, 'version': 5}
+    assert resum(removed['ticket']) == {'out': 4.5, 'in': 70.0, 'items': 2}
+    assert act(client, 'remove', line_id=first['line']['id']).status_code == 404
+
+
+def test_cannot_ring_up_more_than_in_stock(client, user):
+    card = add_card(user, 'Mew', quantity=1, price=50.0)
+    login(client, user)
+    assert act(client, 'add_out', id=str(card.id)).status_code == 200
+    response = act(client, 'add_out', id=str(card.id))
+    assert response.status_code == 409
+    assert response.get_json()['error'] == 'Only 1 in stock.'
+    assert act(client, 'add_out', id='ghost', price='1').get_json()['totals']['items'] == 2
+
+
+def test_ticket_survives_a_reload(client, user):
+    login(client, user)
+    ticket_id = act(client, 'add_out', name='Booster', price='4').get_json()['ticket']
+
+    # A fresh browser tab with the same session cookie picks the ticket back up
+    reloaded = app.test_client()
+    reloaded.set_cookie('session', client.get_cookie('session').value)
+    data = reloaded.get('/api/pos/ticket').get_json()
+    assert data['id'] == ticket_id
+    assert [line['name'] for line in data['lines']] == ['Booster']
+    assert reloaded.get('/pos').status_code == 200
+
+
+def test_parked_tickets_can_be_resumed(client, user):
+    login(client, user)
+    parked = act(client, 'add_out', name='Booster', price='4').get_json()['ticket']
+    fresh = act(client, 'new').get_json()
+    assert fresh['id'] != parked and fresh['lines'] == []
+    assert f"switchTicket('resume', {parked})" in client.get('/pos').get_data(as_text=True)
+
+    resumed = act(client, 'resume', ticket_id=parked).get_json()
+    assert (resumed['id'], resumed['totals']['items']) == (parked, 1)
+    misty = make_user('misty')
+    assert get_pos_ticket(misty.id, parked) is None
+    assert act(client, 'resume', ticket_id=10 ** 6).status_code == 404
+
+
+def test_line_cost_does_not_grow_with_the_ticket(user):
+    ticket = PosTicket(user_id=user.id)
+    db.session.add(ticket)
+    db.session.commit()
+
+    def statements_for_one_add():
+        statements = []
+        listener = lambda conn, cursor, sql, *rest: statements.append(sql)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            pos_add_line(ticket, 'in', 'Bulk', 0.05)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        return len(statements)
+
+    small = statements_for_one_add()
+    for _ in range(200):
+        pos_add_line(ticket, 'in', 'Bulk', 0.05)
+    assert statements_for_one_add() == small
+    db.session.refresh(ticket)
+    assert (ticket.totals()['items'], ticket.totals()['in']) == (202, resum(ticket.id)['in'])
+
+
+def test_checkout_closes_the_ticket_and_checks_the_version(client, user):
+    card = add_card(user, 'Mew', quantity=3, price=50.0)
+    login(client, user)
+    added = act(client, 'add_out', id=str(card.id)).get_json()
+
+    stale = client.post('/api/pos/checkout', json={'version': added['totals']['version'] - 1})
+    assert stale.status_code == 409
+    done = client.post('/api/pos/checkout', json={'version': added['totals']['version']}).get_json()
+    assert (done['status'], done['sold'], done['net']) == ('success', 1, 50.0)
+    assert db.session.get(PosTicket, added['ticket']).status == 'completed'
+    assert db.session.get(Card, card.id).quantity == 2
+    # The terminal moves on to a new, empty ticket
+    assert client.get('/api/pos/ticket').get_json()['id'] != added['ticket']
+    assert client.post('/api/pos/checkout', json={}).status_code == 400
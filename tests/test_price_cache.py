@@ -0,0 +1,64 @@
+import json
+from datetime import datetime, timedelta
+
+from app import (db, CardReference, CatalogChange, PRICE_CACHE_TTL, load_price_cache, reference_row,
+                 upsert_references)
+from conftest import add_card, login
+
+
+def api_card(ref_id, market=1.0, image=True, name='Pikachu'):
+    return {
+        'id': ref_id, 'name': name, 'number': ref_id.split('-')[-1],
+        'set': {'id': 'base1', 'name': 'Base', 'releaseDate': '1999/01/09'},
+        'images': {'small': f'https://images.pokemontcg.io/base1/{ref_id}.png'} if image else {},
+        'tcgplayer': {'url': 'https://prices.pokemontcg.io/tcgplayer/' + ref_id,
+                      'prices': {'normal': {'market': market, 'low': market / 2}}},
+    }
+
+
+def changes():
+    return db.session.query(CatalogChange).count()
+
+
+def test_reupserting_unchanged_cards_logs_no_catalog_change(app_ctx):
+    rows = [reference_row(api_card(f'base1-{i}')) for i in range(50)]
+    upsert_references(rows)
+    db.session.commit()
+    assert changes() == 50
+    upsert_references([reference_row(api_card(f'base1-{i}', market=2.0)) for i in range(50)])
+    db.session.commit()
+    assert changes() == 50
+    assert json.loads(db.session.get(CardReference, 'base1-7').prices) == {'normal': {'market': 2.0, 'low': 1.0}}
+
+
+def test_upsert_fills_blanks_but_keeps_existing_values(app_ctx):
+    upsert_references([reference_row(api_card('base1-1', image=False)), reference_row(api_card('base1-2'))])
+    db.session.commit()
+    db.session.execute(db.update(CardReference).where(CardReference.id == 'base1-2').values(
+        image_url='https://images.pokemontcg.io/base1/2_hires.png'))
+    db.session.commit()
+    before = changes()
+
+    upsert_references([reference_row(api_card('base1-1')), reference_row(api_card('base1-2'))])
+    db.session.commit()
+    db.session.expire_all()
+    assert db.session.get(CardReference, 'base1-1').image_url == 'https://images.pokemontcg.io/base1/base1-1.png'
+    assert db.session.get(CardReference, 'base1-2').image_url == 'https://images.pokemontcg.io/base1/2_hires.png'
+    assert changes() == before + 1   # only the filled reference
+
+
+def test_price_cache_honours_the_ttl(app_ctx):
+    upsert_references([reference_row(api_card('base1-1')), reference_row(api_card('base1-2'))])
+    db.session.execute(db.update(CardReference).where(CardReference.id == 'base1-2').values(
+        prices_updated_at=datetime.utcnow() - PRICE_CACHE_TTL - timedelta(minutes=1)))
+    db.session.commit()
+    assert set(load_price_cache(['base1-1', 'base1-2'])) == {'base1-1'}
+    assert set(load_price_cache(['base1-1', 'base1-2'], fresh_only=False)) == {'base1-1', 'base1-2'}
+
+
+def test_repricing_a_linked_card_reads_the_fresh_cache(client, user):
+    upsert_references([reference_row(api_card('base1-58', market=4.25))])
+    db.session.commit()
+    card = add_card(user, reference_id='base1-58', price=1.0)
+    response = login(client, user).post(f'/admin/update_price/{card.id}')
+    assert response.get_json() == {'success': True, 'new_price': 4.25, 'message': 'Updated to $4.25 (cached)'}
@@ -0,0 +1,78 @@
+from datetime import date
+
+from app import db, PriceHistory, price_history_series, record_price_history
+from conftest import add_card, add_references, login
+
+DAY = date(2024, 3, 1).toordinal()
+
+
+def prices(market):
+    return {'normal': {'market': market, 'low': market / 2}}
+
+
+def history(ref_id='base1-58', finish='normal'):
+    return [(r.day, r.cents) for r in db.session.query(PriceHistory).filter_by(
+        reference_id=ref_id, finish=finish).order_by(PriceHistory.day)]
+
+
+def test_only_price_moves_are_sampled(app_ctx):
+    assert record_price_history({'base1-58': prices(1.25)}, day=DAY) == 1
+    assert record_price_history({'base1-58': prices(1.25)}, day=DAY + 1) == 0
+    assert record_price_history({'base1-58': prices(1.5)}, day=DAY + 2) == 1
+    record_price_history({'base1-58': {'normal': {'market': 0}}}, day=DAY + 3)
+    db.session.commit()
+    assert history() == [(DAY, 125), (DAY + 2, 150)]
+
+
+def test_second_change_on_the_same_day_overwrites_it(app_ctx):
+    record_price_history({'base1-58': prices(1.25)}, day=DAY)
+    record_price_history({'base1-58': prices(1.5)}, day=DAY + 1)
+    record_price_history({'base1-58': prices(1.75)}, day=DAY + 1)
+    db.session.commit()
+    assert history() == [(DAY, 125), (DAY + 1, 175)]
+
+
+def test_change_back_on_the_same_day_drops_the_sample(app_ctx):
+    record_price_history({'base1-58': prices(1.25)}, day=DAY)
+    record_price_history({'base1-58': prices(1.5)}, day=DAY + 1)
+    record_price_history({'base1-58': prices(1.25)}, day=DAY + 1)
+    db.session.commit()
+    assert history() == [(DAY, 125)]
+
+    # A first sample on the same day is kept when it is repeated
+    record_price_history({'base1-4': prices(9.0)}, day=DAY + 1)
+    record_price_history({'base1-4': prices(9.0)}, day=DAY + 1)
+    db.session.commit()
+    assert history('base1-4') == [(DAY + 1, 900)]
+
+
+def test_series_carries_the_last_sample_into_the_window(app_ctx):
+    record_price_history({'base1-58': prices(1.0)}, day=DAY - 10)
+    record_price_history({'base1-58': prices(2.0)}, day=DAY + 5)
+    db.session.commit()
+    days, series = price_history_series({('base1-58', 'normal'), ('base1-4', 'normal')}, DAY, DAY + 10, points=3)
+    assert days == [DAY, DAY + 5, DAY + 10]
+    assert series[('base1-58', 'normal')] == [100, 200, 200]
+    assert series[('base1-4', 'normal')] == [None, None, None]
+
+
+def test_price_history_endpoint_values_the_portfolio(client, user):
+    add_references(('base1-58', 'Pikachu'), ('base1-4', 'Charizard', 'Base', '4'))
+    pikachu = add_card(user, reference_id='base1-58', quantity=2)
+    charizard = add_card(user, 'Charizard', reference_id='base1-4', finish='Holofoil')
+    unlinked = add_card(user, 'Mew')
+    record_price_history({'base1-58': prices(1.0)}, day=DAY)
+    record_price_history({'base1-4': {'holofoil': {'market': 300.0}}}, day=DAY + 2)
+    db.session.commit()
+
+    login(client, user)
+    response = client.get('/api/price_history?start=2024-03-01&end=2024-03-03&points=3&total=1')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['dates'] == ['2024-03-01', '2024-03-02', '2024-03-03']
+    assert data['series'] == {str(pikachu.id): [1.0, 1.0, 1.0], str(charizard.id): [None, None, 300.0]}
+    assert data['missing'] == [unlinked.id]
+    assert data['total'] == [2.0, 2.0, 302.0]
+
+    assert client.get('/api/price_history?start=2024-03-03&end=2024-03-01').status_code == 400
+    assert client.get('/api/price_history?start=March').status_code == 400
@@ -0,0 +1,83 @@
+import pytest
+from sqlalchemy import text
+
+import app as inventory_app
+from app import db, CardReference, init_reference_fts, search_reference_index
+from conftest import add_references, login
+
+FTS_SYNTAX = ['"', 'pika"', 'NEAR(pika', 'pika*', '*', 'name:pika', 'set_name:base', 'pika OR', 'AND', '-pika',
+              '^pika', '(', 'pika) OR (mew']
+
+
+@pytest.fixture
+def searcher(client, user):
+    add_references(('base1-58', 'Pikachu', 'Base', '58', '1999/01/09'),
+                   ('jungle-60', 'Pikachu', 'Jungle', '60', '1999/06/16'),
+                   ('swsh-43', 'Pikachu V', 'Vivid Voltage', '43', '2020/11/13'),
+                   ('wc-1', 'Raichu', 'Pikachu World Collection', '1', '2010/01/01'),
+                   ('base1-4', 'Charizard', 'Base', '4', '1999/01/09'))
+    return login(client, user)
+
+
+def names(results, key='name'):
+    return [(r[key], r['set']) for r in results]
+
+
+def test_fts_index_is_in_use(app_ctx):
+    assert inventory_app.FTS_ENABLED
+
+
+def test_reference_search_ranks_name_hits_above_set_hits(searcher):
+    results = searcher.get('/api/search_reference?q=pika').get_json()
+    assert names(results)[-1] == ('Raichu', 'Pikachu World Collection')
+    assert {r['id'] for r in results[:3]} == {'base1-58', 'jungle-60', 'swsh-43'}
+
+
+def test_reference_search_needs_every_word_as_a_prefix(searcher):
+    assert names(searcher.get('/api/search_reference?q=pika jung').get_json()) == [('Pikachu', 'Jungle')]
+    assert [r['id'] for r in searcher.get('/api/search_reference?q=char').get_json()] == ['base1-4']
+    assert searcher.get('/api/search_reference?q=izard').get_json() == []
+
+
+def test_pos_search_ranks_exact_names_first(searcher):
+    dictionary = searcher.get('/api/pos_search?q=pikachu').get_json()['dictionary']
+    # Exact name (newest printing first), then name prefix, then the set-name hit
+    assert [r['id'] for r in dictionary] == ['jungle-60', 'base1-58', 'swsh-43', 'wc-1']
+
+
+def test_triggers_track_inserts_updates_and_deletes(searcher):
+    db.session.add(CardReference(id='neo1-1', name='Pichu', set_name='Neo Genesis', number='1'))
+    db.session.commit()
+    assert [r.id for r in search_reference_index('pichu')] == ['neo1-1']
+
+    db.session.get(CardReference, 'neo1-1').name = 'Cleffa'
+    db.session.commit()
+    assert search_reference_index('pichu') == []
+    assert [r.id for r in search_reference_index('cleffa')] == ['neo1-1']
+
+    db.session.delete(db.session.get(CardReference, 'neo1-1'))
+    db.session.commit()
+    assert search_reference_index('cleffa') == []
+
+
+@pytest.mark.parametrize('query', FTS_SYNTAX)
+def test_fts_syntax_is_treated_as_plain_text(searcher, query):
+    response = searcher.get('/api/search_reference', query_string={'q': query})
+    assert response.status_code == 200 and isinstance(response.get_json(), list)
+    response = searcher.get('/api/pos_search', query_string={'q': query})
+    assert response.status_code == 200 and 'dictionary' in response.get_json()
+
+
+def test_quoted_input_still_finds_cards(searcher):
+    assert {r['id'] for r in searcher.get('/api/search_reference', query_string={'q': 'pika" jung*'}).get_json()} \
+        == {'jungle-60'}
+
+
+def test_startup_rebuilds_an_index_whose_rowids_drifted(searcher):
+    # What a VACUUM may do to the implicit rowids the index is keyed on (no trigger fires)
+    db.session.execute(text("UPDATE card_reference SET rowid = rowid + 1000"))
+    db.session.commit()
+    assert not inventory_app.reference_fts_consistent()
+    assert init_reference_fts()
+    assert inventory_app.reference_fts_consistent()
+    assert [r.id for r in search_reference_index('char')] == ['base1-4']
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, inspect
+
+from app import app, db, SessionRecord, sweep_expired_sessions
+from conftest import add_card
+
+
+def session_writes(sql_log):
+    return [s for s in sql_log if s.lstrip().startswith(('INSERT INTO sessions', 'UPDATE sessions',
+                                                          'DELETE FROM sessions'))]
+
+
+def logged(fn):
+    statements = []
+    listener = lambda conn, cursor, sql, *rest: statements.append(sql)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        fn()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    return statements
+
+
+def test_carts_live_in_the_database_for_every_worker(client, user):
+    pikachu, mew = add_card(user, 'Pikachu'), add_card(user, 'Mew')
+    assert client.get(f'/cart/add/{pikachu.id}?ajax=1').get_json()['count'] == 1
+    assert db.session.query(SessionRecord).count() == 1
+
+    # Another worker (or container) only has the cookie
+    other = app.test_client()
+    other.set_cookie('session', client.get_cookie('session').value)
+    assert other.get(f'/cart/add/{mew.id}?ajax=1').get_json()['count'] == 2
+
+
+def test_sessions_are_only_written_when_they_change(client, user):
+    card = add_card(user, 'Pikachu')
+    responses = []
+    assert session_writes(logged(lambda: responses.append(client.get('/u/ash')))) == []
+    assert responses[0].status_code == 200
+    assert db.session.query(SessionRecord).count() == 0   # browsing creates no session
+
+    client.get(f'/cart/add/{card.id}?ajax=1')
+    assert session_writes(logged(lambda: client.get('/cart'))) == []
+    assert session_writes(logged(lambda: client.get(f'/cart/add/{card.id}?ajax=1'))) == []   # already in it
+    assert len(session_writes(logged(lambda: client.get(f'/cart/remove/{card.id}')))) == 1
+
+
+def test_sweeper_deletes_expired_sessions_in_batches(app_ctx):
+    now = datetime.utcnow()
+    db.session.add_all([SessionRecord(session_id=f'session:old{i}', data=b'', expiry=now - timedelta(minutes=i + 1))
+                        for i in range(5)])
+    db.session.add(SessionRecord(session_id='session:live', data=b'', expiry=now + timedelta(days=1)))
+    db.session.commit()
+
+    statements = logged(lambda: sweep_expired_sessions(batch_size=2))
+    assert len([s for s in statements if s.lstrip().startswith('DELETE FROM sessions')]) == 3
+    assert [r.session_id for r in db.session.query(SessionRecord)] == ['session:live']
+    assert sweep_expired_sessions() == 0
+
+
+def test_expiry_is_indexed_for_the_sweeper(app_ctx):
+    indexes = {ix['name']: ix['column_names'] for ix in inspect(db.engine).get_indexes('sessions')}
+    assert indexes['ix_sessions_expiry'] == ['expiry']
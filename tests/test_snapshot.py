@@ -0,0 +1,95 @@
+import gzip
+import json
+from datetime import datetime
+
+import pytest
+from sqlalchemy import inspect
+
+import snapshot
+from app import db, CardReference, CardReferenceFinish, CardSpecies, CatalogChange, CATALOG_RELOAD_MARKER, \
+    MasterTracker, read_completion, search_reference_index
+from conftest import add_card, add_references
+
+
+@pytest.fixture
+def catalog(app_ctx):
+    add_references(('base1-58', 'Pikachu', 'Base', '58'), ('jungle-60', 'Pikachu', 'Jungle', '60', '1999/06/16', 'Normal'))
+    db.session.execute(db.update(CardReference).where(CardReference.id == 'base1-58').values(
+        prices='{"normal":{"market":1.25}}', prices_updated_at=datetime(2024, 3, 1, 12, 30), is_favorite=True))
+    db.session.commit()
+
+
+def dump():
+    return sorted(tuple(getattr(r, name) for name in snapshot.SNAPSHOT_COLUMNS) for r in CardReference.query)
+
+
+def write_snapshot(path, header, rows):
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        f.write(json.dumps(header) + "\n")
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+
+def test_export_then_import_round_trips_the_dictionary(catalog, tmp_path):
+    path = str(tmp_path / 'catalog.jsonl.gz')
+    before = dump()
+    assert snapshot.export_snapshot(path) == 2
+
+    assert snapshot.import_snapshot(path, replace=True) == 2
+    db.session.expire_all()
+    assert dump() == before
+    assert sorted((f.reference_id, f.finish_code) for f in CardReferenceFinish.query) == \
+        [('base1-58', 1), ('base1-58', 2), ('jungle-60', 1)]
+    assert {s.species for s in CardSpecies.query} == {'pikachu'}
+    assert db.session.get(CardReference, 'jungle-60').name_key == 'pikachu'
+    assert [r.id for r in search_reference_index('pika jung')] == ['jungle-60']
+    assert CatalogChange.query.order_by(CatalogChange.id.desc()).first().ref_id == CATALOG_RELOAD_MARKER
+
+
+def test_import_restores_indexes_and_triggers(catalog, tmp_path):
+    path = str(tmp_path / 'catalog.jsonl.gz')
+    snapshot.export_snapshot(path)
+    indexes = {ix['name'] for ix in inspect(db.engine).get_indexes('card_reference')}
+    snapshot.import_snapshot(path, replace=True)
+    assert {ix['name'] for ix in inspect(db.engine).get_indexes('card_reference')} == indexes
+
+    db.session.add(CardReference(id='base1-4', name='Charizard', set_name='Base', number='4'))
+    db.session.commit()
+    assert CatalogChange.query.order_by(CatalogChange.id.desc()).first().ref_id == 'base1-4'
+    assert [r.id for r in search_reference_index('chariz')] == ['base1-4']
+
+
+def test_old_snapshots_without_prices_import_as_unpriced(app_ctx, tmp_path):
+    path = str(tmp_path / 'old.jsonl.gz')
+    columns = ['id', 'name', 'set_name', 'set_id', 'number', 'image_url', 'tcgplayer_id', 'release_date',
+               'available_finishes', 'is_favorite']
+    write_snapshot(path, {'format': snapshot.SNAPSHOT_FORMAT, 'version': 1, 'count': 1, 'columns': columns},
+                   [['base1-4', 'Charizard', 'Base', 'base1', '4', None, '42', '1999/01/09', 'Holofoil', False]])
+    assert snapshot.import_snapshot(path) == 1
+    ref = db.session.get(CardReference, 'base1-4')
+    assert (ref.available_finishes, ref.prices, ref.prices_updated_at, ref.number_key) == ('Holofoil', None, None, '4')
+
+
+def test_import_refuses_foreign_newer_or_unwanted_loads(catalog, tmp_path):
+    path = str(tmp_path / 'catalog.jsonl.gz')
+    snapshot.export_snapshot(path)
+    with pytest.raises(ValueError, match='not empty'):
+        snapshot.import_snapshot(path)
+
+    write_snapshot(path, {'format': 'something-else', 'columns': []}, [])
+    with pytest.raises(ValueError, match='not a catalog snapshot'):
+        snapshot.import_snapshot(path, replace=True)
+    write_snapshot(path, {'format': snapshot.SNAPSHOT_FORMAT, 'version': snapshot.SNAPSHOT_VERSION + 1,
+                          'columns': []}, [])
+    with pytest.raises(ValueError, match='newer'):
+        snapshot.import_snapshot(path, replace=True)
+
+
+def test_import_rebuilds_counters_for_linked_cards(catalog, user, tmp_path):
+    path = str(tmp_path / 'catalog.jsonl.gz')
+    snapshot.export_snapshot(path)
+    db.session.add(MasterTracker(species_name='Pikachu'))
+    add_card(user, 'Pikachu', reference_id='jungle-60')
+    snapshot.import_snapshot(path, replace=True)
+    assert read_completion(user.id, 'species', ['Pikachu'])[0] == \
+        {'name': 'Pikachu', 'total': 3, 'owned': 1, 'percent': 33}
@@ -0,0 +1,38 @@
+import pytest
+
+from app import extract_species
+
+
+@pytest.mark.parametrize('card_name, expected', [
+    ('Pikachu', ['pikachu']),
+    ('Dark Charizard', ['charizard']),
+    ('Charizard VMAX', ['charizard']),
+    ('Charizard-GX', ['charizard']),
+    ('M Gengar EX', ['gengar']),
+    ('Alolan Meowth', ['meowth']),
+    ("Team Rocket's Meowth", ['meowth']),
+    ("Brock's Onix", ['onix']),
+    ('Mewtwo (Delta Species)', ['mewtwo']),
+    ('Unown [A]', ['unown']),
+    ('Pikachu - 58/102', ['pikachu']),
+])
+def test_strips_owners_forms_and_suffixes(card_name, expected):
+    assert extract_species(card_name) == expected
+
+
+def test_tag_teams_split_into_each_species():
+    assert extract_species('Pikachu & Zekrom GX') == ['pikachu', 'zekrom']
+
+
+@pytest.mark.parametrize('card_name', ['Mr. Mime', 'Ho-Oh', "Farfetch'd"])
+def test_punctuated_names_survive(card_name):
+    assert extract_species(card_name) == [card_name.lower()]
+
+
+def test_mew_is_not_mewtwo():
+    assert extract_species('Mew ex') == ['mew']
+
+
+@pytest.mark.parametrize('card_name', ['', None])
+def test_empty_names(card_name):
+    assert extract_species(card_name) == []
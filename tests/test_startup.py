@@ -0,0 +1,79 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The schema (and a little data) as it was before the match keys and species / finish indexes existed
+PRE_SERIES_SCHEMA = """
+CREATE TABLE user (id INTEGER NOT NULL, username VARCHAR(150) NOT NULL, password_hash VARCHAR(200) NOT NULL,
+    is_admin BOOLEAN, PRIMARY KEY (id), UNIQUE (username));
+CREATE TABLE card_reference (release_date VARCHAR(25), id VARCHAR(50) NOT NULL, name VARCHAR(150) NOT NULL,
+    set_name VARCHAR(100) NOT NULL, set_id VARCHAR(50), number VARCHAR(20), image_url VARCHAR(500),
+    tcgplayer_id VARCHAR(50), is_favorite BOOLEAN, available_finishes VARCHAR(255), PRIMARY KEY (id));
+CREATE TABLE master_tracker (id INTEGER NOT NULL, species_name VARCHAR(50) NOT NULL, PRIMARY KEY (id),
+    UNIQUE (species_name));
+CREATE TABLE settings (id INTEGER NOT NULL, user_id INTEGER NOT NULL, show_prices BOOLEAN, PRIMARY KEY (id),
+    FOREIGN KEY(user_id) REFERENCES user (id));
+CREATE TABLE card (status VARCHAR(20) NOT NULL, id INTEGER NOT NULL, user_id INTEGER NOT NULL,
+    reference_id VARCHAR(50), game VARCHAR(50) NOT NULL, set_name VARCHAR(100) NOT NULL,
+    card_name VARCHAR(150) NOT NULL, card_number VARCHAR(50), condition VARCHAR(20), price FLOAT, quantity INTEGER,
+    finish VARCHAR(50), image_url VARCHAR(500), variant VARCHAR(100), location VARCHAR(100),
+    grading_company VARCHAR(50), grade VARCHAR(20), cert_number VARCHAR(100), is_first_edition BOOLEAN,
+    last_updated DATETIME, PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES user (id));
+CREATE TABLE sale (id INTEGER NOT NULL, user_id INTEGER NOT NULL, card_name VARCHAR(150) NOT NULL,
+    set_name VARCHAR(100), sale_price FLOAT, quantity INTEGER, sale_date DATETIME, PRIMARY KEY (id),
+    FOREIGN KEY(user_id) REFERENCES user (id));
+
+INSERT INTO user (id, username, password_hash, is_admin) VALUES (1, 'ash', 'x', 0), (2, 'misty', 'x', 0);
+INSERT INTO card_reference (id, name, set_name, set_id, number, available_finishes) VALUES
+    ('base1-0', 'Pikachu', 'Base', 'base1', '0', 'Normal, Holofoil'),
+    ('base1-1', 'Mewtwo', 'Base', 'base1', '1', 'Normal, Holofoil'),
+    ('base1-2', 'Mew ex', 'Base', 'base1', '2', 'Normal, Holofoil'),
+    ('base1-3', 'Dark Charizard', 'Base', 'base1', '3', 'Normal, Holofoil');
+INSERT INTO master_tracker (id, species_name) VALUES (1, 'Mew');
+INSERT INTO card (status, id, user_id, reference_id, game, set_name, card_name, card_number, quantity, price, finish)
+    VALUES ('available', 1, 1, 'base1-1', 'Pokemon', 'Base', 'Mewtwo', '1', 2, 3.0, 'Normal');
+"""
+
+# Runs in a fresh interpreter: importing app is what upgrades the database
+REPORT = """
+import json
+from app import app, db, Card, CardSpecies, CardReferenceFinish, TradeSlot
+with app.app_context():
+    print(json.dumps({
+        'species': sorted(tuple(r) for r in db.session.query(CardSpecies.reference_id, CardSpecies.species)),
+        'finishes': db.session.query(CardReferenceFinish.reference_id).count(),
+        'card': db.session.query(Card.name_key, Card.finish_code).one()._asdict(),
+        'slots': sorted(tuple(r) for r in db.session.query(TradeSlot.user_id, TradeSlot.side, TradeSlot.reference_id)),
+    }))
+"""
+
+
+def start_app(db_path):
+    env = dict(os.environ, SQLALCHEMY_DATABASE_URI='sqlite:///' + db_path, ADMIN_EMAIL='admin@example.com')
+    result = subprocess.run([sys.executable, '-c', REPORT], cwd=REPO_ROOT, env=env, capture_output=True, text=True,
+                            timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert 'Schema upgrade skipped' not in result.stdout, result.stdout
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_startup_backfills_a_pre_series_database(tmp_path):
+    db_path = str(tmp_path / 'inventory.db')
+    with sqlite3.connect(db_path) as conn:
+        conn.executescript(PRE_SERIES_SCHEMA)
+
+    report = start_app(db_path)
+    assert report['species'] == [['base1-0', 'pikachu'], ['base1-1', 'mewtwo'], ['base1-2', 'mew'],
+                                 ['base1-3', 'charizard']]
+    assert report['finishes'] == 8
+    assert report['card']['name_key'] == 'mewtwo' and report['card']['finish_code']
+    # ash stocks Mewtwo but collects no Mew (the tracked species), so nobody wants anything yet;
+    # the user-0 row marks the index as built
+    assert report['slots'] == [[0, 'done', '*'], [1, 'have', 'base1-1']]
+
+    # A second start finds everything in place and changes nothing
+    assert start_app(db_path) == report
@@ -0,0 +1,86 @@
+import re
+
+import pytest
+
+from app import db, Card, STOREFRONT_PAGE_SIZE, STOREFRONT_SORTS, storefront_filters, storefront_page
+from conftest import add_card
+
+
+def card_ids(html):
+    return [int(i) for i in re.findall(r'data-id="(\d+)"', html)]
+
+
+@pytest.fixture
+def shop(user):
+    cards = [
+        add_card(user, 'Pikachu', price=5.0, set_name='Base', finish='Holofoil', condition='NM'),
+        add_card(user, 'Charizard', price=300.0, set_name='Base', finish='Holofoil', condition='LP',
+                 grading_company='PSA', grade='9'),
+        add_card(user, 'Bulbasaur', price=5.0, set_name='Base', condition='NM'),
+        add_card(user, 'Mew', price=5.0, set_name='Fossil', finish='Reverse Holofoil', condition='NM'),
+        add_card(user, 'Pikachu V', price=2.5, set_name='Vivid Voltage', condition='MP'),
+        add_card(user, 'Eevee', price=1.0, set_name='Jungle', condition='NM'),
+        add_card(user, 'Snorlax', price=9.0, set_name='Jungle', condition='NM', quantity=0),   # sold out
+    ]
+    return user, cards
+
+
+def walk(user_id, filters, limit=2):
+    seen, cursor = [], None
+    while True:
+        cards, cursor = storefront_page(user_id, filters, cursor, limit=limit)
+        seen += [c.id for c in cards]
+        if cursor is None:
+            return seen
+
+
+@pytest.mark.parametrize('sort', sorted(STOREFRONT_SORTS))
+def test_keyset_pages_visit_every_in_stock_card_once(shop, sort):
+    user, cards = shop
+    column, descending = STOREFRONT_SORTS[sort]
+    in_stock = [c for c in cards if c.quantity > 0]
+    expected = sorted(in_stock, key=lambda c: (getattr(c, column.key), c.id), reverse=descending)
+    assert walk(user.id, storefront_filters({'sort': sort})) == [c.id for c in expected]
+
+
+@pytest.mark.parametrize('args, names', [
+    ({'q': 'pika'}, {'Pikachu', 'Pikachu V'}),
+    ({'set': 'Jungle'}, {'Eevee'}),
+    ({'finish': 'holo'}, {'Pikachu', 'Charizard'}),
+    ({'graded': '1'}, {'Charizard'}),
+    ({'graded': '0', 'set': 'Base'}, {'Pikachu', 'Bulbasaur'}),
+    ({'condition': 'MP'}, {'Pikachu V'}),
+])
+def test_filters_run_in_sql(shop, args, names):
+    user, cards = shop
+    by_id = {c.id: c.card_name for c in cards}
+    assert {by_id[i] for i in walk(user.id, storefront_filters(args))} == names
+
+
+def test_bad_sort_and_mangled_cursor_fall_back_to_the_first_page(shop):
+    user, _ = shop
+    filters = storefront_filters({'sort': 'DROP TABLE'})
+    assert filters['sort'] == 'price-desc'
+    first, _ = storefront_page(user.id, filters, limit=2)
+    for cursor in ('!!!', 'W10=', 'WyJhIiwiYiJd'):
+        assert storefront_page(user.id, filters, cursor, limit=2)[0] == first
+
+
+def test_storefront_sends_one_page_then_scrolls(client, user):
+    for i in range(STOREFRONT_PAGE_SIZE + 2):
+        db.session.add(Card(user_id=user.id, game='Pokemon', card_name=f'Card {i:03}', set_name='Base',
+                            price=float(i), quantity=1, finish='Normal'))
+    db.session.commit()
+
+    html = client.get('/u/ash').get_data(as_text=True)
+    first = set(card_ids(html))
+    assert len(first) == STOREFRONT_PAGE_SIZE
+    next_cursor = re.search(r'id="loadMore"[^>]*data-next="([^"]+)"', html).group(1)
+
+    data = client.get('/u/ash/cards', query_string={'after': next_cursor}).get_json()
+    rest = card_ids(data['grid'])
+    assert len(rest) == 2 and not first & set(rest)
+    assert data['next'] is None and 'total' not in data
+
+    filtered = client.get('/u/ash/cards', query_string={'q': 'Card 04'}).get_json()
+    assert filtered['total'] == 10 and len(card_ids(filtered['grid'])) == 10
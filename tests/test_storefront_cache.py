@@ -0,0 +1,96 @@
+import pytest
+from sqlalchemy import event
+
+import app as inventory_app
+from app import db, Card, Settings, User, link_references_bulk
+from conftest import add_card, add_references, login
+
+
+@pytest.fixture
+def shop(user):
+    add_card(user, 'Pikachu', price=5.0)
+    return user
+
+
+def version(user):
+    db.session.expire_all()
+    return db.session.get(User, user.id).inventory_version
+
+
+def test_storefront_revalidates_with_a_strong_etag(client, shop):
+    first = client.get('/u/ash')
+    assert first.status_code == 200
+    etag, weak = first.get_etag()
+    assert etag and not weak
+    assert first.last_modified is not None
+    assert first.headers['Cache-Control'] == 'public, no-cache'
+
+    again = client.get('/u/ash', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304 and again.data == b''
+    since = client.get('/u/ash', headers={'If-Modified-Since': first.headers['Last-Modified']})
+    assert since.status_code == 304
+
+
+def test_repeat_views_are_rendered_once_and_write_nothing(client, shop, monkeypatch):
+    renders = []
+    real_render = inventory_app.render_template
+    monkeypatch.setattr(inventory_app, 'render_template', lambda *a, **kw: renders.append(a[0]) or real_render(*a, **kw))
+    writes = []
+    listener = lambda conn, cursor, sql, *rest: writes.append(sql) if not sql.lstrip().startswith('SELECT') else None
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        bodies = {client.get('/u/ash').data for _ in range(3)}
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert renders == ['index.html'] and len(bodies) == 1
+    assert writes == []
+    assert Settings.query.count() == 0   # defaults are read, not created
+
+
+def test_every_inventory_write_moves_the_version(client, shop):
+    seen = [client.get('/u/ash').headers['ETag']]
+
+    def changed():
+        etag = client.get('/u/ash').headers['ETag']
+        assert etag not in seen
+        seen.append(etag)
+
+    card = add_card(shop, 'Mew', price=50.0)
+    changed()
+    card.quantity = 3
+    db.session.commit()
+    changed()
+    db.session.delete(card)
+    db.session.commit()
+    changed()
+
+    login(client, shop)
+    client.post('/update_settings', data={'show_prices': 'on'})
+    client.get('/logout')
+    changed()
+
+    add_references(('base1-58', 'Pikachu', 'Base', '58'))
+    before = version(shop)
+    link_references_bulk(Card.query.filter_by(user_id=shop.id).all())   # bulk UPDATE, no flush hooks
+    db.session.commit()
+    assert version(shop) == before + 1
+    changed()
+
+
+def test_signed_in_views_are_private_and_cached_apart(client, shop):
+    guest = client.get('/u/ash')
+    owner = login(client, shop).get('/u/ash')
+    assert owner.headers['Cache-Control'] == 'private, no-cache'
+    assert owner.headers['ETag'] != guest.headers['ETag']
+    assert 'Cookie' in owner.headers['Vary']
+
+
+def test_inventory_api_revalidates(client, shop):
+    first = client.get('/api/inventory/ash')
+    assert [card['card_name'] for card in first.get_json()] == ['Pikachu']
+    assert client.get('/api/inventory/ash', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    add_card(shop, 'Mew')
+    fresh = client.get('/api/inventory/ash', headers={'If-None-Match': first.headers['ETag']})
+    assert fresh.status_code == 200
+    assert [card['card_name'] for card in fresh.get_json()] == ['Pikachu', 'Mew']
@@ -0,0 +1,83 @@
+import pytest
+from sqlalchemy import event
+
+from app import db, Card, CardReference, trade_search
+from conftest import add_card, add_references, make_user
+
+
+@pytest.fixture
+def traders(app_ctx):
+    ash, misty = make_user('ash'), make_user('misty')
+    add_references(('base1-58', 'Pikachu', 'Base', '58'))
+    db.session.execute(db.update(CardReference).values(prices='{"normal":{"market":2.5},"holofoil":{"market":9.0}}'))
+    db.session.commit()
+    cards = {
+        'pikachu': add_card(ash, 'Pikachu', price=3.0, quantity=2, reference_id='base1-58'),
+        'pichu': add_card(ash, 'Pichu', price=1.0, set_name='Neo Genesis'),
+        'raichu': add_card(ash, 'Raichu', price=4.0, set_name='Pikachu World Collection'),
+        'sold': add_card(ash, 'Pikachu', price=8.0, quantity=0),
+        'starmie': add_card(misty, 'Starmie', price=6.0),
+        'staryu': add_card(misty, 'Staryu', price=0.5, quantity=3),
+    }
+    return ash, misty, {name: card.id for name, card in cards.items()}
+
+
+def test_search_prefix_first_then_substring_within_one_trader(traders):
+    ash, misty, ids = traders
+    assert [c.id for c in trade_search(ash.id, 'pi')] == [ids['pichu'], ids['pikachu'], ids['raichu']]
+    assert [c.id for c in trade_search(ash.id, 'pi', limit=1)] == [ids['pichu']]
+    assert [c.id for c in trade_search(misty.id, 'star')] == [ids['starmie'], ids['staryu']]
+    assert trade_search(misty.id, 'pika') == []
+    assert trade_search(ash.id, '  ') == []
+
+
+def post(client, **payload):
+    return client.post('/api/trade', json=payload)
+
+
+def test_trade_table_keeps_both_sides_server_side(client, traders):
+    ash, misty, ids = traders
+    post(client, action='trader', side='a', username='Ash')
+    post(client, action='trader', side='b', username='misty')
+    assert post(client, action='trader', side='b', username='brock').status_code == 404
+
+    names = [c['name'] for c in client.get('/api/trade/search?side=a&q=pi').get_json()]
+    assert names == ['Pichu', 'Pikachu', 'Raichu']
+    assert client.get('/api/trade/search?side=c&q=pi').get_json() == []
+
+    for _ in range(2):
+        post(client, action='add', side='a', card_id=ids['pikachu'])
+    assert post(client, action='add', side='a', card_id=ids['pikachu']).status_code == 409
+    assert post(client, action='add', side='a', card_id=ids['starmie']).status_code == 400
+    post(client, action='add', side='b', card_id=ids['starmie'])
+    post(client, action='add', side='b', card_id=ids['staryu'])
+    post(client, action='add', side='b', card_id=ids['staryu'])
+    data = post(client, action='remove', side='b', card_id=ids['staryu']).get_json()
+
+    assert [(line['name'], line['qty']) for line in data['a']['lines']] == [('Pikachu', 2)]
+    assert (data['a']['total'], data['a']['market_total']) == (6.0, 5.0)   # market from the cached reference price
+    assert (data['b']['total'], data['b']['market_total']) == (6.5, 6.5)   # unlinked cards fall back to asking
+    assert (data['diff'], data['market_diff']) == (-0.5, -1.5)
+
+    data = post(client, action='clear').get_json()
+    assert data['a']['lines'] == [] and data['b']['user'] == 'misty'
+
+
+def test_valuation_drops_cards_sold_since_they_were_added(client, traders):
+    ash, misty, ids = traders
+    post(client, action='trader', side='a', username='ash')
+    post(client, action='add', side='a', card_id=ids['pikachu'])
+    post(client, action='add', side='a', card_id=ids['pichu'])
+    db.session.get(Card, ids['pichu']).quantity = 0
+    db.session.commit()
+
+    statements = []
+    listener = lambda conn, cursor, sql, *rest: statements.append(sql)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    try:
+        data = client.get('/trade').get_data(as_text=True)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', listener)
+    assert 'Pikachu' in data and 'Pichu' not in data
+    assert len([s for s in statements if 'FROM card LEFT OUTER JOIN card_reference' in s]) == 1
+    assert 'Starmie' not in data   # the page never embeds a whole inventory
@@ -0,0 +1,125 @@
+import random
+
+import pytest
+
+import app as inventory_app
+from app import db, Card, MasterTracker, TradeSlot, TRADE_INDEX_BUILT, rebuild_trade_slots, trade_index_built, \
+    trade_matches
+from conftest import add_card, add_references, make_user
+
+MEW_REFS = [('base-1', 'Mew'), ('jungle-2', 'Mew ex'), ('neo-3', 'Mew & Mewtwo GX')]
+
+
+@pytest.fixture
+def catalog(app_ctx):
+    add_references(*MEW_REFS, ('base-4', 'Mewtwo'), ('base-5', 'Pikachu'), ('base-6', 'Meowth'))
+    db.session.add_all([MasterTracker(species_name='Mew'), MasterTracker(species_name='Meowth')])
+    db.session.commit()
+    rebuild_trade_slots()
+    db.session.commit()
+
+
+def slots(user=None):
+    query = TradeSlot.query.filter(TradeSlot.user_id != TRADE_INDEX_BUILT['user_id'])
+    if user is not None:
+        query = query.filter_by(user_id=user.id)
+    return sorted((s.user_id, s.side, s.reference_id, s.finish_code) for s in query)
+
+
+def assert_matches_rebuild():
+    incremental = slots()
+    rebuild_trade_slots()
+    db.session.commit()
+    assert incremental == slots()
+
+
+def test_only_collectors_want_slots(catalog):
+    ash, misty = make_user('ash'), make_user('misty')
+    add_card(ash, 'Mew', reference_id='base-1', finish='Holofoil')
+    add_card(misty, 'Pikachu', reference_id='base-5')
+    wanted = {ref for _, side, ref, _ in slots(ash) if side == 'want'}
+    assert wanted == {'base-1', 'jungle-2', 'neo-3'}   # Normal base-1 is still missing
+    assert [side for _, side, _, _ in slots(misty)] == ['have']
+    assert_matches_rebuild()
+
+
+def test_first_and_last_card_of_a_species_flip_the_wants(catalog):
+    ash = make_user('ash')
+    card = add_card(ash, 'Mew ex', reference_id='jungle-2', finish='Holofoil')
+    assert len([s for s in slots(ash) if s[1] == 'want']) == 5
+    assert_matches_rebuild()
+
+    db.session.delete(card)
+    db.session.commit()
+    assert slots(ash) == []
+    assert_matches_rebuild()
+
+
+def test_tag_team_references_follow_every_tracked_species(catalog):
+    db.session.add(MasterTracker(species_name='Mewtwo'))
+    db.session.commit()
+    rebuild_trade_slots()
+    ash = make_user('ash')
+    add_card(ash, 'Mewtwo', reference_id='base-4')
+    # Collecting Mewtwo alone makes the shared tag-team card wanted, but not plain Mew cards
+    assert {ref for _, side, ref, _ in slots(ash) if side == 'want'} == {'base-4', 'neo-3'}
+    assert_matches_rebuild()
+
+
+def test_matches_pair_haves_with_wants(catalog):
+    ash, misty = make_user('ash'), make_user('misty')
+    add_card(ash, 'Mew', reference_id='base-1', finish='Holofoil')
+    add_card(misty, 'Mew', reference_id='base-1', finish='Normal', quantity=2)
+    matches = trade_matches(ash.id)
+    assert [(m['username'], m['reference_id'], m['finish']) for m in matches['they_have']] == \
+        [('misty', 'base-1', 'Normal')]
+    assert [(m['username'], m['reference_id'], m['finish']) for m in trade_matches(misty.id)['they_want']] == \
+        [('ash', 'base-1', 'Normal')]
+
+
+def test_random_card_writes_match_a_full_rebuild(catalog):
+    rng = random.Random(16)
+    users = [make_user(f'trainer{i}') for i in range(4)]
+    refs = [ref for ref, _ in MEW_REFS] + ['base-4', 'base-5', 'base-6', None]
+    cards = []
+    for step in range(120):
+        action = rng.random()
+        if action < 0.5 or not cards:
+            ref = rng.choice(refs)
+            cards.append(Card(game='Pokemon', user_id=rng.choice(users).id, card_name='x', set_name='Base',
+                              reference_id=ref, finish=rng.choice(['Normal', 'Holofoil', 'Reverse Holofoil']),
+                              quantity=rng.choice([0, 1, 2])))
+            db.session.add(cards[-1])
+        elif action < 0.7:
+            card = cards.pop(rng.randrange(len(cards)))
+            db.session.delete(card)
+        elif action < 0.85:
+            rng.choice(cards).quantity = rng.choice([0, 1, 3])
+        else:
+            card = rng.choice(cards)
+            card.reference_id, card.finish = rng.choice(refs), rng.choice(['Normal', 'Holofoil'])
+        if step % 7 == 0:
+            db.session.commit()
+    db.session.commit()
+    assert_matches_rebuild()
+
+
+def test_registering_writes_no_slots(catalog, client):
+    response = client.post('/register', data={'username': 'brock', 'password': 'pw', 'confirm_password': 'pw'})
+    assert response.status_code == 302
+    assert slots() == []
+
+
+def test_startup_rebuilds_only_without_the_built_marker(catalog, monkeypatch):
+    assert trade_index_built()
+    calls = []
+    real_rebuild = inventory_app.rebuild_trade_slots
+    monkeypatch.setattr(inventory_app, 'rebuild_trade_slots', lambda *a, **k: calls.append(a) or real_rebuild(*a, **k))
+    inventory_app.run_startup()
+    assert calls == []
+
+    # An empty index is a valid state (no cards yet); only the missing marker means "never built"
+    db.session.execute(TradeSlot.__table__.delete())
+    db.session.commit()
+    inventory_app.run_startup()
+    assert calls == [()] and trade_index_built()